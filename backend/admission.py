@@ -0,0 +1,272 @@
+"""Admission control in front of Bedrock: per-caller token buckets plus a
+global cap on in-flight generations.
+
+A request that needs generation (answer cache hits never do) calls
+admit(principal, client_id) before retrieval and releases the returned
+ticket when generation ends. The principal is who the request verifiably
+comes from: the authenticated user when the API has an authorizer, else
+the source IP. client_id (the session or client id the browser sends) is
+chosen by the caller, so it only ever narrows the principal's limit:
+
+- a verified user has one bucket (CLIENT_RATE_PER_MINUTE, burst
+  CLIENT_BURST);
+- a source IP has a network bucket (NETWORK_RATE_PER_MINUTE, burst
+  NETWORK_BURST), larger because a whole classroom can share one address,
+  and each client id behind it a client bucket. A fresh id per request
+  gets a fresh client bucket, but never more than the network's rate;
+- a lease on one of BEDROCK_MAX_IN_FLIGHT slots, shared by every
+  container, is the only global limit. Leases expire after
+  ADMISSION_LEASE_SECONDS so a crashed container cannot hold a slot
+  forever. (There is no per-origin bucket: the app is served from one
+  origin, so it would be a single rate shared by every student.)
+
+When a token or slot frees up within ADMISSION_QUEUE_SECONDS the request
+waits for it (at most ADMISSION_MAX_WAITERS per process); otherwise it is
+refused with AdmissionDenied, which the handler turns into a 429 with
+Retry-After. Bursts therefore queue briefly and the excess is shed,
+instead of every request reaching invoke_model and being throttled.
+
+Background work (jobs) calls lease_slots() for each Bedrock call instead:
+it takes no tokens, waits as long as the job allows, and does not count
+against ADMISSION_MAX_WAITERS, so it respects the in-flight cap without
+crowding out interactive waiters.
+
+State lives in open_store(ADMISSION_BACKEND): memory for a single process,
+sqlite or dynamodb to share it between processes and containers.
+"""
+import math
+import os
+import random
+import threading
+import time
+import uuid
+
+from stores import open_store
+
+# ========== CONFIGURATION ==========
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_BACKEND = os.environ.get("ADMISSION_BACKEND", "memory")
+CLIENT_RATE_PER_MINUTE = float(os.environ.get("CLIENT_RATE_PER_MINUTE", "10"))
+CLIENT_BURST = float(os.environ.get("CLIENT_BURST", "5"))
+NETWORK_RATE_PER_MINUTE = float(os.environ.get("NETWORK_RATE_PER_MINUTE", "60"))
+NETWORK_BURST = float(os.environ.get("NETWORK_BURST", "20"))
+BEDROCK_MAX_IN_FLIGHT = int(os.environ.get("BEDROCK_MAX_IN_FLIGHT", "10"))
+ADMISSION_QUEUE_SECONDS = float(os.environ.get("ADMISSION_QUEUE_SECONDS", "3"))
+ADMISSION_MAX_WAITERS = int(os.environ.get("ADMISSION_MAX_WAITERS", "16"))
+ADMISSION_LEASE_SECONDS = float(os.environ.get("ADMISSION_LEASE_SECONDS", "90"))
+# Retry-After for a full slot table: roughly one generation
+CAPACITY_RETRY_SECONDS = 3.0
+POLL_SECONDS = 0.1
+
+_store = None
+_store_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_waiters = 0
+_stats = {"admitted": 0, "queued": 0, "denied": 0}
+
+
+class AdmissionDenied(Exception):
+    """The request was refused; retry_after is in seconds"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Too many requests ({reason}), retry in {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                # No in-process tier: counters must never be read stale
+                _store = open_store(ADMISSION_BACKEND, "admission", local_cache=False)
+    return _store
+
+
+# ========== TOKEN BUCKETS ==========
+def _take_token(key, rate_per_minute, burst, cost=1.0):
+    """Take cost tokens from a bucket; returns seconds until they would be available (0 when taken)"""
+    rate = rate_per_minute / 60.0
+
+    def take(state):
+        now = time.time()
+        state = state or {"tokens": burst, "at": now}
+        tokens = min(burst, state["tokens"] + (now - state["at"]) * rate)
+        if tokens >= cost:
+            return {"tokens": tokens - cost, "at": now}, 0.0
+        return {"tokens": tokens, "at": now}, (cost - tokens) / rate if rate else math.inf
+
+    # An idle bucket is full again after burst / rate seconds; let it expire then
+    ttl = burst / rate + 60 if rate else 3600
+    return _get_store().update(key, take, ttl)
+
+
+def _refund_token(key, burst, cost=1.0):
+    def refund(state):
+        state = state or {"tokens": burst, "at": time.time()}
+        return {"tokens": min(burst, state["tokens"] + cost), "at": state["at"]}, None
+
+    _get_store().update(key, refund, ADMISSION_LEASE_SECONDS)
+
+
+# ========== IN-FLIGHT SLOTS ==========
+def _take_slots(lease_id, slots):
+    """Lease slots of the global in-flight cap; returns 0 when leased, else the poll interval"""
+
+    def take(state):
+        now = time.time()
+        leases = {k: v for k, v in ((state or {}).get("leases") or {}).items() if v["expires_at"] > now}
+        in_use = sum(v["slots"] for v in leases.values())
+        if in_use + slots <= BEDROCK_MAX_IN_FLIGHT or not leases:
+            leases[lease_id] = {"slots": slots, "expires_at": now + ADMISSION_LEASE_SECONDS}
+            return {"leases": leases}, 0.0
+        # When a slot frees is unknown, so waiters poll
+        return {"leases": leases}, POLL_SECONDS
+
+    return _get_store().update("inflight", take, ADMISSION_LEASE_SECONDS)
+
+
+def _release_slots(lease_id):
+    def release(state):
+        leases = dict((state or {}).get("leases") or {})
+        leases.pop(lease_id, None)
+        return {"leases": leases}, None
+
+    _get_store().update("inflight", release, ADMISSION_LEASE_SECONDS)
+
+
+# ========== ADMISSION ==========
+class Ticket:
+    """An admitted request; release() exactly once when its Bedrock calls are done"""
+
+    def __init__(self, lease_id, waited_ms):
+        self.lease_id = lease_id
+        self.waited_ms = waited_ms
+        self._released = lease_id is None
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            _release_slots(self.lease_id)
+        except Exception as e:
+            print(f"⚠️ Admission release failed (lease expires on its own): {str(e)}")
+
+    def summary(self):
+        return {"waited_ms": self.waited_ms}
+
+
+def _wait_for(acquire, deadline):
+    """Call acquire() until it returns 0 or the wait it asks for would pass the deadline"""
+    global _waiters
+    wait = acquire()
+    if wait <= 0:
+        return 0.0
+    if time.monotonic() + wait > deadline:
+        return wait
+    with _stats_lock:
+        if _waiters >= ADMISSION_MAX_WAITERS:
+            return wait
+        _waiters += 1
+        _stats["queued"] += 1
+    try:
+        while wait > 0 and time.monotonic() + wait <= deadline:
+            # Jittered so a burst of waiters does not retry in lockstep
+            time.sleep(min(wait * random.uniform(1.0, 1.2), max(0.0, deadline - time.monotonic())))
+            wait = acquire()
+    finally:
+        with _stats_lock:
+            _waiters -= 1
+    return max(wait, 0.0)
+
+
+def _count(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def _buckets(principal, client_id):
+    """(key, rate per minute, burst) of each bucket a request takes tokens from"""
+    if principal.startswith("user:"):
+        return [(f"client:{principal}", CLIENT_RATE_PER_MINUTE, CLIENT_BURST)]
+    return [
+        (f"network:{principal}", NETWORK_RATE_PER_MINUTE, NETWORK_BURST),
+        (f"client:{principal}:{client_id or ''}", CLIENT_RATE_PER_MINUTE, CLIENT_BURST),
+    ]
+
+
+def admit(principal, client_id=None, cost=1, slots=1):
+    """Admit one request (cost tokens, slots in-flight calls) or raise AdmissionDenied.
+
+    slots=0 meters the caller's rate only, for work whose Bedrock calls
+    lease their slots later (jobs, through lease_slots).
+    """
+    if not ADMISSION_ENABLED:
+        return Ticket(None, 0)
+    started = time.monotonic()
+    deadline = started + ADMISSION_QUEUE_SECONDS
+    taken = []
+
+    def refund():
+        for key, burst, bucket_cost in taken:
+            _refund_token(key, burst, bucket_cost)
+
+    try:
+        for key, rate, burst in _buckets(principal, client_id):
+            bucket_cost = min(cost, burst)
+            wait = _wait_for(lambda: _take_token(key, rate, burst, bucket_cost), deadline)
+            if wait:
+                refund()
+                _count("denied")
+                raise AdmissionDenied(f"{key.split(':', 1)[0]}_rate", wait)
+            taken.append((key, burst, bucket_cost))
+        lease_id = uuid.uuid4().hex if slots else None
+        wait = _wait_for(lambda: _take_slots(lease_id, min(slots, BEDROCK_MAX_IN_FLIGHT)), deadline) if slots else 0
+        if wait:
+            # Refused for capacity, not for this caller's rate: give the tokens back
+            refund()
+            _count("denied")
+            raise AdmissionDenied("capacity", CAPACITY_RETRY_SECONDS)
+    except AdmissionDenied:
+        raise
+    except Exception as e:
+        # A broken admission store must not take the service down with it
+        print(f"⚠️ Admission store unavailable, admitting: {str(e)}")
+        return Ticket(None, int((time.monotonic() - started) * 1000))
+
+    _count("admitted")
+    return Ticket(lease_id, int((time.monotonic() - started) * 1000))
+
+
+def lease_slots(slots=1, wait_seconds=ADMISSION_QUEUE_SECONDS, poll_seconds=POLL_SECONDS):
+    """Lease in-flight slots for background work, waiting up to wait_seconds, or raise AdmissionDenied"""
+    if not ADMISSION_ENABLED:
+        return Ticket(None, 0)
+    started = time.monotonic()
+    deadline = started + wait_seconds
+    lease_id = uuid.uuid4().hex
+    try:
+        while True:
+            wait = _take_slots(lease_id, min(slots, BEDROCK_MAX_IN_FLIGHT))
+            if wait <= 0:
+                break
+            if time.monotonic() + wait > deadline:
+                _count("denied")
+                raise AdmissionDenied("capacity", CAPACITY_RETRY_SECONDS)
+            time.sleep(max(wait, poll_seconds) * random.uniform(1.0, 1.2))
+    except AdmissionDenied:
+        raise
+    except Exception as e:
+        print(f"⚠️ Admission store unavailable, admitting: {str(e)}")
+        return Ticket(None, int((time.monotonic() - started) * 1000))
+
+    _count("admitted")
+    return Ticket(lease_id, int((time.monotonic() - started) * 1000))
+
+
+def admission_stats():
+    """Admitted, queued and denied counts in this container"""
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,194 @@
+"""Semantic cache of final answers for near-duplicate questions.
+
+Questions are reduced to a 64-bit SimHash of their content words and
+character trigrams, so rewordings such as "what is photosynthesis" and
+"photosynthesis, what is it?" land within a few bits of each other.
+Lookups use banded locality-sensitive hashing: with one band more than the
+allowed Hamming distance, any signature inside the threshold is guaranteed
+to share at least one band with the query, so recall is exact while only a
+handful of candidates are compared.
+
+SimHash is blind to what matters most in a math question: "12*12" and
+"12+12", or the same word problem with 30 and 60 apples, land within the
+threshold. So a cached answer is only served when the question's numbers
+and operators (exact_terms) are the same, in the same order.
+"""
+import hashlib
+import os
+import threading
+import time
+
+from search_cache import is_math_symbol, normalize_query
+from stores import open_store
+
+# ========== CONFIGURATION ==========
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_BACKEND = os.environ.get("ANSWER_CACHE_BACKEND", "memory")
+ANSWER_CACHE_TTL_SECONDS = int(os.environ.get("ANSWER_CACHE_TTL_SECONDS", "21600"))
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", "0.9"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "2048"))
+BUCKET_LIMIT = 32
+
+SIGNATURE_BITS = 64
+
+STOP_WORDS = frozenset([
+    # English
+    "a", "an", "the", "is", "are", "was", "were", "be", "of", "to", "in", "on",
+    "for", "and", "or", "it", "its", "this", "that", "what", "whats", "how",
+    "why", "me", "my", "you", "your", "can", "could", "please", "explain",
+    "tell", "about", "do", "does", "i", "simple", "terms", "steps", "step",
+    # Spanish
+    "el", "la", "los", "las", "un", "una", "de", "del", "que", "qué", "es",
+    "son", "en", "y", "o", "por", "para", "como", "cómo", "me", "explica",
+    "dime", "sobre",
+])
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                # Each answer uses one entry key plus one bucket key per band
+                _store = open_store(
+                    ANSWER_CACHE_BACKEND,
+                    "answer_cache",
+                    max_entries=ANSWER_CACHE_MAX_ENTRIES * 8,
+                )
+    return _store
+
+
+# ========== SIGNATURES ==========
+def _features(question):
+    words = [w for w in normalize_query(question).split() if w not in STOP_WORDS]
+    features = {}
+    for word in words:
+        features[word] = features.get(word, 0) + 3
+        padded = f"_{word}_"
+        for i in range(len(padded) - 2):
+            gram = padded[i:i + 3]
+            features[gram] = features.get(gram, 0) + 1
+    return features
+
+
+def exact_terms(question):
+    """The numbers, math symbols and terms with digits in a question, in order; these must match exactly"""
+    terms = [
+        token for token in normalize_query(question).split()
+        if is_math_symbol(token) or any(ch.isdigit() for ch in token)
+    ]
+    # Brackets alone are prose ("photosynthesis (in plants)"), not math
+    return terms if any(term not in "()" for term in terms) else []
+
+
+def simhash(question):
+    """64-bit SimHash of a question's content words and their trigrams"""
+    totals = [0] * SIGNATURE_BITS
+    for feature, weight in _features(question).items():
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(SIGNATURE_BITS):
+            totals[bit] += weight if (h >> bit) & 1 else -weight
+    signature = 0
+    for bit, total in enumerate(totals):
+        if total > 0:
+            signature |= 1 << bit
+    return signature
+
+
+def similarity(a, b):
+    """Fraction of matching signature bits"""
+    return 1.0 - bin(a ^ b).count("1") / SIGNATURE_BITS
+
+
+def _bands(signature, threshold):
+    max_distance = int((1.0 - threshold) * SIGNATURE_BITS)
+    n_bands = max_distance + 1
+    width = SIGNATURE_BITS // n_bands
+    mask = (1 << width) - 1
+    return [(i, (signature >> (i * width)) & mask) for i in range(n_bands)]
+
+
+# ========== LOOKUP / STORE ==========
+def lookup_answer(question, language):
+    """Return the closest cached answer within the similarity threshold, or None"""
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    threshold = ANSWER_CACHE_SIMILARITY
+    signature = simhash(question)
+    if not signature:
+        return None
+
+    terms = exact_terms(question)
+    store = _get_store()
+    candidates = set()
+    try:
+        for band, value in _bands(signature, threshold):
+            candidates.update(store.get(f"band:{language}:{band}:{value}") or [])
+
+        best, best_score = None, threshold
+        for candidate in candidates:
+            score = similarity(signature, int(candidate, 16))
+            if score < best_score:
+                continue
+            entry = store.get(f"entry:{language}:{candidate}")
+            if entry is None or entry.get("exact_terms", []) != terms:
+                continue
+            if best is None or score > best_score:
+                best, best_score = entry, score
+    except Exception as e:
+        print(f"⚠️ Answer cache read failed: {str(e)}")
+        return None
+
+    if best is None:
+        return None
+    return {**best, "similarity": round(best_score, 3), "age_s": int(time.time() - best["created_at"])}
+
+
+def answer_expires_at(question, language):
+    """Expiry time of the answer stored for exactly this question, or None"""
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    signature = simhash(question)
+    if not signature:
+        return None
+    try:
+        entry = _get_store().get_entry(f"entry:{language}:{signature:016x}")
+    except Exception as e:
+        print(f"⚠️ Answer cache read failed: {str(e)}")
+        return None
+    if not entry or entry[0].get("exact_terms", []) != exact_terms(question):
+        return None
+    return entry[1]
+
+
+def store_answer(question, language, answer, sources, model_id, ttl=None):
+    """Remember a generated answer for future near-duplicate questions"""
+    if not ANSWER_CACHE_ENABLED or not answer:
+        return
+    ttl = ANSWER_CACHE_TTL_SECONDS if ttl is None else ttl
+    signature = simhash(question)
+    if not signature:
+        return
+
+    sig_hex = f"{signature:016x}"
+    store = _get_store()
+    try:
+        store.put(f"entry:{language}:{sig_hex}", {
+            "question": question,
+            "exact_terms": exact_terms(question),
+            "language": language,
+            "answer": answer,
+            "sources": sources,
+            "model_used": model_id,
+            "created_at": time.time(),
+        }, ttl)
+        for band, value in _bands(signature, ANSWER_CACHE_SIMILARITY):
+            key = f"band:{language}:{band}:{value}"
+            bucket = [s for s in (store.get(key) or []) if s != sig_hex]
+            bucket.append(sig_hex)
+            store.put(key, bucket[-BUCKET_LIMIT:], ttl)
+    except Exception as e:
+        print(f"⚠️ Answer cache write failed: {str(e)}")
@@ -0,0 +1,283 @@
+"""Long-lived asyncio HTTP server around handle_event, for running on our own hosts.
+
+    SERVER_WORKERS=4 SERVER_THREADS=128 python async_server.py
+
+Unlike local_server.py, which has one thread per connection and no shutdown:
+
+- each worker process runs one event loop that owns every client socket, so
+  idle keep-alive connections, slow uploads and SSE writes to slow readers
+  cost no thread;
+- handle_event runs unchanged (request parsing, CORS, caches, retrieval,
+  Bedrock) on a bounded pool of SERVER_THREADS threads, and each frame of
+  a stream is pulled from it there. Upstream calls share the process's
+  keep-alive pools and Bedrock clients, which stay warm for its whole life.
+  Requests beyond the pool queue instead of starting threads;
+- SERVER_WORKERS processes accept on one listening socket, so the CPU-bound
+  stages (JSON, SimHash, context assembly) use more than one core; a worker
+  that dies is replaced;
+- SIGTERM or SIGINT stops accepting and closes idle connections. Requests
+  and streams already running get up to SHUTDOWN_GRACE_SECONDS to finish,
+  and GET /healthz answers 503 meanwhile so load balancers move away.
+
+Within a worker, SINGLEFLIGHT_WORKERS caps concurrent generations and
+RETRIEVAL_WORKERS concurrent searches; raise them along with SERVER_THREADS.
+Workers share nothing in memory: set ANSWER_CACHE_BACKEND,
+SEARCH_CACHE_BACKEND, SESSION_BACKEND, ADMISSION_BACKEND,
+SINGLEFLIGHT_BACKEND and JOBS_BACKEND to sqlite (one host) or dynamodb to
+share state; a job is polled through whichever worker the client reaches.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import signal
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from images import MAX_BODY_CHARS
+from lambda_handler import get_cors_headers, handle_event
+from local_server import HOST, PORT, REQUEST_TIMEOUT_SECONDS, RequestContext, build_event
+from response_encoding import StreamEncoder, encode_body, encoding_headers, negotiate_encoding
+
+# ========== CONFIGURATION ==========
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", "1"))
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", "128"))
+SERVER_BACKLOG = int(os.environ.get("SERVER_BACKLOG", "1024"))
+HEADER_TIMEOUT_SECONDS = float(os.environ.get("HEADER_TIMEOUT_SECONDS", "10"))
+KEEPALIVE_TIMEOUT_SECONDS = float(os.environ.get("KEEPALIVE_TIMEOUT_SECONDS", "15"))
+SHUTDOWN_GRACE_SECONDS = float(os.environ.get("SHUTDOWN_GRACE_SECONDS", "30"))
+MAX_HEADER_BYTES = 16 * 1024
+
+HEALTH_PATH = "/healthz"
+
+
+class _BadRequest(Exception):
+    pass
+
+
+def _head(status_code, headers, keep_alive):
+    try:
+        phrase = HTTPStatus(status_code).phrase
+    except ValueError:
+        phrase = ""
+    lines = [f"HTTP/1.1 {status_code} {phrase}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1", "replace")
+
+
+# ========== SERVER ==========
+class StudyBuddyServer:
+    """One worker's event loop, request pool and shutdown state"""
+
+    def __init__(self, threads=SERVER_THREADS):
+        self.threads = threads
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="request")
+        self.active = 0
+        self.draining = False
+        self._idle = set()
+        self._connections = set()
+        self._drained = None
+
+    async def _run(self, ctx, fn, *args):
+        """fn(*args) on the request pool, inside the request's own context.
+
+        The trace handle_event starts lives in a context variable, so every
+        call for one request (the handler, then each stream frame) must
+        share its context even though they run on different pool threads.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.pool, ctx.run, fn, *args)
+
+    async def handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            keep_alive = True
+            while keep_alive and not self.draining:
+                self._idle.add(task)
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT_SECONDS)
+                finally:
+                    self._idle.discard(task)
+                keep_alive = await self._respond(reader, writer, head)
+        except _BadRequest as e:
+            writer.write(_head(400, {"Content-Type": "text/plain", "Content-Length": str(len(str(e)))}, False) + str(e).encode())
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, asyncio.CancelledError):
+                pass
+
+    async def _respond(self, reader, writer, head):
+        """Answer one request; returns whether the connection stays open"""
+        try:
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            method, target, version = request_line.split(" ", 2)
+            headers = dict(line.split(":", 1) for line in header_lines if line)
+        except ValueError:
+            raise _BadRequest("Malformed request")
+        headers = {name.strip().lower(): value.strip() for name, value in headers.items()}
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+        if target.split("?", 1)[0] == HEALTH_PATH:
+            status_code = 503 if self.draining else 200
+            payload = json.dumps({"status": "draining" if self.draining else "ok", "active": self.active}).encode()
+            writer.write(_head(status_code, {"Content-Type": "application/json", "Content-Length": str(len(payload))}, keep_alive) + payload)
+            await writer.drain()
+            return keep_alive
+
+        length = int(headers.get("content-length") or 0) if headers.get("content-length", "0").isdigit() else -1
+        if length < 0 or "chunked" in headers.get("transfer-encoding", "").lower():
+            writer.write(_head(411, {"Content-Length": "0"}, False))
+            await writer.drain()
+            return False
+        if length > MAX_BODY_CHARS:
+            # Refused from Content-Length alone, before the body is read
+            payload = b'{"error": "Request body too large"}'
+            cors_headers = get_cors_headers({"headers": {"origin": headers.get("origin", "")}})
+            writer.write(_head(413, {**cors_headers, "Content-Type": "application/json", "Content-Length": str(len(payload))}, False) + payload)
+            await writer.drain()
+            return False
+        body = await asyncio.wait_for(reader.readexactly(length), HEADER_TIMEOUT_SECONDS) if length else b""
+
+        peer = writer.get_extra_info("peername")
+        event = build_event(method, target, headers, body.decode("utf-8", "replace"), peer[0] if peer else None)
+        ctx = contextvars.copy_context()
+        self.active += 1
+        try:
+            status_code, response_headers, chunks = await self._run(ctx, handle_event, event, RequestContext(REQUEST_TIMEOUT_SECONDS))
+            keep_alive = keep_alive and not self.draining
+            streaming = response_headers.get("Content-Type") == "text/event-stream"
+            encoding = negotiate_encoding(headers, stream=streaming)
+            if not streaming:
+                # Compressing a large body is CPU work; keep it off the event loop
+                payload, encoding = await self._run(ctx, encode_body, "".join(chunks), encoding)
+                response_headers = {**encoding_headers(response_headers, encoding), "Content-Length": str(len(payload))}
+                writer.write(_head(status_code, response_headers, keep_alive) + payload)
+                await writer.drain()
+                return keep_alive
+            return await self._stream(ctx, writer, status_code, response_headers, chunks, keep_alive, StreamEncoder(encoding))
+        finally:
+            self.active -= 1
+            if self.draining and self.active == 0 and self._drained is not None:
+                self._drained.set()
+
+    async def _stream(self, ctx, writer, status_code, headers, chunks, keep_alive, encoder):
+        """Write SSE frames as the pool produces them, chunk-encoded (and compressed when negotiated)"""
+        headers = {**encoding_headers(headers, encoder.encoding), "Transfer-Encoding": "chunked"}
+        writer.write(_head(status_code, headers, keep_alive))
+
+        def next_data():
+            # Frame and compress on the pool thread, in the request's context
+            chunk = next(chunks, None)
+            return None if chunk is None else encoder.encode(chunk)
+
+        try:
+            while True:
+                data = await self._run(ctx, next_data)
+                if data is None:
+                    break
+                if data:
+                    writer.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+                    await writer.drain()
+            tail = encoder.finish()
+            writer.write((f"{len(tail):X}\r\n".encode("ascii") + tail + b"\r\n" if tail else b"") + b"0\r\n\r\n")
+            await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            print("⚠️ Client disconnected mid-stream")
+            # Run the generator's cleanup (admission release, trace emit) on the pool
+            await self._run(ctx, chunks.close)
+            return False
+        return keep_alive
+
+    async def serve(self, sock):
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+        server = await asyncio.start_server(self.handle_connection, sock=sock, limit=MAX_HEADER_BYTES)
+        print(f"🚀 Worker {os.getpid()} serving with {self.threads} request threads")
+        await stop.wait()
+
+        # Graceful shutdown: no new connections, idle ones closed, running requests finish
+        print(f"🛑 Worker {os.getpid()} draining {self.active} requests")
+        self.draining = True
+        server.close()
+        for task in list(self._idle):
+            task.cancel()
+        if self.active:
+            self._drained = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._drained.wait(), SHUTDOWN_GRACE_SECONDS)
+            except asyncio.TimeoutError:
+                print(f"⚠️ Worker {os.getpid()} stopped with {self.active} requests unfinished")
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+# ========== PROCESSES ==========
+def _run_worker(sock):
+    asyncio.run(StudyBuddyServer().serve(sock))
+
+
+def _fork_worker(sock):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _run_worker(sock)
+        except BaseException as e:
+            print(f"❌ Worker {os.getpid()} crashed: {str(e)}")
+            code = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(code)
+    return pid
+
+
+def main():
+    sock = socket.create_server((HOST, PORT), backlog=SERVER_BACKLOG)
+    print(f"🚀 Smart Study Buddy listening on http://{HOST}:{PORT} ({SERVER_WORKERS} workers)")
+    if SERVER_WORKERS <= 1:
+        _run_worker(sock)
+        return
+
+    # Workers are forked after the imports above, so they start warm and share those pages
+    workers = {_fork_worker(sock) for _ in range(SERVER_WORKERS)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        workers.discard(pid)
+        if not stopping:
+            print(f"⚠️ Worker {pid} exited ({status}), starting a replacement")
+            workers.add(_fork_worker(sock))
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Helpers for answering a worksheet of questions in one request.
+
+The pipeline stages themselves live in lambda_handler; this module only
+plans the batch (dedupe, grouping of related questions that can share one
+retrieval) and runs work with bounded parallelism under a deadline.
+"""
+import os
+
+from answer_cache import simhash, similarity
+from search_cache import exact_key
+from tracing import submit_with_context
+
+# ========== CONFIGURATION ==========
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "30"))
+BATCH_RETRIEVAL_CONCURRENCY = int(os.environ.get("BATCH_RETRIEVAL_CONCURRENCY", "8"))
+BATCH_BEDROCK_CONCURRENCY = int(os.environ.get("BATCH_BEDROCK_CONCURRENCY", "4"))
+BATCH_SHARE_SIMILARITY = float(os.environ.get("BATCH_SHARE_SIMILARITY", "0.8"))
+BATCH_MAX_SECONDS = float(os.environ.get("BATCH_MAX_SECONDS", "60"))
+BATCH_RESPONSE_RESERVE_SECONDS = 2.0
+
+
+class DeadlineExceeded(Exception):
+    """The batch ran out of time before this item finished"""
+
+
+# ========== PLANNING ==========
+def dedupe_questions(questions):
+    """Map each (question, language) pair to a unique unit.
+
+    Returns (units, unit_of) where units is a list of (question, language)
+    and unit_of[i] is the unit index answering questions[i].
+    """
+    units, unit_of, seen = [], [], {}
+    for question, language in questions:
+        # Exact up to case and spacing: "7+3" and "7-3" on one worksheet are different questions
+        key = (exact_key(question), language)
+        if key not in seen:
+            seen[key] = len(units)
+            units.append((question, language))
+        unit_of.append(seen[key])
+    return units, unit_of
+
+
+def group_related(units, threshold=BATCH_SHARE_SIMILARITY):
+    """Group units similar enough to share one retrieval; the first member leads"""
+    groups = []
+    for index, (question, language) in enumerate(units):
+        signature = simhash(question)
+        for group in groups:
+            if group["language"] == language and similarity(group["signature"], signature) >= threshold:
+                group["members"].append(index)
+                break
+        else:
+            groups.append({"signature": signature, "language": language, "members": [index]})
+    return [group["members"] for group in groups]
+
+
+def batch_deadline(context):
+    """Seconds the whole batch may run before we must respond"""
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return BATCH_MAX_SECONDS
+    return max(1.0, context.get_remaining_time_in_millis() / 1000.0 - BATCH_RESPONSE_RESERVE_SECONDS)
+
+
+# ========== EXECUTION ==========
+def run_bounded(fn, items, max_workers, deadline_s):
+    """Apply fn to every item with at most max_workers in flight.
+
+    Returns a list of (result, error) in item order. Items still running at
+    the deadline get a DeadlineExceeded error and are abandoned.
+    """
+    if not items:
+        return []
+    from concurrent.futures import ThreadPoolExecutor, wait
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))), thread_name_prefix="batch")
+    futures = [submit_with_context(pool, fn, item) for item in items]
+    try:
+        wait(futures, timeout=max(0.0, deadline_s))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    outcomes = []
+    for future in futures:
+        if not future.done() or future.cancelled():
+            outcomes.append((None, DeadlineExceeded("Batch deadline exceeded")))
+            continue
+        try:
+            outcomes.append((future.result(), None))
+        except Exception as e:
+            outcomes.append((None, e))
+    return outcomes
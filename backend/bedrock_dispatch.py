@@ -0,0 +1,278 @@
+"""Bedrock calls spread over several targets, with throttling retries.
+
+A target is one model id or inference profile in one region. Each model the
+router picks can have an ordered list of them:
+
+    BEDROCK_TARGETS='{"us.anthropic.claude-3-5-sonnet-20241022-v2:0": [
+        {"region": "us-east-1"},
+        {"region": "us-west-2"},
+        {"region": "us-east-2", "model_id": "arn:aws:bedrock:us-east-2:123456789012:application-inference-profile/abc"}
+    ]}'
+
+A target's model_id defaults to the key, and it may also set endpoint_url.
+Models without an entry use their own id in each BEDROCK_REGIONS region;
+the default is us-east-1 alone, as before.
+
+dispatch(model_id, call, kind) chooses a target for each attempt:
+
+- the first choice is a weighted draw: faster targets with fewer recent
+  errors get more calls, and each later position in the list counts
+  BEDROCK_ORDER_DECAY times less. Load therefore spreads over healthy
+  targets and drains away from slow or throttled ones. Latency is tracked
+  per call kind, since a stream opens long before a full answer is done;
+- a throttle, 5xx or connection error fails over at once to the next
+  target not yet tried. Once all have been tried, the next round waits a
+  full-jitter backoff (BEDROCK_BACKOFF_BASE_SECONDS, doubling up to
+  BEDROCK_BACKOFF_MAX_SECONDS);
+- a target that cannot serve the model (not enabled in that region, no
+  access) is set aside for BEDROCK_TARGET_DISABLE_SECONDS and not retried.
+  When no other target is left, the error is raised at once: only
+  throttles and server errors are worth waiting for;
+- retries stop after BEDROCK_MAX_ATTEMPTS, or when another attempt would
+  not leave BEDROCK_MIN_ATTEMPT_SECONDS before the invocation's deadline,
+  with BedrockBusy.
+
+Other errors, such as a malformed request, are raised unchanged. The
+target that served each call, with its attempt and retry counts, is
+recorded on the request's trace (served_by()); per-target health is in
+dispatch_stats().
+"""
+import json
+import os
+import random
+import threading
+import time
+
+from resources import get_bedrock_client
+from tracing import current_trace
+
+# ========== CONFIGURATION ==========
+BEDROCK_REGIONS = [
+    region.strip() for region in os.environ.get("BEDROCK_REGIONS", "us-east-1").split(",") if region.strip()
+]
+BEDROCK_MAX_ATTEMPTS = int(os.environ.get("BEDROCK_MAX_ATTEMPTS", "6"))
+BEDROCK_BACKOFF_BASE_SECONDS = float(os.environ.get("BEDROCK_BACKOFF_BASE_SECONDS", "0.25"))
+BEDROCK_BACKOFF_MAX_SECONDS = float(os.environ.get("BEDROCK_BACKOFF_MAX_SECONDS", "4"))
+BEDROCK_MIN_ATTEMPT_SECONDS = float(os.environ.get("BEDROCK_MIN_ATTEMPT_SECONDS", "5"))
+# Retry window when the invocation's own deadline is unknown
+BEDROCK_RETRY_MAX_SECONDS = float(os.environ.get("BEDROCK_RETRY_MAX_SECONDS", "20"))
+BEDROCK_ORDER_DECAY = float(os.environ.get("BEDROCK_ORDER_DECAY", "0.5"))
+BEDROCK_ERROR_PENALTY = float(os.environ.get("BEDROCK_ERROR_PENALTY", "4"))
+BEDROCK_TARGET_DISABLE_SECONDS = float(os.environ.get("BEDROCK_TARGET_DISABLE_SECONDS", "300"))
+EWMA_ALPHA = 0.2
+BUSY_RETRY_SECONDS = 5
+
+# Assumed latency of a target until it has been called
+ASSUMED_LATENCY_S = {"invoke": 5.0, "stream": 1.0}
+
+# Worth retrying, on this target later or on another now
+RETRYABLE_CODES = {
+    "ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException",
+    "ModelNotReadyException", "ModelTimeoutException", "InternalServerException",
+}
+CONNECTION_ERRORS = {"EndpointConnectionError", "ConnectTimeoutError", "ReadTimeoutError", "ConnectionClosedError"}
+# This target cannot serve the model at all
+UNAVAILABLE_CODES = {"AccessDeniedException", "ResourceNotFoundException", "UnrecognizedClientException"}
+
+RETRY, UNAVAILABLE = "retry", "unavailable"
+
+_targets = {}
+_targets_lock = threading.Lock()
+_report_lock = threading.Lock()
+
+
+class BedrockBusy(Exception):
+    """Every attempt was throttled or failed; retry_after is in seconds"""
+
+    def __init__(self, attempts, last_error):
+        super().__init__(f"Bedrock is busy after {attempts} attempts: {str(last_error)}")
+        self.attempts = attempts
+        self.retry_after = BUSY_RETRY_SECONDS
+
+
+# ========== TARGETS ==========
+class Target:
+    """One model id in one region, with its observed health"""
+
+    def __init__(self, model_id, region, endpoint_url=None):
+        self.model_id = model_id
+        self.region = region
+        self.endpoint_url = endpoint_url
+        self.name = f"{region}/{model_id}"
+        self._lock = threading.Lock()
+        self.latency_s = {}
+        self.error_rate = 0.0
+        self.disabled_until = 0.0
+        self.counts = {"calls": 0, "retried": 0, "unavailable": 0}
+
+    def available(self, now):
+        return now >= self.disabled_until
+
+    def score(self, kind, fallback_s):
+        """Expected seconds per call, inflated by the recent error rate; lower is better"""
+        with self._lock:
+            return self.latency_s.get(kind, fallback_s) * (1 + BEDROCK_ERROR_PENALTY * self.error_rate)
+
+    def record_success(self, kind, seconds):
+        with self._lock:
+            self.counts["calls"] += 1
+            previous = self.latency_s.get(kind)
+            self.latency_s[kind] = seconds if previous is None else previous + EWMA_ALPHA * (seconds - previous)
+            self.error_rate *= 1 - EWMA_ALPHA
+
+    def record_failure(self, outcome):
+        with self._lock:
+            self.counts["calls"] += 1
+            self.counts["retried" if outcome == RETRY else "unavailable"] += 1
+            self.error_rate += EWMA_ALPHA * (1 - self.error_rate)
+            if outcome == UNAVAILABLE:
+                self.disabled_until = time.monotonic() + BEDROCK_TARGET_DISABLE_SECONDS
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "latency_ms": {kind: int(s * 1000) for kind, s in self.latency_s.items()},
+                "error_rate": round(self.error_rate, 3),
+                "disabled": not self.available(time.monotonic()),
+                **self.counts,
+            }
+
+
+def _configured_targets():
+    raw = os.environ.get("BEDROCK_TARGETS", "").strip()
+    if not raw:
+        return {}
+    try:
+        return {model_id: list(entries) for model_id, entries in json.loads(raw).items()}
+    except (ValueError, AttributeError, TypeError) as e:
+        print(f"⚠️ Ignoring invalid BEDROCK_TARGETS: {str(e)}")
+        return {}
+
+
+def targets_for(model_id):
+    """The ordered targets that can serve a model"""
+    targets = _targets.get(model_id)
+    if targets is None:
+        with _targets_lock:
+            targets = _targets.get(model_id)
+            if targets is None:
+                entries = _configured_targets().get(model_id) or [{"region": region} for region in BEDROCK_REGIONS]
+                targets = _targets[model_id] = [
+                    Target(entry.get("model_id") or model_id, entry.get("region") or BEDROCK_REGIONS[0], entry.get("endpoint_url"))
+                    for entry in entries
+                ]
+    return targets
+
+
+def _order(targets, kind):
+    """Targets in the order to try them: a weighted draw by health first, then the rest by score"""
+    now = time.monotonic()
+    usable = [t for t in targets if t.available(now)] or targets
+    if len(usable) == 1:
+        return usable
+    sampled = [t.latency_s[kind] for t in usable if kind in t.latency_s]
+    fallback_s = sum(sampled) / len(sampled) if sampled else ASSUMED_LATENCY_S.get(kind, 1.0)
+    scores = {t.name: t.score(kind, fallback_s) for t in usable}
+    weights = [BEDROCK_ORDER_DECAY ** targets.index(t) / max(scores[t.name], 1e-3) for t in usable]
+    first = random.choices(usable, weights)[0]
+    return [first] + sorted((t for t in usable if t is not first), key=lambda t: scores[t.name])
+
+
+# ========== DISPATCH ==========
+def _classify(error):
+    """RETRY, UNAVAILABLE, or None for errors no other attempt would fix"""
+    response = getattr(error, "response", None) or {}
+    code = response.get("Error", {}).get("Code", "")
+    status = response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+    if code in RETRYABLE_CODES or status == 429 or status >= 500 or type(error).__name__ in CONNECTION_ERRORS:
+        return RETRY
+    if code in UNAVAILABLE_CODES or (code == "ValidationException" and "model identifier" in str(error).lower()):
+        return UNAVAILABLE
+    return None
+
+
+def _retry_deadline(started):
+    deadline = started + BEDROCK_RETRY_MAX_SECONDS
+    trace = current_trace()
+    if trace is not None and trace.deadline is not None:
+        deadline = min(deadline, trace.deadline)
+    return deadline
+
+
+def dispatch(model_id, call, kind="invoke"):
+    """Run call(client, target_model_id) on the model's targets; returns its result.
+
+    Throttles and server errors fail over and back off as described above;
+    raises BedrockBusy when no attempt succeeded in time.
+    """
+    targets = targets_for(model_id)
+    started = time.monotonic()
+    deadline = _retry_deadline(started)
+    tried, attempts, retried, rounds, last_error = set(), 0, 0, 0, None
+    while True:
+        order = _order(targets, kind)
+        target = next((t for t in order if t.name not in tried), None)
+        if target is None:
+            # Every target failed this round: back off before trying again the
+            # ones that were throttled or failed, never those that cannot serve
+            now = time.monotonic()
+            order = [t for t in order if t.available(now)]
+            if not order:
+                if not retried:
+                    raise last_error
+                raise BedrockBusy(attempts, last_error) from last_error
+            tried.clear()
+            rounds += 1
+            target = order[0]
+            delay = random.uniform(0, min(BEDROCK_BACKOFF_MAX_SECONDS, BEDROCK_BACKOFF_BASE_SECONDS * 2 ** (rounds - 1)))
+            time.sleep(min(delay, max(0.0, deadline - BEDROCK_MIN_ATTEMPT_SECONDS - time.monotonic())))
+        tried.add(target.name)
+        attempts += 1
+        call_started = time.monotonic()
+        try:
+            result = call(get_bedrock_client(target.region, target.endpoint_url), target.model_id)
+        except Exception as e:
+            outcome = _classify(e)
+            if outcome is None:
+                raise
+            target.record_failure(outcome)
+            last_error = e
+            if outcome == RETRY:
+                retried += 1
+            print(f"⚠️ Bedrock {target.name} {'throttled or failed' if outcome == RETRY else 'unavailable'} (attempt {attempts}): {str(e)}")
+            out_of_time = time.monotonic() + BEDROCK_MIN_ATTEMPT_SECONDS > deadline
+            if attempts >= BEDROCK_MAX_ATTEMPTS or out_of_time:
+                if not retried:
+                    raise
+                raise BedrockBusy(attempts, e) from e
+            continue
+        target.record_success(kind, time.monotonic() - call_started)
+        _report(target, kind, attempts, retried)
+        return result
+
+
+# ========== REPORTING ==========
+def _report(target, kind, attempts, retried):
+    trace = current_trace()
+    if trace is None:
+        return
+    entry = {"target": target.name, "region": target.region, "kind": kind, "attempts": attempts, "retried": retried}
+    with _report_lock:
+        trace.properties.setdefault("bedrock_calls", []).append(entry)
+
+
+def served_by():
+    """Target, attempts and retries of each Bedrock call made so far for this request"""
+    trace = current_trace()
+    if trace is None:
+        return None
+    with _report_lock:
+        calls = trace.properties.get("bedrock_calls")
+        return [dict(call) for call in calls] if calls else None
+
+
+def dispatch_stats():
+    """Observed latency, error rate and call counts per target in this container"""
+    with _targets_lock:
+        targets = [t for model_targets in _targets.values() for t in model_targets]
+    return {t.name: t.snapshot() for t in targets}
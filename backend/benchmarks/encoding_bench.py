@@ -0,0 +1,181 @@
+"""Bytes on the wire and encode CPU for each response encoding option.
+
+    python benchmarks/encoding_bench.py [--delta-words 4] [--repeat 200]
+
+Builds real responses with the handler against the stub upstreams (so the
+metadata, trace and frame sequence are what clients get), with the answer
+and sources swapped for the prose in data/response_sample.json: the stubs'
+few-word vocabulary would compress unrealistically well. For an English
+and a Spanish answer, as a JSON body and as an SSE stream (the answer in
+deltas of --delta-words words, as Bedrock sends them), it reports:
+
+- format: the JSON before dense encoding (json.dumps defaults), dense JSON,
+  and dense JSON with compact sources;
+- encoding: identity, gzip and br (when the brotli package is installed)
+  at a few levels. A JSON body is compressed whole; a stream either frame
+  by frame with a flush after each (local_server.py and async_server.py)
+  or whole (Lambda behind API Gateway, which buffers the stream anyway).
+
+Bytes are the body sent; CPU is the median process time to serialize and
+compress one response, over --repeat runs. Each response is also requested
+with "source_format": "compact", and the run fails unless the handler's
+compact sources match compact_sources of the full ones.
+"""
+import argparse
+import importlib.util
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from contextlib import redirect_stdout
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from load_test import _Context  # noqa: E402
+from response_encoding import StreamEncoder, compact_sources, compress, dumps  # noqa: E402
+from stubs import UpstreamStubs  # noqa: E402
+
+SAMPLE_PATH = os.path.join(BENCH_DIR, "data", "response_sample.json")
+
+FORMATS = {
+    "json.dumps": lambda data: json.dumps(data),
+    "dense": dumps,
+    "dense+compact": dumps,
+}
+LEVELS = {"identity": [None], "gzip": [1, 6, 9], "br": [4, 5, 11]}
+
+
+def capture(handle_event, question, stream, compact=False):
+    """A real response for the question: the JSON body, or the stream's (event, data) pairs"""
+    request = {"prompt": question, "stream": stream}
+    if compact:
+        request["source_format"] = "compact"
+    event = {"body": json.dumps(request)}
+    with redirect_stdout(io.StringIO()):
+        status, _, chunks = handle_event(event, _Context())
+        body = "".join(chunks)
+    if status != 200:
+        raise RuntimeError(f"Request failed: {status} {body[:200]}")
+    if not stream:
+        return json.loads(body)
+    frames = []
+    for raw in body.strip().split("\n\n"):
+        name, data = raw.split("\n", 1)
+        frames.append((name[len("event: "):], json.loads(data[len("data: "):])))
+    return frames
+
+
+def response_sources(response):
+    if isinstance(response, dict):
+        return response["sources"]
+    return next(data for name, data in response if name == "sources")
+
+
+def check_compact(handle_event, question, stream, full):
+    """The handler's own compact response carries compact_sources of the full one"""
+    compacted = response_sources(capture(handle_event, question, stream, compact=True))
+    if compacted != compact_sources(response_sources(full)):
+        raise RuntimeError(f"Compact {'stream' if stream else 'JSON'} sources differ: {compacted[:2]}")
+
+
+def with_sample(response, sample, delta_words):
+    """The captured response with the sample's answer and sources"""
+    if isinstance(response, dict):
+        return {**response, "answer": sample["answer"], "sources": sample["sources"]}
+    words = sample["answer"].split(" ")
+    deltas = [" ".join(words[i:i + delta_words]) + " " for i in range(0, len(words), delta_words)]
+    metadata = next(data for name, data in response if name == "metadata")
+    return [("sources", sample["sources"])] + [("delta", {"text": d}) for d in deltas] + [("metadata", metadata)]
+
+
+def serialize(response, fmt):
+    """The body text, or the list of SSE frames, in one format"""
+    encode = FORMATS[fmt]
+    compact = fmt.endswith("+compact")
+    if isinstance(response, dict):
+        if compact:
+            response = {**response, "sources": compact_sources(response["sources"])}
+        return encode(response)
+    frames = []
+    for name, data in response:
+        if compact and name == "sources":
+            data = compact_sources(data)
+        frames.append(f"event: {name}\ndata: {encode(data)}\n\n")
+    return frames
+
+
+def wire_bytes(response, fmt, encoding, level, per_frame):
+    payload = serialize(response, fmt)
+    if isinstance(payload, list) and per_frame and encoding != "identity":
+        encoder = StreamEncoder(encoding, level)
+        return sum(len(encoder.encode(frame)) for frame in payload) + len(encoder.finish())
+    data = ("".join(payload) if isinstance(payload, list) else payload).encode("utf-8")
+    return len(data) if encoding == "identity" else len(compress(data, encoding, level))
+
+
+def cpu_us(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.process_time_ns()
+        fn()
+        samples.append((time.process_time_ns() - started) / 1000)
+    return statistics.median(samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--delta-words", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    encodings = ["identity", "gzip"]
+    if importlib.util.find_spec("brotli"):
+        encodings.append("br")
+    else:
+        print("⚠️ brotli is not installed: br rows skipped")
+
+    with open(SAMPLE_PATH, encoding="utf-8") as f:
+        samples = json.load(f)
+    stubs = UpstreamStubs({
+        "tavily": "latency=fixed:5", "newsapi": "latency=fixed:5",
+        "bedrock": "latency=fixed:20,output_words=40,chunk_ms=1",
+    }).start()
+    os.environ.update(stubs.environment())
+    os.environ["ANSWER_CACHE_ENABLED"] = "false"
+    # One client sends every request; its rate limit is not what this measures
+    os.environ["ADMISSION_ENABLED"] = "false"
+    from lambda_handler import handle_event
+
+    cases = []
+    try:
+        for language, sample in samples.items():
+            for stream in (False, True):
+                captured = capture(handle_event, sample["question"], stream)
+                check_compact(handle_event, sample["question"], stream, captured)
+                response = with_sample(captured, sample, args.delta_words)
+                modes = [("frames", True), ("whole", False)] if stream else [("body", False)]
+                for mode, per_frame in modes:
+                    cases.append((f"{language} {'sse' if stream else 'json'} {mode}", response, per_frame))
+    finally:
+        stubs.stop()
+
+    print(f"{'response':<18} {'format':<14} {'encoding':<9} {'bytes':>8} {'vs before':>10} {'cpu us':>9}")
+    for label, response, per_frame in cases:
+        baseline = wire_bytes(response, "json.dumps", "identity", None, per_frame)
+        for fmt in FORMATS:
+            for encoding in encodings:
+                for level in LEVELS[encoding]:
+                    size = wire_bytes(response, fmt, encoding, level, per_frame)
+                    cpu = cpu_us(lambda: wire_bytes(response, fmt, encoding, level, per_frame), args.repeat)
+                    name = encoding if level is None else f"{encoding}-{level}"
+                    print(f"{label:<18} {fmt:<14} {name:<9} {size:>8} {size / baseline - 1:>+10.0%} {cpu:>9.0f}")
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
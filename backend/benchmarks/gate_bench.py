@@ -0,0 +1,66 @@
+"""Accuracy and cost of the retrieval gate on a labeled set of questions.
+
+    python benchmarks/gate_bench.py [--corpus benchmarks/data/gate_corpus.jsonl] [--check]
+
+Each row is a question with the decision it should get ("none", "web",
+"news" or "web+news") and, optionally, the providers with credentials
+(all of them by default). The corpus includes questions with ranges,
+dates and model numbers ("1914-1918", "9/11", "737-800") that need
+sources even though they contain digits next to "-" or "/". The local
+knowledge base is left out (no hits), so kb_coverage never applies.
+--check exits non-zero on any wrong decision.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gate import PROVIDERS, WEB_NEWS, decide_retrieval  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gate_corpus.jsonl")
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def decide(row):
+    configured = tuple(row.get("configured", PROVIDERS[WEB_NEWS]))
+    with redirect_stdout(io.StringIO()):
+        return decide_retrieval(row["text"], [], configured=configured)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--check", action="store_true", help="exit 1 on any wrong decision")
+    args = parser.parse_args(argv)
+
+    rows = load_corpus(args.corpus)
+    wrong = []
+    for row in rows:
+        gate = decide(row)
+        if gate["decision"] != row["decision"]:
+            wrong.append((row, gate))
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        for row in rows:
+            decide(row)
+    us_per_decision = (time.perf_counter() - started) * 1e6 / (args.repeat * len(rows))
+
+    print(f"corpus: {len(rows)} labeled questions; correct: {len(rows) - len(wrong)}; {us_per_decision:.1f} µs/decision")
+    for row, gate in wrong:
+        print(f"❌ {row['text']!r}: {gate['decision']} ({', '.join(gate['reasons'])}), expected {row['decision']}")
+    return 1 if args.check and wrong else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
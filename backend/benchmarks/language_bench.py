@@ -0,0 +1,92 @@
+"""Accuracy and throughput of detect_language on a labeled EN/ES corpus.
+
+    python benchmarks/language_bench.py [--corpus benchmarks/data/lang_corpus.jsonl]
+
+Compares the compiled detector with the original substring detector from
+frontend/src/lambde.py, on the short questions in the corpus and on the
+same questions concatenated into long pasted-homework texts.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from language import detect_language, detect_many  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "lang_corpus.jsonl")
+
+_LEGACY_INDICATORS = [
+    'qué', 'cómo', 'cuál', 'cuándo', 'dónde', 'quién', 'por qué',
+    'el', 'la', 'los', 'las', 'un', 'una', 'es', 'son', 'está',
+    'de', 'del', 'para', 'con', 'sin', 'sobre', 'entre',
+    'yo', 'tú', 'él', 'ella', 'nosotros', 'ustedes',
+    'explica', 'explicar', 'dime', 'cuéntame', 'ayuda'
+]
+
+
+def legacy_detect(text):
+    """The original detector: any indicator substring means Spanish"""
+    text_lower = text.lower()
+    return "es" if sum(1 for word in _LEGACY_INDICATORS if word in text_lower) >= 1 else "en"
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def accuracy(detect, rows):
+    correct = {"en": 0, "es": 0}
+    totals = {"en": 0, "es": 0}
+    for row in rows:
+        totals[row["lang"]] += 1
+        if detect(row["text"]) == row["lang"]:
+            correct[row["lang"]] += 1
+    overall = sum(correct.values()) / max(1, sum(totals.values()))
+    per_lang = {lang: correct[lang] / max(1, totals[lang]) for lang in totals}
+    return overall, per_lang
+
+
+def microseconds_per_text(detect, texts, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            detect(text)
+    return (time.perf_counter() - started) * 1e6 / (repeat * len(texts))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    rows = load_corpus(args.corpus)
+    short_texts = [row["text"] for row in rows]
+    long_rows = [
+        {"lang": lang, "text": " ".join(r["text"] for r in rows if r["lang"] == lang) * 20}
+        for lang in ("en", "es")
+    ]
+    long_texts = [row["text"] for row in long_rows]
+
+    print(f"corpus: {len(rows)} labeled texts; long texts: {[len(t) for t in long_texts]} chars")
+    print(f"{'detector':<10} {'accuracy':>9} {'en':>6} {'es':>6} {'long ok':>8} {'µs/short':>9} {'µs/long':>9}")
+    for name, detect in (("legacy", legacy_detect), ("compiled", detect_language)):
+        overall, per_lang = accuracy(detect, rows)
+        long_overall, _ = accuracy(detect, long_rows)
+        short_us = microseconds_per_text(detect, short_texts, args.repeat)
+        long_us = microseconds_per_text(detect, long_texts, max(1, args.repeat // 10))
+        print(
+            f"{name:<10} {overall:>9.1%} {per_lang['en']:>6.0%} {per_lang['es']:>6.0%} "
+            f"{long_overall:>8.0%} {short_us:>9.1f} {long_us:>9.1f}"
+        )
+
+    batch_us = microseconds_per_text(lambda texts: detect_many(texts), [short_texts], args.repeat) / len(short_texts)
+    print(f"detect_many: {batch_us:.1f} µs/text over a batch of {len(short_texts)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""Drive the handler at fixed concurrency against stub upstreams and record the results.
+
+    python benchmarks/load_test.py [--concurrency 8] [--requests 200] [--stream]
+                                   [--bedrock "latency=lognormal:800:0.3"] [--compare OLD.json]
+
+By default the stubs (benchmarks/stubs.py) run in a child process and the
+handler runs in this process, so peak RSS is the handler's own. With
+--target http://host:port the requests go over HTTP to a running server
+instead (local_server.py or anything else speaking the same API).
+
+Each run writes benchmarks/results/<label>-<commit>-<time>.json with the
+configuration, throughput, latency percentiles, time to first token when
+streaming, peak RSS and the per-stage percentiles from the handler's EMF
+lines. --compare prints the change against an earlier results file.
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlsplit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+sys.path.insert(0, BACKEND_DIR)
+
+from tracing import summarize  # noqa: E402
+
+TOPICS = (
+    "photosynthesis", "mitosis", "the French Revolution", "recursion", "Newton's second law",
+    "the water cycle", "supply and demand", "plate tectonics", "the Pythagorean theorem",
+    "DNA replication", "World War I", "binary search", "the immune system", "climate change",
+)
+TEMPLATES = (
+    "What is {topic}?",
+    "Explain {topic} step by step",
+    "Why does {topic} matter and how does it work?",
+    "¿Qué es {topic}?",
+)
+
+
+# ========== WORKLOAD ==========
+def build_questions(count, unique_ratio, seed=7):
+    """Questions for the run; 1 - unique_ratio of them repeat earlier ones (cache hits)"""
+    import random
+
+    rng = random.Random(seed)
+    questions = []
+    for n in range(count):
+        if questions and rng.random() >= unique_ratio:
+            questions.append(rng.choice(questions))
+            continue
+        template, topic = rng.choice(TEMPLATES), rng.choice(TOPICS)
+        questions.append(f"{template.format(topic=topic)} (#{n})")
+    return questions
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def pick(pct):
+        return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+    return {
+        "p50": round(pick(50), 1),
+        "p95": round(pick(95), 1),
+        "p99": round(pick(99), 1),
+        "max": round(ordered[-1], 1),
+        "mean": round(statistics.fmean(ordered), 1),
+    }
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+class _LogSink(io.TextIOBase):
+    """Stands in for stdout during a run: keeps EMF lines, drops the rest"""
+
+    def __init__(self):
+        self.emf_lines = []
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        if '{"_aws"' in text:
+            with self._lock:
+                self.emf_lines.append(text)
+        return len(text)
+
+
+# ========== DRIVERS ==========
+class _Context:
+    def __init__(self, timeout_s=30):
+        self._deadline = time.monotonic() + timeout_s
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+def in_process_request(handle_event, question, stream):
+    """One request through handle_event; returns (status, latency_ms, ttft_ms)"""
+    started = time.perf_counter()
+    event = {
+        "body": json.dumps({"prompt": question, "stream": stream}),
+        "headers": {"origin": "http://localhost:5173"},
+        "requestContext": {"http": {"method": "POST"}},
+    }
+    status, _, chunks = handle_event(event, _Context())
+    ttft_ms = None
+    for chunk in chunks:
+        if ttft_ms is None and chunk.startswith("event: delta"):
+            ttft_ms = (time.perf_counter() - started) * 1000
+    return status, (time.perf_counter() - started) * 1000, ttft_ms
+
+
+def http_request(target, question, stream):
+    """One request over HTTP; returns (status, latency_ms, ttft_ms)"""
+    url = urlsplit(target)
+    conn_cls = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+    conn = conn_cls(url.hostname, url.port, timeout=120)
+    started = time.perf_counter()
+    try:
+        conn.request("POST", url.path or "/", body=json.dumps({"prompt": question, "stream": stream}),
+                     headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        ttft_ms = None
+        while True:
+            data = response.read1(65536) if stream else response.read()
+            if not data:
+                break
+            if ttft_ms is None and stream and b"event: delta" in data:
+                ttft_ms = (time.perf_counter() - started) * 1000
+            if not stream:
+                break
+        return response.status, (time.perf_counter() - started) * 1000, ttft_ms
+    finally:
+        conn.close()
+
+
+def start_stub_process(args):
+    """Run stubs.py in a child process and return (process, environment)"""
+    command = [sys.executable, os.path.join(BENCH_DIR, "stubs.py"), "--port", "0"]
+    for name in ("tavily", "newsapi", "bedrock"):
+        if getattr(args, name):
+            command += [f"--{name}", getattr(args, name)]
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    line = proc.stdout.readline().strip()
+    if not line.startswith("listening on "):
+        proc.kill()
+        raise RuntimeError(f"Stub server failed to start: {proc.stderr.read()[-2000:]}")
+    url = line[len("listening on "):]
+    return proc, {
+        "TAVILY_API_KEY": "stub",
+        "NEWS_API_KEY": "stub",
+        "TAVILY_URL": f"{url}/search",
+        "NEWS_API_URL": f"{url}/v2/everything",
+        "BEDROCK_ENDPOINT_URL": url,
+        "AWS_ACCESS_KEY_ID": "stub",
+        "AWS_SECRET_ACCESS_KEY": "stub",
+        "AWS_DEFAULT_REGION": "us-east-1",
+    }
+
+
+def run(args):
+    questions = build_questions(args.warmup + args.requests, args.unique_ratio)
+    sink = None
+    stub_proc = None
+
+    if args.target:
+        send = lambda question: http_request(args.target, question, args.stream)  # noqa: E731
+    else:
+        if not args.no_stubs:
+            stub_proc, env = start_stub_process(args)
+            os.environ.update(env)
+        os.environ.setdefault("ANSWER_CACHE_ENABLED", "true" if args.caches else "false")
+        # Every request comes from this one client, whose rate limit would shed most of them
+        os.environ.setdefault("ADMISSION_ENABLED", "false")
+        # Module-level configuration reads the environment at import
+        from lambda_handler import handle_event
+
+        send = lambda question: in_process_request(handle_event, question, args.stream)  # noqa: E731
+
+    outcomes = []
+    stdout = sys.stdout
+    try:
+        if not args.target and not args.verbose:
+            sink = _LogSink()
+            sys.stdout = sink
+        for question in questions[:args.warmup]:
+            send(question)
+        if sink:
+            sink.emf_lines.clear()
+
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                futures = [pool.submit(send, q) for q in questions[args.warmup:]]
+                for future in futures:
+                    try:
+                        outcomes.append(future.result())
+                    except Exception as e:
+                        outcomes.append((type(e).__name__, None, None))
+        finally:
+            wall_s = time.perf_counter() - started
+            sys.stdout = stdout
+    finally:
+        if stub_proc is not None:
+            stub_proc.terminate()
+            stub_proc.wait(timeout=5)
+
+    statuses = {}
+    for status, _, _ in outcomes:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = [latency for status, latency, _ in outcomes if status == 200]
+    ttft = [t for status, _, t in outcomes if status == 200 and t is not None]
+    return {
+        "requests": len(outcomes),
+        "statuses": statuses,
+        "error_rate": round(1 - len(ok) / max(1, len(outcomes)), 4),
+        "wall_s": round(wall_s, 3),
+        "throughput_rps": round(len(outcomes) / wall_s, 2) if wall_s else None,
+        "latency_ms": _percentiles(ok),
+        "ttft_ms": _percentiles(ttft),
+        "peak_rss_mb": None if args.target else _peak_rss_mb(),
+        "stages": summarize(sink.emf_lines) if sink else None,
+    }
+
+
+# ========== REPORTING ==========
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def print_report(report):
+    results = report["results"]
+    print(f"requests: {results['requests']} at concurrency {report['config']['concurrency']}, statuses {results['statuses']}")
+    print(f"throughput: {results['throughput_rps']} req/s over {results['wall_s']}s; peak RSS: {results['peak_rss_mb']} MB")
+    for name in ("latency_ms", "ttft_ms"):
+        if results[name]:
+            print(f"{name:<11} " + "  ".join(f"{k} {v}" for k, v in results[name].items()))
+    for path, stages in (results["stages"] or {}).items():
+        print(f"[{path}] " + ", ".join(
+            f"{name[:-3]} p50 {s['p50']:.0f}/p99 {s['p99']:.0f}" for name, s in stages.items() if s["p99"] >= 1
+        ))
+
+
+def print_comparison(old, new):
+    def flat(report):
+        results = report["results"]
+        values = {"throughput_rps": results["throughput_rps"], "peak_rss_mb": results["peak_rss_mb"]}
+        for name in ("latency_ms", "ttft_ms"):
+            for pct in ("p50", "p95", "p99"):
+                if results[name]:
+                    values[f"{name}.{pct}"] = results[name][pct]
+        return values
+
+    before, after = flat(old), flat(new)
+    print(f"\ncompared with {old['label']} @ {old['commit']} ({old['timestamp']}):")
+    for key in before:
+        if before[key] is None or after.get(key) is None:
+            continue
+        change = (after[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+        print(f"  {key:<18} {before[key]:>10} -> {after[key]:>10}  ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--stream", action="store_true", help="request SSE and record time to first token")
+    parser.add_argument("--unique-ratio", type=float, default=1.0, help="share of never-seen questions")
+    parser.add_argument("--caches", action="store_true", help="leave the answer cache enabled")
+    parser.add_argument("--target", help="drive a running server over HTTP instead of in-process")
+    parser.add_argument("--no-stubs", action="store_true", help="use the upstreams configured in the environment")
+    parser.add_argument("--tavily", help="stub overrides, see stubs.py")
+    parser.add_argument("--newsapi", help="stub overrides, see stubs.py")
+    parser.add_argument("--bedrock", help="stub overrides, see stubs.py")
+    parser.add_argument("--label", default="load")
+    parser.add_argument("--out", help="results file (default: benchmarks/results/<label>-<commit>-<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--verbose", action="store_true", help="keep the handler's log output")
+    args = parser.parse_args(argv)
+
+    commit = _git_commit()
+    config = {k: v for k, v in vars(args).items() if k not in ("out", "compare", "verbose")}
+    report = {
+        "label": args.label,
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "config": config,
+        "results": run(args),
+    }
+    print_report(report)
+
+    out = args.out or os.path.join(
+        RESULTS_DIR, f"{args.label}-{commit}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"saved {out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
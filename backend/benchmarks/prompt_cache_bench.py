@@ -0,0 +1,134 @@
+"""Prompt-cache hit rate and input-token savings against the Bedrock stub.
+
+    python benchmarks/prompt_cache_bench.py [--requests 40] [--check] [--min-hit-rate 0.8]
+
+Streams the same set of distinct questions through the handler twice,
+with PROMPT_CACHE_ENABLED off and on, against the stub upstreams (which
+model Bedrock's cache: per-model prefix minimum, five-minute TTL, and
+prefill time for uncached input tokens). For each run it reports, per
+model, the share of requests that read the system prefix from the cache,
+input tokens as billed (cache writes at 1.25x, reads at 0.1x) and time to
+first token. With caching off every model gets the short instructions, so
+the comparison is against what an uncached deployment would send. --check
+exits non-zero when the hit rate on models whose minimum the prefix
+reaches falls below --min-hit-rate, for example because a per-request
+value crept into the system prompt.
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from contextlib import redirect_stdout
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from load_test import _Context, build_questions  # noqa: E402
+from stubs import UpstreamStubs  # noqa: E402
+
+# Relative input price of each kind of token
+PRICE = {"input_tokens": 1.0, "cache_creation_input_tokens": 1.25, "cache_read_input_tokens": 0.1}
+
+
+def _metadata(chunks):
+    """The metadata frame of a streamed answer, and the time its first delta arrived"""
+    started = time.perf_counter()
+    ttft_ms, metadata = None, None
+    for chunk in chunks:
+        if ttft_ms is None and chunk.startswith("event: delta"):
+            ttft_ms = (time.perf_counter() - started) * 1000
+        if chunk.startswith("event: metadata"):
+            metadata = json.loads(chunk.split("data: ", 1)[1])
+    return metadata, ttft_ms
+
+
+def run(handle_event, questions, cache_enabled, stubs):
+    import prompts
+
+    prompts.PROMPT_CACHE_ENABLED = cache_enabled
+    stubs.handler.prompt_cache.clear()
+    by_model = {}
+    for question in questions:
+        event = {"body": json.dumps({"prompt": question, "stream": True})}
+        with redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            status, _, chunks = handle_event(event, _Context())
+            metadata, ttft_ms = _metadata(chunks)
+        if status != 200 or not metadata or not metadata.get("usage"):
+            raise RuntimeError(f"Request failed: {status} {question}")
+        usage = metadata["usage"]
+        row = by_model.setdefault(metadata["model_used"], {"requests": 0, "hits": 0, "writes": 0, "ttft_ms": [], **dict.fromkeys(PRICE, 0)})
+        row["requests"] += 1
+        row["hits"] += 1 if usage["cache_read_input_tokens"] else 0
+        row["writes"] += 1 if usage["cache_creation_input_tokens"] else 0
+        row["ttft_ms"].append(ttft_ms if ttft_ms is not None else (time.perf_counter() - started) * 1000)
+        for field in PRICE:
+            row[field] += usage[field]
+
+    report = {}
+    for model, row in by_model.items():
+        report[model] = {
+            "requests": row["requests"],
+            "hit_rate": round(row["hits"] / row["requests"], 3),
+            "cacheable": bool(row["hits"] or row["writes"]),
+            "input_tokens": sum(row[field] for field in PRICE),
+            "billed_input_tokens": round(sum(row[field] * price for field, price in PRICE.items())),
+            "ttft_p50_ms": round(statistics.median(row["ttft_ms"]), 1),
+        }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--bedrock", default="latency=fixed:200,output_words=40,chunk_ms=5",
+                        help="Bedrock stub overrides, see stubs.py")
+    parser.add_argument("--check", action="store_true", help="exit 1 when the hit rate is too low")
+    parser.add_argument("--min-hit-rate", type=float, default=0.8)
+    args = parser.parse_args(argv)
+
+    stubs = UpstreamStubs({
+        "tavily": "latency=fixed:5", "newsapi": "latency=fixed:5", "bedrock": args.bedrock,
+    }).start()
+    os.environ.update(stubs.environment())
+    os.environ["ANSWER_CACHE_ENABLED"] = "false"
+    # One client sends every request; its rate limit is not what this measures
+    os.environ["ADMISSION_ENABLED"] = "false"
+    from lambda_handler import handle_event
+
+    questions = build_questions(args.requests, unique_ratio=1.0)
+    try:
+        reports = {mode: run(handle_event, questions, mode == "cached", stubs) for mode in ("uncached", "cached")}
+    finally:
+        stubs.stop()
+
+    print(f"{'model':<48} {'mode':<9} {'reqs':>5} {'hit rate':>9} {'input tok':>10} {'billed':>8} {'ttft p50':>9}")
+    failures = []
+    for model in sorted(reports["cached"]):
+        for mode in ("uncached", "cached"):
+            row = reports[mode][model]
+            print(
+                f"{model:<48} {mode:<9} {row['requests']:>5} {row['hit_rate']:>9.0%} {row['input_tokens']:>10} "
+                f"{row['billed_input_tokens']:>8} {row['ttft_p50_ms']:>9.1f}"
+            )
+        before, after = reports["uncached"][model], reports["cached"][model]
+        saved = 1 - after["billed_input_tokens"] / max(1, before["billed_input_tokens"])
+        if not after["cacheable"]:
+            # No cache writes at all: the prefix is below this model's minimum
+            print(f"{'':<48} full instructions below this model's cache minimum: short ones sent, not cached")
+            continue
+        print(f"{'':<48} billed input {-saved:+.0%}, ttft {after['ttft_p50_ms'] - before['ttft_p50_ms']:+.1f}ms")
+        if after["requests"] > 1 and after["hit_rate"] < args.min_hit_rate:
+            failures.append(f"{model} hit rate {after['hit_rate']:.0%} (minimum {args.min_hit_rate:.0%})")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    return 1 if args.check and failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""Cold-start cost of the handler: import time and first-invocation latency per path.
+
+    python benchmarks/startup_bench.py [--runs 5] [--answer] [--check]
+
+Every sample runs in a fresh interpreter, the way a new Lambda container
+would: import lambda_handler, then invoke it once on one request path.
+Besides timings, each sample reports which heavy modules the path loaded;
+preflight and validation errors must not load any of them. --check exits
+non-zero when they do, or when the median import time exceeds
+--max-import-ms, so cold-start regressions fail CI.
+
+--answer adds a full question (needs Bedrock credentials, or the stub
+upstreams from the load-test suite).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ("boto3", "botocore", "PIL", "ssl", "http.client", "sqlite3", "concurrent.futures")
+
+# Paths that must answer without touching any heavy module
+LIGHT_PATHS = ("preflight", "invalid_json", "missing_prompt", "body_too_large")
+
+
+def _event(path):
+    if path == "preflight":
+        return {"requestContext": {"http": {"method": "OPTIONS"}}, "headers": {"origin": "http://localhost:5173"}}
+    if path == "invalid_json":
+        return {"body": "{not json"}
+    if path == "missing_prompt":
+        return {"body": "{}"}
+    if path == "body_too_large":
+        from images import MAX_BODY_CHARS
+
+        return {"body": '{"prompt": "x", "image": "' + "A" * MAX_BODY_CHARS + '"}'}
+    if path == "answer":
+        return {"body": json.dumps({"prompt": "What is photosynthesis?"})}
+    raise ValueError(f"Unknown path: {path}")
+
+
+class _Context:
+    def get_remaining_time_in_millis(self):
+        return 30000
+
+
+# ========== CHILD ==========
+def run_child(path):
+    """One cold sample; prints a RESULT line for the parent to parse"""
+    started = time.perf_counter()
+    import lambda_handler
+
+    imported = time.perf_counter()
+    if path == "bedrock_client":
+        from resources import get_bedrock_client
+
+        invoked = time.perf_counter()
+        get_bedrock_client("us-east-1")
+        status = None
+    else:
+        event = _event(path)
+        invoked = time.perf_counter()
+        status = lambda_handler.lambda_handler(event, _Context())["statusCode"]
+    finished = time.perf_counter()
+
+    print("RESULT " + json.dumps({
+        "import_ms": (imported - started) * 1000,
+        "first_call_ms": (finished - invoked) * 1000,
+        "status": status,
+        "heavy_loaded": [name for name in HEAVY_MODULES if name in sys.modules],
+    }))
+
+
+# ========== PARENT ==========
+def sample(path):
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [BACKEND_DIR, os.environ.get("PYTHONPATH")]))}
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", path],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=120,
+    )
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    raise RuntimeError(f"{path} sample failed:\n{proc.stderr.strip()[-2000:]}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--answer", action="store_true", help="also measure a full question")
+    parser.add_argument("--check", action="store_true", help="exit 1 on a cold-start regression")
+    parser.add_argument("--max-import-ms", type=float, default=150.0)
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child)
+        return 0
+
+    paths = list(LIGHT_PATHS) + ["bedrock_client"] + (["answer"] if args.answer else [])
+    report = {}
+    print(f"{'path':<16} {'status':>6} {'import ms':>10} {'first call ms':>14}  heavy modules loaded")
+    for path in paths:
+        try:
+            samples = [sample(path) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"{path:<16} skipped: {str(e).splitlines()[-1]}")
+            continue
+        heavy = sorted({name for s in samples for name in s["heavy_loaded"]})
+        report[path] = {
+            "status": samples[0]["status"],
+            "import_ms": statistics.median(s["import_ms"] for s in samples),
+            "first_call_ms": statistics.median(s["first_call_ms"] for s in samples),
+            "heavy_loaded": heavy,
+        }
+        row = report[path]
+        print(
+            f"{path:<16} {str(row['status'] or '-'):>6} {row['import_ms']:>10.1f} "
+            f"{row['first_call_ms']:>14.1f}  {', '.join(heavy) or '-'}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    failures = []
+    for path in LIGHT_PATHS:
+        if report.get(path, {}).get("heavy_loaded"):
+            failures.append(f"{path} loaded {', '.join(report[path]['heavy_loaded'])}")
+    import_ms = statistics.median(row["import_ms"] for row in report.values()) if report else 0.0
+    if import_ms > args.max_import_ms:
+        failures.append(f"import took {import_ms:.1f}ms (limit {args.max_import_ms:.0f}ms)")
+    for failure in failures:
+        print(f"❌ {failure}")
+    return 1 if args.check and failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
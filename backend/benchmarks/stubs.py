@@ -0,0 +1,366 @@
+"""Local stand-ins for Tavily, NewsAPI and Bedrock runtime.
+
+    python benchmarks/stubs.py [--port 9000] [--tavily SPEC] [--newsapi SPEC] [--bedrock SPEC]
+
+One HTTP server answers all three upstreams:
+
+    POST /search                                      Tavily
+    GET  /v2/everything                               NewsAPI
+    POST /model/<model>/invoke                        Bedrock
+    POST /model/<model>/invoke-with-response-stream   Bedrock, AWS event stream
+
+Point the handler at it with TAVILY_URL=<url>/search,
+NEWS_API_URL=<url>/v2/everything and BEDROCK_ENDPOINT_URL=<url> (any
+dummy AWS credentials will do; signatures are not checked).
+
+A SPEC is a comma-separated list of key=value overrides, e.g.
+"latency=lognormal:300:0.5,error_rate=0.02,results=8". Latency is one of
+fixed:<ms>, uniform:<lo_ms>:<hi_ms> or lognormal:<median_ms>:<sigma>;
+for Bedrock it is the time to the first token, after which a chunk of
+chunk_words words is sent every chunk_ms.
+
+Bedrock also models prompt caching: a system prompt marked with
+cache_control and at least cache_min_tokens long (cache_min_tokens_haiku
+for Haiku models) is remembered per model for cache_ttl_s. Usage reports
+cache_read_input_tokens / cache_creation_input_tokens like the real
+service, and every uncached input token adds prefill_ms_per_1k to the time
+to first token (cached ones a tenth of that).
+"""
+import argparse
+import base64
+import json
+import math
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_SPECS = {
+    "tavily": "latency=lognormal:450:0.4,error_rate=0,results=6,content_chars=1500",
+    "newsapi": "latency=lognormal:250:0.4,error_rate=0,results=3,content_chars=600",
+    "bedrock": (
+        "latency=lognormal:800:0.3,error_rate=0,throttle_rate=0,output_words=250,chunk_words=6,chunk_ms=20,"
+        "prefill_ms_per_1k=60,cache_min_tokens=1024,cache_min_tokens_haiku=2048,cache_ttl_s=300"
+    ),
+}
+
+_WORDS = (
+    "energy cell light plant water process chlorophyll glucose oxygen carbon dioxide "
+    "reaction molecule atom structure function system example step result cause effect "
+    "theory history evidence model equation force motion learn explain because therefore"
+).split()
+
+
+# ========== SPECS ==========
+class Latency:
+    """A latency distribution parsed from fixed:, uniform: or lognormal:"""
+
+    def __init__(self, text):
+        kind, *args = text.split(":")
+        self.kind = kind
+        self.args = [float(a) for a in args]
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {text}")
+
+    def sample_s(self, rng):
+        if self.kind == "fixed":
+            ms = self.args[0]
+        elif self.kind == "uniform":
+            ms = rng.uniform(self.args[0], self.args[1])
+        else:
+            median, sigma = self.args
+            ms = rng.lognormvariate(math.log(max(median, 0.001)), sigma)
+        return max(0.0, ms) / 1000.0
+
+
+def parse_spec(upstream, text=None):
+    """Merge a SPEC string over the upstream's defaults"""
+    spec = {}
+    for source in (DEFAULT_SPECS[upstream], text or ""):
+        for item in filter(None, (part.strip() for part in source.split(","))):
+            key, _, value = item.partition("=")
+            spec[key] = value
+    parsed = {"latency": Latency(spec.pop("latency"))}
+    for key, value in spec.items():
+        parsed[key] = float(value) if "." in value or key.endswith("_rate") else int(value)
+    return parsed
+
+
+def _text(rng, chars):
+    words, length = [], 0
+    while length < chars:
+        word = rng.choice(_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:chars]
+
+
+def _tokens(value):
+    # Same rough ratio as context_assembly.estimate_tokens
+    return int(len(json.dumps(value, ensure_ascii=False).encode("utf-8")) / 3.8) + 1
+
+
+# ========== AWS EVENT STREAM ==========
+def _eventstream_message(headers, payload):
+    """Encode one application/vnd.amazon.eventstream message"""
+    encoded_headers = b""
+    for name, value in headers.items():
+        name_bytes, value_bytes = name.encode("utf-8"), value.encode("utf-8")
+        encoded_headers += (
+            struct.pack(">B", len(name_bytes)) + name_bytes
+            + struct.pack(">BH", 7, len(value_bytes)) + value_bytes
+        )
+    total = 12 + len(encoded_headers) + len(payload) + 4
+    prelude = struct.pack(">II", total, len(encoded_headers))
+    prelude += struct.pack(">I", zlib.crc32(prelude) & 0xFFFFFFFF)
+    message = prelude + encoded_headers + payload
+    return message + struct.pack(">I", zlib.crc32(message) & 0xFFFFFFFF)
+
+
+def bedrock_chunk(event):
+    """One Bedrock response-stream chunk wrapping an Anthropic stream event"""
+    payload = json.dumps({"bytes": base64.b64encode(json.dumps(event).encode("utf-8")).decode("ascii")})
+    return _eventstream_message(
+        {":event-type": "chunk", ":content-type": "application/json", ":message-type": "event"},
+        payload.encode("utf-8"),
+    )
+
+
+# ========== SERVER ==========
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    specs = {}
+    stats = {}
+    stats_lock = threading.Lock()
+    prompt_cache = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def _count(self, upstream, outcome):
+        with self.stats_lock:
+            counts = self.stats.setdefault(upstream, {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _fail(self, upstream, spec, rng):
+        """Inject a configured error; returns True when one was sent"""
+        if rng.random() < spec.get("throttle_rate", 0):
+            self._count(upstream, "throttled")
+            self._send_json(429, {"message": "Too many requests"}, {"x-amzn-ErrorType": "ThrottlingException"})
+            return True
+        if rng.random() < spec.get("error_rate", 0):
+            self._count(upstream, "errors")
+            self._send_json(500, {"message": "Stub upstream error"})
+            return True
+        return False
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != "/v2/everything":
+            self._send_json(404, {"message": "Not found"})
+            return
+        spec, rng = self.specs["newsapi"], random.Random()
+        query = parse_qs(url.query).get("q", [""])[0]
+        time.sleep(spec["latency"].sample_s(rng))
+        if self._fail("newsapi", spec, rng):
+            return
+        count = min(spec["results"], int(parse_qs(url.query).get("pageSize", [spec["results"]])[0]))
+        self._count("newsapi", "ok")
+        self._send_json(200, {"status": "ok", "articles": [
+            {
+                "title": f"{query} in the news ({i + 1})",
+                "url": f"https://news.example.com/{i}",
+                "description": _text(rng, 200),
+                "content": _text(rng, spec["content_chars"]),
+                "source": {"name": "Stub News"},
+                "publishedAt": "2024-01-01T00:00:00Z",
+            }
+            for i in range(count)
+        ]})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        raw = self._read_body()
+        if path == "/search":
+            self._tavily(json.loads(raw or b"{}"))
+            return
+        match = re.match(r"^/model/([^/]+)/(invoke|invoke-with-response-stream)$", path)
+        if match:
+            self._bedrock(match.group(1), json.loads(raw or b"{}"), streaming=match.group(2) != "invoke")
+            return
+        self._send_json(404, {"message": "Not found"})
+
+    def _tavily(self, payload):
+        spec, rng = self.specs["tavily"], random.Random()
+        time.sleep(spec["latency"].sample_s(rng))
+        if self._fail("tavily", spec, rng):
+            return
+        count = min(spec["results"], int(payload.get("max_results", spec["results"])))
+        query = payload.get("query", "")
+        self._count("tavily", "ok")
+        self._send_json(200, {
+            "answer": _text(rng, 200),
+            "results": [
+                {
+                    "title": f"{query} explained ({i + 1})",
+                    "url": f"https://reference.example.com/{i}",
+                    "content": _text(rng, spec["content_chars"]),
+                    "score": round(1.0 - i * 0.1, 2),
+                }
+                for i in range(count)
+            ],
+        })
+
+    def _prompt_usage(self, model, payload, spec):
+        """Input token usage split into cached and uncached parts, like Bedrock reports it"""
+        system = payload.get("system") or []
+        if isinstance(system, str):
+            system = [{"type": "text", "text": system}]
+        total = _tokens(system) + _tokens(payload.get("messages", []))
+        # Everything up to the last cache_control marker is the cacheable prefix
+        marked = [n for n, block in enumerate(system) if "cache_control" in block]
+        usage = {"input_tokens": total, "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
+        if not marked:
+            return usage
+        prefix = system[:marked[-1] + 1]
+        prefix_tokens = _tokens(prefix)
+        minimum = spec["cache_min_tokens_haiku"] if "haiku" in model else spec["cache_min_tokens"]
+        if prefix_tokens < minimum:
+            return usage
+        key = (model, json.dumps(prefix, sort_keys=True))
+        now = time.monotonic()
+        with self.stats_lock:
+            hit = self.prompt_cache.get(key, 0) > now
+            self.prompt_cache[key] = now + spec["cache_ttl_s"]
+        usage["input_tokens"] = total - prefix_tokens
+        usage["cache_read_input_tokens" if hit else "cache_creation_input_tokens"] = prefix_tokens
+        self._count("bedrock", "cache_hit" if hit else "cache_write")
+        return usage
+
+    def _bedrock(self, model, payload, streaming):
+        spec, rng = self.specs["bedrock"], random.Random()
+        usage = self._prompt_usage(model, payload, spec)
+        prefill_tokens = usage["input_tokens"] + usage["cache_creation_input_tokens"] + usage["cache_read_input_tokens"] / 10
+        time.sleep(spec["latency"].sample_s(rng) + prefill_tokens / 1000 * spec["prefill_ms_per_1k"] / 1000)
+        if self._fail("bedrock", spec, rng):
+            return
+        words = min(spec["output_words"], int(payload.get("max_tokens", spec["output_words"])))
+        chunks = [
+            " ".join(rng.choice(_WORDS) for _ in range(min(spec["chunk_words"], words - start))) + " "
+            for start in range(0, words, spec["chunk_words"])
+        ]
+        self._count("bedrock", "ok")
+
+        if not streaming:
+            time.sleep(len(chunks) * spec["chunk_ms"] / 1000.0)
+            self._send_json(200, {
+                "content": [{"type": "text", "text": "".join(chunks)}],
+                "usage": {**usage, "output_tokens": words},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.amazon.eventstream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        events = [{"type": "message_start", "message": {"usage": usage}}]
+        events += [{"type": "content_block_delta", "delta": {"type": "text_delta", "text": c}} for c in chunks]
+        events.append({"type": "message_delta", "usage": {"output_tokens": words}})
+        for n, event in enumerate(events):
+            if 1 < n < len(events) - 1:
+                time.sleep(spec["chunk_ms"] / 1000.0)
+            data = bedrock_chunk(event)
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class UpstreamStubs:
+    """The stub server on a background thread"""
+
+    def __init__(self, specs=None, host="127.0.0.1", port=0):
+        specs = specs or {}
+        handler = type("ConfiguredStubHandler", (StubHandler,), {
+            "specs": {name: parse_spec(name, specs.get(name)) for name in DEFAULT_SPECS},
+            "stats": {},
+            "prompt_cache": {},
+        })
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.handler = handler
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def environment(self):
+        """Environment variables that point the handler at these stubs"""
+        return {
+            "TAVILY_API_KEY": "stub",
+            "NEWS_API_KEY": "stub",
+            "TAVILY_URL": f"{self.url}/search",
+            "NEWS_API_URL": f"{self.url}/v2/everything",
+            "BEDROCK_ENDPOINT_URL": self.url,
+            "AWS_ACCESS_KEY_ID": "stub",
+            "AWS_SECRET_ACCESS_KEY": "stub",
+            "AWS_DEFAULT_REGION": "us-east-1",
+        }
+
+    def stats(self):
+        with self.handler.stats_lock:
+            return {name: dict(counts) for name, counts in self.handler.stats.items()}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Tavily/NewsAPI/Bedrock stubs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    for name in DEFAULT_SPECS:
+        parser.add_argument(f"--{name}", help=f"overrides for {DEFAULT_SPECS[name]}")
+    args = parser.parse_args(argv)
+
+    stubs = UpstreamStubs({name: getattr(args, name) for name in DEFAULT_SPECS}, args.host, args.port)
+    # The load test reads this line to find the port
+    print(f"listening on {stubs.url}", flush=True)
+    for name, value in stubs.environment().items():
+        print(f"  {name}={value}", file=sys.stderr)
+    try:
+        stubs.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stubs.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
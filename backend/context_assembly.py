@@ -0,0 +1,173 @@
+"""Token-budgeted context assembly for the tutor prompt.
+
+Takes the raw web, knowledge-base and news hits and decides what the model
+actually reads: near-duplicate snippets are dropped, the survivors are ranked
+by fusing the provider signal (Tavily score, BM25 score, news recency) with
+query relevance, each is cut down to its most query-relevant passage, and the
+result is packed into CONTEXT_TOKEN_BUDGET tokens.
+"""
+import os
+import re
+
+from kb_index import tokenize
+
+# ========== CONFIGURATION ==========
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1500"))
+PASSAGE_CHARS = int(os.environ.get("CONTEXT_PASSAGE_CHARS", "700"))
+DUPLICATE_JACCARD = 0.6
+RRF_K = 10
+MIN_TRIMMED_TOKENS = 40
+BLOCK_OVERHEAD_TOKENS = 12
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+# ========== TOKEN ESTIMATE ==========
+def estimate_tokens(text):
+    """Cheap token estimate: Claude averages roughly 3.8 UTF-8 bytes per token"""
+    if not text:
+        return 0
+    return int(len(text.encode("utf-8")) / 3.8) + 1
+
+
+# ========== DEDUP ==========
+def _shingles(text):
+    words = (text or "").lower().split()
+    if len(words) < 3:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+# ========== PASSAGE SELECTION ==========
+def select_passage(text, query_terms, max_chars=PASSAGE_CHARS):
+    """The most query-relevant sentence, grown with its best neighbours up to max_chars"""
+    text = (text or "").strip()
+    if len(text) <= max_chars:
+        return text
+
+    sentences = [s for s in _SENTENCE_RE.split(text) if s.strip()]
+    weights = [len(query_terms.intersection(tokenize(s))) for s in sentences]
+    anchor = max(range(len(sentences)), key=lambda i: weights[i])
+    if len(sentences[anchor]) > max_chars:
+        return sentences[anchor][:max_chars].rsplit(" ", 1)[0]
+
+    start, end = anchor, anchor + 1
+    length = len(sentences[anchor])
+    while True:
+        options = []
+        if start > 0 and length + len(sentences[start - 1]) + 1 <= max_chars:
+            options.append((weights[start - 1], 0, "left"))
+        if end < len(sentences) and length + len(sentences[end]) + 1 <= max_chars:
+            # Ties go right: the text after a match usually elaborates on it
+            options.append((weights[end], 1, "right"))
+        if not options:
+            break
+        _, _, side = max(options)
+        if side == "left":
+            start -= 1
+            length += len(sentences[start]) + 1
+        else:
+            length += len(sentences[end]) + 1
+            end += 1
+    return " ".join(sentences[start:end])
+
+
+def _relevance(passage, query_terms):
+    if not query_terms:
+        return 0.0
+    return len(query_terms.intersection(tokenize(passage))) / len(query_terms)
+
+
+# ========== RANKING ==========
+def _provider_rank_key(item):
+    kind = item["kind"]
+    if kind == "news":
+        # ISO-8601 timestamps sort chronologically as strings; newest first
+        return (2, item["source"].get("published") or "")
+    return (0 if kind == "kb" else 1, item["source"].get("score") or 0)
+
+
+def _fuse(items):
+    """Reciprocal-rank fusion of the provider signal and query relevance"""
+    by_kind = {}
+    for item in items:
+        by_kind.setdefault(item["kind"], []).append(item)
+    for group in by_kind.values():
+        group.sort(key=_provider_rank_key, reverse=True)
+        for rank, item in enumerate(group):
+            item["fused"] = 1.0 / (RRF_K + rank)
+
+    for rank, item in enumerate(sorted(items, key=lambda i: i["relevance"], reverse=True)):
+        item["fused"] += 1.0 / (RRF_K + rank)
+    return sorted(items, key=lambda i: i["fused"], reverse=True)
+
+
+def _trim_to_tokens(passage, tokens):
+    kept = []
+    for sentence in _SENTENCE_RE.split(passage):
+        if estimate_tokens(" ".join(kept + [sentence])) > tokens:
+            break
+        kept.append(sentence)
+    return " ".join(kept)
+
+
+# ========== ASSEMBLY ==========
+def assemble_context(user_query, sources, news_articles, budget=None):
+    """Pick, trim and pack sources into the token budget.
+
+    Returns (sources, news_articles, stats). Each selected item is a copy of
+    its input with a "passage" holding the text the prompt should include;
+    order within each list follows the fused ranking.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    query_terms = set(tokenize(user_query))
+
+    items = []
+    for kind, group in (("web", sources), ("news", news_articles)):
+        for source in group:
+            kind_of = source.get("type", kind) if kind == "web" else "news"
+            passage = select_passage(source.get("content") or source.get("snippet") or "", query_terms)
+            items.append({
+                "kind": kind_of,
+                "source": source,
+                "passage": passage,
+                "shingles": _shingles(passage),
+                "relevance": _relevance(passage, query_terms),
+            })
+
+    ranked = _fuse(items)
+
+    kept, duplicates, over_budget, used = [], 0, 0, 0
+    for item in ranked:
+        if any(_jaccard(item["shingles"], k["shingles"]) >= DUPLICATE_JACCARD for k in kept):
+            duplicates += 1
+            continue
+
+        cost = estimate_tokens(item["passage"]) + BLOCK_OVERHEAD_TOKENS
+        if used + cost > budget:
+            remaining = budget - used - BLOCK_OVERHEAD_TOKENS
+            trimmed = _trim_to_tokens(item["passage"], remaining) if remaining >= MIN_TRIMMED_TOKENS else ""
+            if not trimmed:
+                over_budget += 1
+                continue
+            item["passage"] = trimmed
+            cost = estimate_tokens(trimmed) + BLOCK_OVERHEAD_TOKENS
+        kept.append(item)
+        used += cost
+
+    selected_sources = [{**i["source"], "passage": i["passage"]} for i in kept if i["kind"] != "news"]
+    selected_news = [{**i["source"], "passage": i["passage"]} for i in kept if i["kind"] == "news"]
+    stats = {
+        "context_tokens": used,
+        "token_budget": budget,
+        "candidates": len(items),
+        "dropped_duplicates": duplicates,
+        "dropped_over_budget": over_budget,
+    }
+    return selected_sources, selected_news, stats
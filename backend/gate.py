@@ -0,0 +1,139 @@
+"""Decide, before any network call, which search providers a question needs.
+
+Three outcomes:
+
+- "none": the local knowledge base already covers the question, or it is a
+  self-contained calculation or code question that sources cannot improve;
+- "web": Tavily only, the default for evergreen tutoring questions
+  ("Explain recursion in simple steps.") where news is noise;
+- "web+news": Tavily and NewsAPI, for questions with recency cues
+  ("latest", "this year", "hoy") or about current-affairs topics.
+
+Recency cues win over local coverage, since the knowledge base may be stale.
+Only providers with credentials run, and the decision recorded is named
+after the ones that do ("news" when NewsAPI runs alone). The decision costs
+a few regex matches; the time it saves is estimated from each upstream's
+observed median latency and recorded in the response trace.
+GATE_ENABLED=false restores the old behavior (news always, Tavily unless
+the knowledge base is strong). benchmarks/gate_bench.py checks the
+decisions on a labeled set of questions.
+"""
+import os
+import re
+from datetime import datetime
+
+from kb_index import is_strong_recall
+from resilience import resilience_stats
+
+# ========== CONFIGURATION ==========
+GATE_ENABLED = os.environ.get("GATE_ENABLED", "true").lower() == "true"
+
+NONE, WEB, NEWS, WEB_NEWS = "none", "web", "news", "web+news"
+
+PROVIDERS = {
+    NONE: (),
+    WEB: ("tavily",),
+    NEWS: ("newsapi",),
+    WEB_NEWS: ("tavily", "newsapi"),
+}
+
+# Assumed median latency until an upstream has enough samples of its own
+ASSUMED_LATENCY_MS = {"tavily": 1500, "newsapi": 600}
+
+_YEAR = datetime.utcnow().year
+
+RECENCY_CUES = re.compile(
+    r"\b(latest|recent|recently|newest|currently|today|tonight|yesterday|tomorrow|"
+    r"this (?:week|month|year|season)|last (?:week|month|night)|right now|nowadays|"
+    r"news|breaking|upcoming|so far|anymore|"
+    r"hoy|ayer|mañana|actual|actualmente|reciente|recientes|últimas?|último|noticias|"
+    r"esta (?:semana|temporada)|este (?:mes|año)|ahora)\b|"
+    rf"\b(?:{_YEAR - 1}|{_YEAR}|{_YEAR + 1})\b",
+    re.IGNORECASE,
+)
+
+# Topics whose answers change from week to week
+CURRENT_AFFAIRS = re.compile(
+    r"\b(election|elections|president|prime minister|government|policy|congress|senate|"
+    r"ceasefire|economy|inflation|interest rates?|stock|stocks|market|markets|price of|"
+    r"unemployment|pandemic|outbreak|climate summit|standings|tournament|"
+    r"elecciones|presidente|gobierno|economía|inflación|mercado|bolsa|precio de)\b",
+    re.IGNORECASE,
+)
+
+# A calculation to work out or code to read. Stricter than routing's
+# MATH_OR_CODE, which only has to pick a model: a false match here drops
+# every source, so a hyphen or slash between numbers ("1914-1918", "9/11",
+# "737-800", "COVID-19") is a range, date or name, never an operator
+SELF_CONTAINED = re.compile(
+    r"```|\bdef \w+\s*\(|\bfunction\s*\w*\s*\(|\bO\([^)]*n|"
+    r"[\w)]\s*=\s*[\w(-]|"
+    r"\b\d*[a-z]\s*[+*^]\s*\d|\d\s*[a-z]\b\s*[+\-*^=]\s*[\d(]|"
+    r"\d\s*[+*×÷^]\s*\d",
+    re.IGNORECASE,
+)
+
+# Topics a textbook answers as well as the web does
+TIMELESS_TOPICS = re.compile(
+    r"\b(recursion|algorithm|loop|function|variable|array|class|equation|theorem|proof|"
+    r"derivative|integral|fraction|algebra|geometry|grammar|verb|noun|tense|photosynthesis|"
+    r"cell|atom|molecule|gravity|newton|evolution|dna|element|ecosystem|mitosis|"
+    r"recursión|algoritmo|ecuación|teorema|derivada|integral|fracción|álgebra|gramática|"
+    r"verbo|fotosíntesis|célula|átomo|molécula|gravedad)\b",
+    re.IGNORECASE,
+)
+
+
+# ========== DECISION ==========
+def _median_ms(name, stats):
+    return (stats.get(name) or {}).get("p50_ms") or ASSUMED_LATENCY_MS.get(name, 0)
+
+
+def decide_retrieval(user_query, kb_hits, configured=PROVIDERS[WEB_NEWS]):
+    """Return the gate decision: providers to call, reasons and estimated savings.
+
+    configured names the providers with credentials; the others never run.
+    """
+    kb_strong = is_strong_recall(kb_hits)
+    reasons = []
+    if not GATE_ENABLED:
+        wanted = PROVIDERS[NEWS] if kb_strong else PROVIDERS[WEB_NEWS]
+        reasons.append("gate_disabled")
+    elif RECENCY_CUES.search(user_query):
+        wanted = PROVIDERS[WEB_NEWS]
+        reasons.append("recency_cue")
+    elif CURRENT_AFFAIRS.search(user_query):
+        wanted = PROVIDERS[WEB_NEWS]
+        reasons.append("current_affairs")
+    elif kb_strong:
+        wanted = PROVIDERS[NONE]
+        reasons.append("kb_coverage")
+    elif SELF_CONTAINED.search(user_query):
+        wanted = PROVIDERS[NONE]
+        reasons.append("self_contained")
+    else:
+        wanted = PROVIDERS[WEB]
+        reasons.append("timeless_topic" if TIMELESS_TOPICS.search(user_query) else "evergreen_default")
+
+    providers = tuple(name for name in wanted if name in configured)
+    if providers != wanted:
+        reasons.append("not_configured")
+    decision = next(label for label, names in PROVIDERS.items() if names == providers)
+
+    skipped = [name for name in configured if name not in providers]
+    stats = resilience_stats()
+    # Providers run concurrently, so wall time is the slowest one's; skipping
+    # only the faster provider saves a round trip and its tail, not median time
+    wall_ms = max((_median_ms(name, stats) for name in configured), default=0)
+    kept_ms = max((_median_ms(name, stats) for name in providers), default=0)
+    print(f"🚦 Retrieval gate: {decision} ({', '.join(reasons)}), skipping {skipped or 'nothing'}")
+    return {
+        "decision": decision,
+        "providers": list(providers),
+        "kb_strong": kb_strong,
+        "reasons": reasons,
+        "skipped": skipped,
+        "round_trips_saved": len(skipped),
+        "est_saved_ms": wall_ms - kept_ms,
+        "upstream_ms_avoided": sum(_median_ms(name, stats) for name in skipped),
+    }
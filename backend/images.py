@@ -0,0 +1,209 @@
+"""Uploaded images, decoded and sized for the model with bounded memory.
+
+The frontend sends a screenshot as a base64 `image` field. prepare_image
+checks its size before decoding anything, decodes it in fixed-size chunks
+(no full ASCII copy of the string) while hashing, and downscales it to
+the longest edge the model actually uses. JPEGs are decoded straight at
+the reduced scale, so the full-resolution bitmap never exists in memory.
+Processed images are cached by sha256 of the upload, so a student who
+re-sends the same screenshot skips the decode and resize entirely.
+
+Pillow is optional: without it images under the Bedrock limit are passed
+through unchanged and larger ones are rejected.
+"""
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import threading
+
+from stores import open_store
+
+# ========== CONFIGURATION ==========
+IMAGE_MAX_BYTES = int(os.environ.get("IMAGE_MAX_BYTES", str(4 * 1024 * 1024)))
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", "1568"))
+IMAGE_MAX_PIXELS = int(os.environ.get("IMAGE_MAX_PIXELS", str(40_000_000)))
+IMAGE_REENCODE_BYTES = int(os.environ.get("IMAGE_REENCODE_BYTES", str(1024 * 1024)))
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_CACHE_BACKEND = os.environ.get("IMAGE_CACHE_BACKEND", "memory")
+IMAGE_CACHE_TTL_SECONDS = int(os.environ.get("IMAGE_CACHE_TTL_SECONDS", "3600"))
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+
+# Anthropic models on Bedrock reject images above this size
+BEDROCK_IMAGE_MAX_BYTES = 3_750_000
+
+# A request body holding the largest accepted image, plus room for the rest of the JSON
+MAX_ENCODED_CHARS = 4 * ((IMAGE_MAX_BYTES + 2) // 3)
+MAX_BODY_CHARS = MAX_ENCODED_CHARS + 64 * 1024
+
+# Base64 characters decoded per step; a multiple of 4 so chunks never split a quantum
+_DECODE_CHUNK_CHARS = 256 * 1024
+
+_DATA_URL_RE = re.compile(r"^data:image/[\w.+-]+;base64,")
+_WHITESPACE_RE = re.compile(r"\s")
+
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+_store = None
+_store_lock = threading.Lock()
+
+
+class ImageError(Exception):
+    """An upload we cannot use; status is the HTTP status to answer with"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = open_store(
+                    IMAGE_CACHE_BACKEND,
+                    "image_cache",
+                    max_entries=64,
+                    max_bytes=IMAGE_CACHE_MAX_BYTES,
+                )
+    return _store
+
+
+# ========== DECODING ==========
+def _decode_bounded(encoded):
+    """Decode base64 chunk by chunk, hashing as we go; returns (bytes, sha256 hex)"""
+    if _WHITESPACE_RE.search(encoded):
+        encoded = _WHITESPACE_RE.sub("", encoded)
+
+    decoded = bytearray()
+    digest = hashlib.sha256()
+    for start in range(0, len(encoded), _DECODE_CHUNK_CHARS):
+        try:
+            chunk = binascii.a2b_base64(encoded[start:start + _DECODE_CHUNK_CHARS])
+        except (binascii.Error, ValueError) as e:
+            raise ImageError(400, f"Invalid base64 image: {str(e)}")
+        if len(decoded) + len(chunk) > IMAGE_MAX_BYTES:
+            raise ImageError(413, f"Image exceeds {IMAGE_MAX_BYTES} bytes")
+        digest.update(chunk)
+        decoded += chunk
+    return bytes(decoded), digest.hexdigest()
+
+
+def sniff_media_type(data):
+    """Media type from the file signature; None for formats Bedrock does not take"""
+    for signature, media_type in _SIGNATURES:
+        if data.startswith(signature):
+            return media_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+# ========== RESIZING ==========
+def _fit_for_model(data, media_type):
+    """Downscale and re-encode when the image is larger than the model needs.
+
+    Returns (bytes, media_type, width, height, resized).
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        if len(data) > BEDROCK_IMAGE_MAX_BYTES:
+            raise ImageError(413, "Image is too large and cannot be downscaled here")
+        return data, media_type, None, None, False
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        width, height = image.size
+        if width * height > IMAGE_MAX_PIXELS:
+            raise ImageError(413, f"Image has more than {IMAGE_MAX_PIXELS} pixels")
+        if max(width, height) <= IMAGE_MAX_EDGE and len(data) <= IMAGE_REENCODE_BYTES:
+            return data, media_type, width, height, False
+
+        # JPEG decodes at 1/2, 1/4 or 1/8 scale here, before any pixels are allocated
+        image.draft("RGB", (IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+        image.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+
+        out = io.BytesIO()
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            image.save(out, format="PNG", optimize=True)
+            out_type = "image/png"
+        else:
+            image.convert("RGB").save(out, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+            out_type = "image/jpeg"
+        resized_width, resized_height = image.size
+        image.close()
+    except ImageError:
+        raise
+    except Exception as e:
+        raise ImageError(400, f"Unreadable image: {str(e)}")
+
+    # Keep the original when re-encoding did not help
+    if out.tell() >= len(data) and max(width, height) <= IMAGE_MAX_EDGE:
+        return data, media_type, width, height, False
+    return out.getvalue(), out_type, resized_width, resized_height, True
+
+
+# ========== API ==========
+def prepare_image(encoded):
+    """Validate, dedupe and size an uploaded base64 image for a Bedrock image block.
+
+    Returns {"media_type", "data", "sha256", "bytes", "width", "height",
+    "resized", "cached"}; raises ImageError with an HTTP status on bad input.
+    """
+    if not isinstance(encoded, str) or not encoded:
+        raise ImageError(400, "'image' must be a base64 string")
+    prefix = _DATA_URL_RE.match(encoded)
+    if prefix:
+        encoded = encoded[prefix.end():]
+    if len(encoded) > MAX_ENCODED_CHARS:
+        raise ImageError(413, f"Image exceeds {IMAGE_MAX_BYTES} bytes")
+
+    data, sha256 = _decode_bounded(encoded)
+    store = _get_store()
+    cached = store.get(sha256)
+    if cached is not None:
+        return {**cached, "cached": True}
+
+    media_type = sniff_media_type(data)
+    if media_type is None:
+        raise ImageError(415, "Unsupported image format; use PNG, JPEG, GIF or WebP")
+
+    data, media_type, width, height, resized = _fit_for_model(data, media_type)
+    if len(data) > BEDROCK_IMAGE_MAX_BYTES:
+        raise ImageError(413, "Image is still too large after downscaling")
+
+    prepared = {
+        "media_type": media_type,
+        "data": base64.b64encode(data).decode("ascii"),
+        "sha256": sha256,
+        "bytes": len(data),
+        "width": width,
+        "height": height,
+        "resized": resized,
+    }
+    store.put(sha256, prepared, IMAGE_CACHE_TTL_SECONDS)
+    if resized:
+        print(f"🖼️ Image downscaled to {width}x{height} ({len(data)} bytes, {media_type})")
+    return {**prepared, "cached": False}
+
+
+def image_block(image):
+    """Anthropic messages content block for a prepared image"""
+    return {
+        "type": "image",
+        "source": {"type": "base64", "media_type": image["media_type"], "data": image["data"]},
+    }
+
+
+def image_summary(image):
+    """Small description of a prepared image for metadata and logs"""
+    return {key: image[key] for key in ("sha256", "media_type", "bytes", "width", "height", "resized", "cached")}
@@ -0,0 +1,412 @@
+"""Asynchronous jobs for long-form outputs: study plans and practice sets.
+
+A study plan or practice set takes several Bedrock calls and can run for
+minutes, longer than a request should hold a connection (or than API
+Gateway allows). So it is submitted, then polled:
+
+    {"job": {"type": "study_plan", "topic": "photosynthesis", "level": "high school", "weeks": 4}}
+        -> 202 {"job_id": "...", "status": "queued", "poll_after_s": 2}
+    {"job": {"type": "practice_set", "topic": "quadratic equations", "questions": 5}}
+    {"job_id": "..."}                  -> the job so far: status, progress, finished sections
+    {"job_id": "...", "stream": true}  -> SSE "job", "section" and "progress" frames as it advances
+
+submit_job() stores a queued record and hands the job to a runner:
+
+- thread (the default outside Lambda): JOB_WORKERS threads in this process,
+  for local_server.py and async_server.py;
+- lambda (the default in Lambda, where threads freeze between invocations):
+  an asynchronous invocation of JOB_FUNCTION_NAME, this function unless
+  set, with {"job_run": job_id}. The job then runs within that
+  invocation's own timeout.
+
+run_job() works in steps. One fast-model call outlines the sections, and
+retrieval gathers sources for the topic once. Then the sections are written
+in parallel, JOB_SECTION_CONCURRENCY Bedrock calls at a time, through the
+handler's prompt builder and router. Each section is saved to the record as
+soon as it is written, so pollers see partial results.
+
+Jobs have their own workers, so interactive questions do not queue behind
+them; submitting one takes JOB_ADMISSION_COST tokens from the client's
+bucket. Each of a job's Bedrock calls leases an in-flight slot
+(admission.lease_slots), waiting until the job's deadline if it must, so
+jobs count against BEDROCK_MAX_IN_FLIGHT like everything else.
+
+Records live in open_store(JOBS_BACKEND) for JOB_TTL_SECONDS. memory serves
+a single process, and sqlite is the local stand-in between processes. The
+lambda runner needs dynamodb, since another invocation writes the record:
+with the memory backend submit_job refuses jobs with a 503 rather than
+accept one that could never finish.
+"""
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from stores import open_store
+from tracing import annotate, span, start_trace
+
+# ========== CONFIGURATION ==========
+JOBS_ENABLED = os.environ.get("JOBS_ENABLED", "true").lower() == "true"
+JOBS_BACKEND = os.environ.get("JOBS_BACKEND", "memory")
+JOB_RUNNER = os.environ.get("JOB_RUNNER", "lambda" if os.environ.get("AWS_LAMBDA_FUNCTION_NAME") else "thread")
+JOB_FUNCTION_NAME = os.environ.get("JOB_FUNCTION_NAME", os.environ.get("AWS_LAMBDA_FUNCTION_NAME", ""))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_MAX_QUEUED = int(os.environ.get("JOB_MAX_QUEUED", "20"))
+JOB_SECTION_CONCURRENCY = int(os.environ.get("JOB_SECTION_CONCURRENCY", "3"))
+JOB_SECTION_MAX_TOKENS = int(os.environ.get("JOB_SECTION_MAX_TOKENS", "1500"))
+JOB_ADMISSION_COST = int(os.environ.get("JOB_ADMISSION_COST", "3"))
+JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_SECONDS", "86400"))
+JOB_MAX_SECONDS = float(os.environ.get("JOB_MAX_SECONDS", "600"))
+JOB_SUBSCRIBE_SECONDS = float(os.environ.get("JOB_SUBSCRIBE_SECONDS", "25"))
+JOB_RETRIEVAL_SECONDS = 10.0
+JOB_POLL_SECONDS = 2
+JOB_WATCH_SECONDS = 0.5
+# Leave room to save the final record when running inside a Lambda invocation
+JOB_RESERVE_SECONDS = 15.0
+# A queued or running job whose record has not changed for this long lost its worker
+JOB_STALE_SECONDS = JOB_MAX_SECONDS + 60
+
+LEVELS = ("middle school", "high school", "university")
+MAX_TOPIC_CHARS = 300
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+FINISHED = (DONE, FAILED)
+
+JOB_TYPES = {
+    "study_plan": {
+        "outline": 'Outline a {weeks}-week study plan on "{topic}" for a {level} student. Return only a JSON array of {count} short titles, one per week, in the language with code "{language}".',
+        "section": 'Write the "{title}" part of a {weeks}-week study plan on "{topic}" for a {level} student: the goals for that week, the key concepts to master, concrete study activities with time estimates, and a short self-check. Cover only this part.',
+        "fallback": "Week {number}",
+    },
+    "practice_set": {
+        "outline": 'List {count} sub-topics of "{topic}" that a {level} student should practice, from basic to challenging. Return only a JSON array of {count} short titles in the language with code "{language}".',
+        "section": 'Write {questions} practice questions on "{title}" (part of "{topic}") for a {level} student, from easier to harder. Follow each question with its worked answer.',
+        "fallback": "Practice {number}",
+    },
+}
+PRACTICE_SECTIONS = 4
+
+_store = None
+_store_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+_lambda_client = None
+_stats_lock = threading.Lock()
+_queued = 0
+_stats = {"submitted": 0, "done": 0, "failed": 0}
+
+
+class JobError(Exception):
+    """A job we cannot accept; status is the HTTP status to answer with"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                # Written by the worker and read by pollers, possibly in other containers
+                _store = open_store(JOBS_BACKEND, "jobs", local_cache=False)
+    return _store
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+    return _executor
+
+
+def _count(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+# ========== REQUESTS ==========
+def _bounded_int(spec, name, default, low, high):
+    value = spec.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+        raise JobError(400, f"'{name}' must be a whole number from {low} to {high}")
+    return value
+
+
+def job_params(spec):
+    """Validated parameters of a job request, or JobError(400)"""
+    kind = spec.get("type")
+    if kind not in JOB_TYPES:
+        raise JobError(400, f"'type' must be one of: {', '.join(JOB_TYPES)}")
+    topic = spec.get("topic")
+    topic = topic.strip() if isinstance(topic, str) else ""
+    if not topic or len(topic) > MAX_TOPIC_CHARS:
+        raise JobError(400, f"'topic' must be 1 to {MAX_TOPIC_CHARS} characters")
+    level = spec.get("level", "high school")
+    if level not in LEVELS:
+        raise JobError(400, f"'level' must be one of: {', '.join(LEVELS)}")
+    params = {"type": kind, "topic": topic, "level": level}
+    if kind == "study_plan":
+        params["weeks"] = _bounded_int(spec, "weeks", 4, 1, 8)
+        params["count"] = params["weeks"]
+    else:
+        params["questions"] = _bounded_int(spec, "questions", 5, 2, 10)
+        params["count"] = PRACTICE_SECTIONS
+    return params
+
+
+def valid_job_id(job_id):
+    return isinstance(job_id, str) and re.fullmatch(r"[0-9a-f]{32}", job_id) is not None
+
+
+# ========== RECORDS ==========
+def _update(job_id, change):
+    """Apply change(record) to a copy of the stored record and save it atomically"""
+
+    def write(current):
+        if current is None:
+            return None, None
+        record = json.loads(json.dumps(current))
+        change(record)
+        record["version"] += 1
+        record["updated_at"] = time.time()
+        return record, None
+
+    _get_store().update(job_id, write, JOB_TTL_SECONDS)
+
+
+def get_job(job_id):
+    """The job as pollers see it, or None when unknown or expired"""
+    record = _get_store().get(job_id)
+    if record is None:
+        return None
+    if record["status"] not in FINISHED and time.time() - record["updated_at"] > JOB_STALE_SECONDS:
+        record = {**record, "status": FAILED, "error": "The job stopped responding"}
+    done = [s for s in record["sections"] if s["status"] != "pending"]
+    record["progress"] = {"done": len(done), "total": len(record["sections"]) or None}
+    if record["status"] == DONE:
+        record["document"] = "\n\n".join(f"## {s['title']}\n\n{s['content']}" for s in record["sections"] if s["status"] == DONE)
+    return record
+
+
+# ========== SUBMISSION ==========
+def submit_job(params):
+    """Store a queued job and hand it to the runner; returns its record"""
+    global _queued
+    if not JOBS_ENABLED:
+        raise JobError(503, "Jobs are disabled")
+    if JOB_RUNNER == "thread":
+        with _stats_lock:
+            if _queued >= JOB_MAX_QUEUED:
+                raise JobError(503, "Too many jobs are running, please try again in a few minutes")
+            _queued += 1
+    elif JOBS_BACKEND == "memory":
+        # The invocation that runs the job could never see or update this record
+        print("❌ JOB_RUNNER is lambda but JOBS_BACKEND is memory: set JOBS_BACKEND=dynamodb")
+        raise JobError(503, "Jobs are not available on this deployment")
+
+    now = time.time()
+    record = {
+        "job_id": uuid.uuid4().hex,
+        "type": params["type"],
+        "params": params,
+        "status": QUEUED,
+        "sections": [],
+        "sources": [],
+        "error": None,
+        "version": 0,
+        "created_at": now,
+        "updated_at": now,
+    }
+    try:
+        _get_store().put(record["job_id"], record, JOB_TTL_SECONDS)
+        _start(record["job_id"])
+    except Exception:
+        if JOB_RUNNER == "thread":
+            with _stats_lock:
+                _queued -= 1
+        raise
+    _count("submitted")
+    print(f"🗂️ Job {record['job_id']} queued: {params['type']} on {params['topic'][:60]}")
+    return record
+
+
+def _start(job_id):
+    global _lambda_client
+    if JOB_RUNNER == "thread":
+        _get_executor().submit(_run_queued, job_id)
+        return
+    if JOB_RUNNER != "lambda":
+        raise ValueError(f"Unknown job runner: {JOB_RUNNER}")
+    if _lambda_client is None:
+        import boto3
+
+        _lambda_client = boto3.client("lambda")
+    _lambda_client.invoke(
+        FunctionName=JOB_FUNCTION_NAME,
+        InvocationType="Event",
+        Payload=json.dumps({"job_run": job_id}).encode("utf-8"),
+    )
+
+
+def _run_queued(job_id):
+    global _queued
+    try:
+        run_job(job_id)
+    finally:
+        with _stats_lock:
+            _queued -= 1
+
+
+# ========== EXECUTION ==========
+def _invoke(prompt, model_id, max_tokens, deadline, **kwargs):
+    """invoke_bedrock holding an in-flight slot, waited for until the job's deadline"""
+    from admission import lease_slots
+    from lambda_handler import invoke_bedrock
+
+    ticket = lease_slots(1, max(0.0, deadline - time.monotonic()), JOB_WATCH_SECONDS)
+    try:
+        return invoke_bedrock(prompt, model_id, max_tokens, **kwargs)
+    finally:
+        ticket.release()
+
+
+def _outline(params, language, deadline):
+    """Section titles from one fast-model call, or numbered fallbacks"""
+    # Imported here: the handler imports this module for its routes
+    from routing import ROUTES
+
+    spec = JOB_TYPES[params["type"]]
+    count = params["count"]
+    titles = []
+    try:
+        text = _invoke(spec["outline"].format(**params, language=language), ROUTES["fast"]["model_id"], 400, deadline, system=None)
+        parsed = json.loads(text[text.index("["):text.rindex("]") + 1])
+        titles = [t.strip() for t in parsed if isinstance(t, str) and t.strip()][:count]
+    except Exception as e:
+        print(f"⚠️ Job outline unusable, numbering sections instead: {str(e)}")
+    return titles + [spec["fallback"].format(number=n) for n in range(len(titles) + 1, count + 1)]
+
+
+def _write_section(job_id, index, title, params, language, retrieved, deadline):
+    from lambda_handler import prepare_generation
+
+    question = JOB_TYPES[params["type"]]["section"].format(**params, title=title)
+    try:
+        prepared = prepare_generation(question, language, retrieved)
+        content = _invoke(prepared["prompt"], prepared["route"]["model_id"], JOB_SECTION_MAX_TOKENS, deadline)
+        section = {"title": title, "status": DONE, "content": content}
+    except Exception as e:
+        print(f"❌ Job section {index + 1} failed: {str(e)}")
+        section = {"title": title, "status": FAILED, "content": "", "error": str(e)}
+
+    def save(record):
+        record["sections"][index] = section
+
+    _update(job_id, save)
+    return section
+
+
+def run_job(job_id, context=None):
+    """Generate a queued job, saving each step to its record; returns the final record"""
+    from batch import run_bounded
+    from language import detect_language
+    from lambda_handler import format_sources, retrieve_context
+
+    trace = start_trace(context)
+    trace.set_path("job")
+    if trace.deadline is None:
+        trace.deadline = trace.started + JOB_MAX_SECONDS
+    deadline = trace.deadline - JOB_RESERVE_SECONDS
+    record = _get_store().get(job_id)
+    if record is None or record["status"] != QUEUED:
+        print(f"⚠️ Job {job_id} is not queued, skipping")
+        return record
+    params = record["params"]
+    annotate("job_type", params["type"])
+    try:
+        language = detect_language(params["topic"])
+        _update(job_id, lambda r: r.update(status=RUNNING, language=language))
+        with span("job_outline"):
+            titles = _outline(params, language, deadline)
+        _update(job_id, lambda r: r.update(sections=[{"title": t, "status": "pending", "content": ""} for t in titles]))
+
+        with span("job_retrieval"):
+            retrieved = retrieve_context(params["topic"], language, min(JOB_RETRIEVAL_SECONDS, max(1.0, deadline - time.monotonic())))
+        sources = format_sources(retrieved["sources"], retrieved["news_articles"])
+        _update(job_id, lambda r: r.update(sources=sources))
+
+        with span("job_sections"):
+            outcomes = run_bounded(
+                lambda item: _write_section(job_id, item[0], item[1], params, language, retrieved, deadline),
+                list(enumerate(titles)),
+                JOB_SECTION_CONCURRENCY,
+                deadline - time.monotonic(),
+            )
+        written = sum(1 for section, error in outcomes if error is None and section["status"] == DONE)
+        if not written:
+            raise RuntimeError("No section could be written")
+
+        def finish(record):
+            for section in record["sections"]:
+                if section["status"] == "pending":
+                    section.update(status=FAILED, error="Job deadline exceeded")
+            record["status"] = DONE
+
+        _update(job_id, finish)
+        _count("done")
+        print(f"✅ Job {job_id} done: {written}/{len(titles)} sections")
+    except Exception as e:
+        print(f"❌ Job {job_id} failed: {str(e)}")
+        message = str(e)
+        _update(job_id, lambda r: r.update(status=FAILED, error=message))
+        _count("failed")
+    finally:
+        annotate("job_status", (_get_store().get(job_id) or {}).get("status"))
+        trace.emit()
+    return get_job(job_id)
+
+
+# ========== WATCHING ==========
+def job_events(job_id, seconds=JOB_SUBSCRIBE_SECONDS):
+    """(event, data) pairs as a job advances: the job so far, then each
+    finished section and progress change, until it ends or seconds pass.
+
+    A client whose stream ends before the job does subscribes again.
+    """
+    job = get_job(job_id)
+    if job is None:
+        return
+    yield "job", job
+    seen = {i for i, s in enumerate(job["sections"]) if s["status"] != "pending"}
+    version = job["version"]
+    stop_at = time.monotonic() + seconds
+    while job["status"] not in FINISHED and time.monotonic() < stop_at:
+        time.sleep(JOB_WATCH_SECONDS)
+        job = get_job(job_id)
+        if job is None:
+            return
+        if job["version"] == version and job["status"] not in FINISHED:
+            continue
+        version = job["version"]
+        for index, section in enumerate(job["sections"]):
+            if section["status"] != "pending" and index not in seen:
+                seen.add(index)
+                yield "section", {"index": index, **section}
+        progress = {key: job.get(key) for key in ("status", "progress", "error")}
+        if job["status"] == DONE:
+            progress["document"] = job["document"]
+        yield "progress", progress
+
+
+def job_stats():
+    """Submitted, finished and failed jobs, and jobs queued here, in this container"""
+    with _stats_lock:
+        return {**_stats, "queued": _queued, "runner": JOB_RUNNER}
@@ -0,0 +1,327 @@
+"""Local knowledge base: a BM25 inverted index stored as one mmap-able file.
+
+Build it offline from curated course material (Markdown / text files) and
+from the sources earlier answers harvested (JSONL, see KB_HARVEST_PATH):
+
+    python kb_index.py build --source course/ --harvest harvest.jsonl --out kb.idx
+    python kb_index.py query --index kb.idx "what is photosynthesis"
+
+File layout (little endian):
+
+    header    magic, n_docs, n_terms, avgdl, section offsets
+    terms     n_terms x (term hash u64, first posting u32, df u32), sorted by hash
+    postings  (doc id u32, term frequency u16) runs, one per term
+    lengths   n_docs x doc length u32
+    doc table n_docs x (offset u64, size u32) into the doc store
+    docs      JSON records {title, url, text}
+
+Nothing is parsed at load time; lookups binary-search the term table in the
+mapped file and only the top hits' JSON records are decoded.
+
+Raw BM25 scores grow with the corpus and the query length, so web search is
+skipped on two normalized measures of the best hit instead:
+
+- relevance: its score over that of a passage of average length holding
+  every query term once (about 1.0 for such a passage, up to 2.2);
+- coverage: the share of the query's terms it contains.
+
+KB_MIN_RELEVANCE and KB_MIN_COVERAGE set the bar. To tune them, run
+representative questions through `kb_index.py query`, which prints both
+for each hit, and raise the bar if passages that only share a word or two
+with the question count as strong recall.
+"""
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+
+from answer_cache import STOP_WORDS
+from search_cache import normalize_query
+
+# ========== CONFIGURATION ==========
+KB_INDEX_PATH = os.environ.get("KB_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "kb.idx"))
+KB_HARVEST_PATH = os.environ.get("KB_HARVEST_PATH", "").strip()
+KB_MIN_RELEVANCE = float(os.environ.get("KB_MIN_RELEVANCE", "0.8"))
+KB_MIN_COVERAGE = float(os.environ.get("KB_MIN_COVERAGE", "0.6"))
+PASSAGE_WORDS = 120
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+MAGIC = b"SSBKB001"
+HEADER = struct.Struct("<8sIIfQQQQ")
+TERM = struct.Struct("<QII")
+POSTING = struct.Struct("<IH")
+LENGTH = struct.Struct("<I")
+DOC_REF = struct.Struct("<QI")
+
+_kb = None
+_kb_lock = threading.Lock()
+
+
+# ========== TOKENIZATION ==========
+def tokenize(text):
+    """Content-word tokens shared by the builder and the query path"""
+    return [t for t in normalize_query(text).split() if len(t) > 1 and t not in STOP_WORDS]
+
+
+def term_hash(term):
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+# ========== READER ==========
+class KnowledgeBase:
+    """Read-only view over a memory-mapped index file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.n_docs, self.n_terms, self.avgdl,
+         self._terms_off, self._postings_off, self._lengths_off, self._docs_off) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a knowledge-base index")
+        self._doc_table_off = self._docs_off
+        self._doc_data_off = self._docs_off + self.n_docs * DOC_REF.size
+
+    def _find_term(self, h):
+        lo, hi = 0, self.n_terms - 1
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            mid_hash, first, df = TERM.unpack_from(self._mm, self._terms_off + mid * TERM.size)
+            if mid_hash == h:
+                return first, df
+            if mid_hash < h:
+                lo = mid + 1
+            else:
+                hi = mid - 1
+        return None
+
+    def _doc_length(self, doc_id):
+        return LENGTH.unpack_from(self._mm, self._lengths_off + doc_id * LENGTH.size)[0]
+
+    def document(self, doc_id):
+        offset, size = DOC_REF.unpack_from(self._mm, self._doc_table_off + doc_id * DOC_REF.size)
+        start = self._doc_data_off + offset
+        return json.loads(self._mm[start:start + size].decode("utf-8"))
+
+    def search(self, query, k=5):
+        """Top-k passages by BM25, each with its relevance and query-term coverage"""
+        terms = set(tokenize(query))
+        if not terms or not self.n_docs:
+            return []
+
+        scores = {}
+        matched = {}
+        ideal = 0.0
+        for term in terms:
+            found = self._find_term(term_hash(term))
+            df = found[1] if found else 0
+            idf = math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+            # What the term adds to a passage of average length that has it once
+            ideal += idf
+            if found is None:
+                continue
+            first = found[0]
+            base = self._postings_off + first * POSTING.size
+            for i in range(df):
+                doc_id, tf = POSTING.unpack_from(self._mm, base + i * POSTING.size)
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_length(doc_id) / self.avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+                matched[doc_id] = matched.get(doc_id, 0) + 1
+
+        hits = []
+        for doc_id, score in heapq.nlargest(k, scores.items(), key=lambda item: item[1]):
+            doc = self.document(doc_id)
+            hits.append({
+                "type": "kb",
+                "title": doc.get("title") or "Course notes",
+                "url": doc.get("url", ""),
+                "snippet": doc.get("text", ""),
+                "score": round(score, 3),
+                "relevance": round(score / ideal, 3),
+                "coverage": round(matched[doc_id] / len(terms), 3),
+            })
+        return hits
+
+
+def get_knowledge_base():
+    """Container-wide index, mapped on first use; None when no index is deployed"""
+    global _kb
+    if _kb is None and os.path.exists(KB_INDEX_PATH):
+        with _kb_lock:
+            if _kb is None:
+                try:
+                    _kb = KnowledgeBase(KB_INDEX_PATH)
+                    print(f"📚 Knowledge base loaded: {_kb.n_docs} passages")
+                except Exception as e:
+                    print(f"❌ Knowledge base load error: {str(e)}")
+                    return None
+    return _kb
+
+
+def kb_search(query, k=4):
+    """Query the local index; returns [] when none is available"""
+    kb = get_knowledge_base()
+    if kb is None:
+        return []
+    return kb.search(query, k=k)
+
+
+def is_strong_recall(hits):
+    """True when the best local passage is good enough to skip web search"""
+    if not hits:
+        return False
+    top = hits[0]
+    return top["relevance"] >= KB_MIN_RELEVANCE and top["coverage"] >= KB_MIN_COVERAGE
+
+
+# ========== HARVEST ==========
+_harvest_lock = threading.Lock()
+
+
+def harvest_sources(sources):
+    """Append answer sources to KB_HARVEST_PATH for the next offline build"""
+    if not KB_HARVEST_PATH or not sources:
+        return
+    lines = [
+        json.dumps({"title": s.get("title", ""), "url": s.get("url", ""), "text": s.get("snippet", "")})
+        for s in sources
+        if s.get("type") in ("web", "news") and s.get("snippet")
+    ]
+    if not lines:
+        return
+    try:
+        with _harvest_lock, open(KB_HARVEST_PATH, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+    except OSError as e:
+        print(f"⚠️ Source harvest failed: {str(e)}")
+
+
+# ========== BUILDER ==========
+def _passages_from_text(text, default_title, url=""):
+    title = default_title
+    words = []
+    for block in re.split(r"\n\s*\n", text):
+        block = block.strip()
+        if not block:
+            continue
+        if block.startswith("#"):
+            if words:
+                yield {"title": title, "url": url, "text": " ".join(words)}
+                words = []
+            title = block.splitlines()[0].lstrip("#").strip() or default_title
+            block = "\n".join(block.splitlines()[1:])
+        words.extend(block.split())
+        while len(words) >= PASSAGE_WORDS:
+            yield {"title": title, "url": url, "text": " ".join(words[:PASSAGE_WORDS])}
+            words = words[PASSAGE_WORDS:]
+    if words:
+        yield {"title": title, "url": url, "text": " ".join(words)}
+
+
+def iter_documents(source_dirs, harvest_files):
+    """Passages from course material plus de-duplicated harvested sources"""
+    for root_dir in source_dirs:
+        for dirpath, _, filenames in os.walk(root_dir):
+            for name in sorted(filenames):
+                if not name.endswith((".md", ".txt")):
+                    continue
+                path = os.path.join(dirpath, name)
+                with open(path, encoding="utf-8") as f:
+                    yield from _passages_from_text(f.read(), os.path.splitext(name)[0].replace("_", " "))
+
+    seen = set()
+    for path in harvest_files:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                key = (record.get("url"), record.get("text"))
+                if key in seen or not record.get("text"):
+                    continue
+                seen.add(key)
+                yield {"title": record.get("title", ""), "url": record.get("url", ""), "text": record["text"]}
+
+
+def build_index(documents, out_path):
+    """Write the index file and return the number of passages indexed"""
+    postings = {}
+    lengths = []
+    doc_blobs = []
+    for doc_id, doc in enumerate(documents):
+        tokens = tokenize(f"{doc['title']} {doc['text']}")
+        lengths.append(len(tokens))
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, tf in counts.items():
+            postings.setdefault(term_hash(token), []).append((doc_id, min(tf, 0xFFFF)))
+        doc_blobs.append(json.dumps(doc, ensure_ascii=False).encode("utf-8"))
+
+    n_docs = len(lengths)
+    avgdl = (sum(lengths) / n_docs) if n_docs else 0.0
+    sorted_terms = sorted(postings)
+
+    terms_off = HEADER.size
+    postings_off = terms_off + len(sorted_terms) * TERM.size
+    n_postings = sum(len(p) for p in postings.values())
+    lengths_off = postings_off + n_postings * POSTING.size
+    docs_off = lengths_off + n_docs * LENGTH.size
+
+    tmp_path = f"{out_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, n_docs, len(sorted_terms), avgdl, terms_off, postings_off, lengths_off, docs_off))
+        first = 0
+        for h in sorted_terms:
+            f.write(TERM.pack(h, first, len(postings[h])))
+            first += len(postings[h])
+        for h in sorted_terms:
+            f.write(b"".join(POSTING.pack(doc_id, tf) for doc_id, tf in postings[h]))
+        f.write(b"".join(LENGTH.pack(n) for n in lengths))
+        offset = 0
+        for blob in doc_blobs:
+            f.write(DOC_REF.pack(offset, len(blob)))
+            offset += len(blob)
+        for blob in doc_blobs:
+            f.write(blob)
+    os.replace(tmp_path, out_path)
+    return n_docs
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build or query the local knowledge-base index")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="index course material and harvested sources")
+    build.add_argument("--source", action="append", default=[], help="directory of .md/.txt course material")
+    build.add_argument("--harvest", action="append", default=[], help="JSONL file of harvested answer sources")
+    build.add_argument("--out", default=KB_INDEX_PATH)
+
+    query = sub.add_parser("query", help="run a query against an index")
+    query.add_argument("--index", default=KB_INDEX_PATH)
+    query.add_argument("-k", type=int, default=5)
+    query.add_argument("text")
+
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        n_docs = build_index(iter_documents(args.source, args.harvest), args.out)
+        print(f"✅ Indexed {n_docs} passages into {args.out}")
+    else:
+        hits = KnowledgeBase(args.index).search(args.text, k=args.k)
+        for hit in hits:
+            print(f"{hit['score']:7.3f}  rel={hit['relevance']:.2f}  cov={hit['coverage']:.2f}  {hit['title']}  {hit['url']}")
+        print(f"strong recall: {is_strong_recall(hits)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,64 @@
 import os
 import json
-import boto3
-import urllib.request
-import urllib.error
+import base64
+import itertools
+import math
+import time
 from datetime import datetime
+from urllib.parse import urlencode
+from admission import AdmissionDenied, admit
+from answer_cache import lookup_answer, store_answer
+from bedrock_dispatch import BedrockBusy, dispatch, dispatch_stats, served_by
+from batch import (
+    BATCH_BEDROCK_CONCURRENCY, BATCH_MAX_ITEMS, BATCH_RETRIEVAL_CONCURRENCY,
+    batch_deadline, dedupe_questions, group_related, run_bounded,
+)
+from context_assembly import assemble_context
+from gate import decide_retrieval
+from images import MAX_BODY_CHARS, ImageError, image_block, image_summary, prepare_image
+from jobs import (
+    JOB_ADMISSION_COST, JOB_POLL_SECONDS, JobError, get_job, job_events, job_params, run_job,
+    submit_job, valid_job_id,
+)
+from kb_index import harvest_sources, is_strong_recall, kb_search
+from language import detect_language, detect_many
+from prompts import (
+    TUTOR_SYSTEM_PROMPT, disable_cache, is_cache_rejection, record_usage, system_blocks,
+    uncached_system, usage_totals, uses_cache,
+)
+from resilience import call_upstream, resilience_stats
+from resources import http_request, pool_stats
+from response_encoding import (
+    compact_response, compact_sources as compact_wire_sources, dumps, encode_body, encoding_headers,
+    negotiate_encoding, wants_compact_sources,
+)
+from retrieval import fan_out, retrieval_deadline
+from routing import ROUTES, route_query
+from search_cache import cached_search, search_cache_stats
+from singleflight import SINGLEFLIGHT_ENABLED, FlightAbandoned, join_flight
+from sessions import (
+    compact_sources, history_for_prompt, is_follow_up, load_session, record_turn,
+    session_sources, valid_session_id,
+)
+from streaming import iter_bedrock_deltas, sse_frame, wants_stream
+from tracing import annotate, record, span, start_trace, summarize_event
 
 # ========== CONFIGURATION ==========
-INFERENCE_PROFILE_ARN = os.environ.get("INFERENCE_PROFILE_ARN", "").strip()
 TAVILY_API_KEY = os.environ.get("TAVILY_API_KEY", "").strip()
 NEWS_API_KEY = os.environ.get("NEWS_API_KEY", "").strip()
 
+# Overridable so benchmarks can point the handler at local stubs
+TAVILY_URL = os.environ.get("TAVILY_URL", "https://api.tavily.com/search")
+NEWS_API_URL = os.environ.get("NEWS_API_URL", "https://newsapi.org/v2/everything")
+
+# Raw text kept per hit for context assembly; only "snippet" is sent to the browser
+MAX_CONTENT_CHARS = 3000
+
+# Tavily domain filters that favour sources in the student's language
+LANGUAGE_DOMAINS = {
+    "es": ["es.wikipedia.org", ".es", ".mx", ".ar", ".co", ".cl"],
+}
+
 # ========== CORS Configuration ==========
 def get_cors_headers(event):
     """Return proper CORS headers for the request"""
@@ -37,106 +86,172 @@ def get_cors_headers(event):
         "Access-Control-Allow-Credentials": "true"
     }
 
+def client_identity(event, body):
+    """(principal, client id) that admission control meters a request under.
+
+    The principal is the authorizer's verified user, else the source IP;
+    ids in the body or headers are the caller's own choice, so they are
+    only ever the secondary key.
+    """
+    headers = event.get("headers") or {}
+    request_context = event.get("requestContext") or {}
+    authorizer = request_context.get("authorizer") or {}
+    claims = (authorizer.get("jwt") or {}).get("claims") or authorizer.get("claims") or {}
+    user = claims.get("sub") or (authorizer.get("iam") or {}).get("userArn")
+    if user:
+        principal = f"user:{user}"
+    else:
+        source_ip = (
+            (request_context.get("http") or {}).get("sourceIp")
+            or (request_context.get("identity") or {}).get("sourceIp")
+        )
+        principal = f"ip:{source_ip}" if source_ip else "anonymous"
+    client_id = (
+        body.get("client_id") if isinstance(body.get("client_id"), str) else None
+    ) or (
+        body.get("session_id") if valid_session_id(body.get("session_id")) else None
+    ) or headers.get("x-client-id") or headers.get("X-Client-Id")
+    return principal[:200], client_id[:128] if client_id else None
+
+def _too_many_requests(cors_headers, denied):
+    """429 with Retry-After (readable by the browser) for a request admission control refused"""
+    retry_after = max(1, math.ceil(denied.retry_after))
+    print(f"🚧 Admission denied ({denied.reason}), retry after {retry_after}s")
+    annotate("admission", denied.reason)
+    headers = {**cors_headers, "Retry-After": str(retry_after), "Access-Control-Expose-Headers": "Retry-After"}
+    return _json_response(429, headers, {
+        "error": "Too many requests",
+        "reason": denied.reason,
+        "retry_after_s": retry_after,
+        "message": "Lots of students are asking right now. Please try again in a moment."
+    })
+
+def _service_busy(cors_headers, retry_after, details):
+    """503 with Retry-After when Bedrock kept throttling through every retry and target"""
+    headers = {**cors_headers, "Retry-After": str(retry_after), "Access-Control-Expose-Headers": "Retry-After"}
+    return _json_response(503, headers, {
+        "error": "AI service busy",
+        "details": details,
+        "retry_after_s": retry_after,
+        "message": "The AI service is very busy right now. Please try again in a moment."
+    })
+
+def _release_after(chunks, ticket):
+    """Hold the admission ticket until a streamed answer has been fully generated"""
+    try:
+        yield from chunks
+    finally:
+        ticket.release()
+
 # ========== TAVILY SEARCH ==========
-def tavily_search(query, max_results=6):
-    """Search using Tavily API for educational content"""
+@cached_search("tavily")
+def tavily_search(query, max_results=6, timeout=15, language="en", include_domains=None):
+    """Search using Tavily API for educational content.
+
+    Upstream errors propagate (the caller's fan-out falls back) so the
+    resilience layer can count them; timeout is a ceiling it may lower.
+    """
     if not TAVILY_API_KEY:
         print("⚠️ TAVILY_API_KEY not configured")
         return {"results": [], "answer": None}
     
-    try:
-        url = "https://api.tavily.com/search"
-        payload = {
-            "api_key": TAVILY_API_KEY,
-            "query": query,
-            "search_depth": "advanced",
-            "max_results": max_results,
-            "include_answer": True,
-            "include_images": False,
-            "topic": "general",
-        }
-        
-        req = urllib.request.Request(
-            url,
-            data=json.dumps(payload).encode("utf-8"),
-            headers={"Content-Type": "application/json"},
-            method="POST"
-        )
-        
-        with urllib.request.urlopen(req, timeout=15) as response:
-            data = json.loads(response.read().decode("utf-8"))
-            
-        results = []
-        for r in data.get("results", []):
-            results.append({
-                "title": r.get("title", "Source"),
-                "url": r.get("url", ""),
-                "snippet": (r.get("content") or "")[:400],
-                "score": r.get("score", 0)
-            })
-        
-        return {
-            "results": results[:max_results],
-            "answer": data.get("answer")
-        }
+    url = TAVILY_URL
+    payload = {
+        "api_key": TAVILY_API_KEY,
+        "query": query,
+        "search_depth": "advanced",
+        "max_results": max_results,
+        "include_answer": True,
+        "include_images": False,
+        "topic": "general",
+    }
+    
+    domains = include_domains if include_domains is not None else LANGUAGE_DOMAINS.get(language)
+    if domains:
+        payload["include_domains"] = domains
+    
+    body = json.dumps(payload).encode("utf-8")
+    raw = call_upstream(
+        "tavily",
+        lambda t: http_request("POST", url, body=body, headers={"Content-Type": "application/json"}, timeout=t),
+        timeout
+    )
+    data = json.loads(raw.decode("utf-8"))
         
-    except Exception as e:
-        print(f"❌ Tavily search error: {str(e)}")
-        return {"results": [], "answer": None}
+    results = []
+    for r in data.get("results", []):
+        results.append({
+            "title": r.get("title", "Source"),
+            "url": r.get("url", ""),
+            "snippet": (r.get("content") or "")[:400],
+            "content": (r.get("content") or "")[:MAX_CONTENT_CHARS],
+            "score": r.get("score", 0)
+        })
+    
+    return {
+        "results": results[:max_results],
+        "answer": data.get("answer")
+    }
 
 # ========== NEWS API SEARCH ==========
-def news_search(query, max_results=3):
-    """Search recent news using NewsAPI"""
+@cached_search("newsapi")
+def news_search(query, max_results=3, timeout=10, language="en"):
+    """Search recent news using NewsAPI; upstream errors propagate like tavily_search"""
     if not NEWS_API_KEY:
         print("⚠️ NEWS_API_KEY not configured")
         return []
     
-    try:
-        url = "https://newsapi.org/v2/everything"
-        params = {
-            "q": query,
-            "apiKey": NEWS_API_KEY,
-            "sortBy": "relevancy",
-            "pageSize": max_results,
-            "language": "en"
-        }
-        
-        query_string = "&".join([f"{k}={v}" for k, v in params.items()])
-        full_url = f"{url}?{query_string}"
-        
-        req = urllib.request.Request(full_url)
-        with urllib.request.urlopen(req, timeout=10) as response:
-            data = json.loads(response.read().decode("utf-8"))
-        
-        articles = []
-        for article in data.get("articles", [])[:max_results]:
-            articles.append({
-                "title": article.get("title", "Article"),
-                "url": article.get("url", ""),
-                "snippet": article.get("description", "")[:300],
-                "source": article.get("source", {}).get("name", "Unknown")
-            })
-        
-        return articles
-        
-    except Exception as e:
-        print(f"❌ NewsAPI error: {str(e)}")
-        return []
+    params = {
+        "q": query,
+        "apiKey": NEWS_API_KEY,
+        "sortBy": "relevancy",
+        "pageSize": max_results,
+        "language": language
+    }
+    
+    full_url = f"{NEWS_API_URL}?{urlencode(params)}"
+    
+    raw = call_upstream("newsapi", lambda t: http_request("GET", full_url, timeout=t), timeout)
+    data = json.loads(raw.decode("utf-8"))
+    
+    articles = []
+    for article in data.get("articles", [])[:max_results]:
+        articles.append({
+            "title": article.get("title", "Article"),
+            "url": article.get("url", ""),
+            "snippet": (article.get("description") or "")[:300],
+            "content": " ".join(filter(None, [article.get("description"), article.get("content")]))[:MAX_CONTENT_CHARS],
+            "source": (article.get("source") or {}).get("name", "Unknown"),
+            "published": article.get("publishedAt", "")
+        })
+    
+    return articles
 
 # ========== BUILD EDUCATIONAL PROMPT ==========
-def build_educational_prompt(user_query, web_results, news_results):
+def build_educational_prompt(user_query, web_results, news_results, history=None):
     """Create a comprehensive educational prompt with context"""
     
     sections = []
     
+    # Earlier turns of the session: rolling summary plus the newest turns verbatim
+    if history and (history["summary"] or history["turns"]):
+        sections.append("=== CONVERSATION SO FAR ===")
+        if history["summary"]:
+            sections.append(f"Summary of earlier turns:\n{history['summary']}")
+        for turn in history["turns"]:
+            sections.append(f"\nStudent: {turn['question']}\nTutor: {turn['answer']}")
+        sections.append("")
+    
     # Add web search context
     if web_results:
         sections.append("=== RELIABLE SOURCES ===")
         for i, source in enumerate(web_results, 1):
             sections.append(f"\n[{i}] {source['title']}")
-            sections.append(f"URL: {source['url']}")
-            if source.get('snippet'):
-                sections.append(f"Content: {source['snippet']}")
+            if source.get('url'):
+                sections.append(f"URL: {source['url']}")
+            passage = source.get('passage') or source.get('snippet')
+            if passage:
+                sections.append(f"Content: {passage}")
     
     # Add news context if available
     if news_results:
@@ -144,28 +259,19 @@ def build_educational_prompt(user_query, web_results, news_results):
         for i, article in enumerate(news_results, 1):
             sections.append(f"\n[N{i}] {article['title']}")
             sections.append(f"Source: {article['source']}")
-            if article.get('snippet'):
-                sections.append(f"Summary: {article['snippet']}")
+            passage = article.get('passage') or article.get('snippet')
+            if passage:
+                sections.append(f"Summary: {passage}")
     
     context = "\n".join(sections)
     
-    prompt = f"""You are Smart Study Buddy, an expert AI tutor that helps students learn effectively.
-
-{context}
-
-STUDENT'S QUESTION: {user_query}
+    # The tutor instructions are the system prompt (prompts.py), cached where
+    # the model allows; only this per-request part is new on every call
+    prompt = f"""{context}
 
-YOUR TASK:
-1. Provide a clear, step-by-step explanation using the sources above
-2. Break down complex concepts into simple, understandable parts
-3. Use real-world examples and analogies where helpful
-4. Cite sources inline using [1], [2], [N1], etc.
-5. Structure your response with headers and bullet points for clarity
-6. End with 2-3 follow-up questions to deepen understanding
+STUDENT'S QUESTION: {user_query}"""
 
-Keep your tone friendly, educational, and encouraging. Make learning enjoyable!"""
-
-    return prompt
+    return prompt.lstrip()
 
 # ========== EXTRACT BEDROCK RESPONSE ==========
 def extract_bedrock_text(response_body):
@@ -192,149 +298,803 @@ def extract_bedrock_text(response_body):
         print(f"❌ Error extracting text: {e}")
         return "Error processing response"
 
+# ========== BEDROCK ==========
+FALLBACK_ANSWER = "I apologize, but I couldn't generate a proper response. Please try rephrasing your question."
+
+def build_bedrock_payload(prompt, max_tokens=2000, image=None, model_id=None, system=TUTOR_SYSTEM_PROMPT):
+    """Anthropic messages payload: the system prompt (cached where it can be), then one user turn, optionally with one image"""
+    content = [image_block(image)] if image else []
+    content.append({"type": "text", "text": prompt})
+    payload = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "temperature": 0.7,
+        "messages": [
+            {
+                "role": "user",
+                "content": content
+            }
+        ]
+    }
+    if system:
+        payload["system"] = system_blocks(model_id, system)
+    return payload
+
+def _call_bedrock(method, model_id, payload):
+    """invoke_model(_with_response_stream), retried once without cache_control if the model rejects it"""
+    try:
+        return method(
+            modelId=model_id,
+            body=json.dumps(payload).encode("utf-8"),
+            accept="application/json",
+            contentType="application/json"
+        )
+    except Exception as e:
+        if not (uses_cache(payload) and is_cache_rejection(e)):
+            raise
+        disable_cache(model_id, e)
+        payload = {**payload, "system": uncached_system(payload["system"])}
+        return _call_bedrock(method, model_id, payload)
+
+def invoke_bedrock(prompt, model_id, max_tokens=2000, image=None, system=TUTOR_SYSTEM_PROMPT):
+    """Generate the full answer in one call"""
+    payload = build_bedrock_payload(prompt, max_tokens, image, model_id, system)
+    with span("bedrock"):
+        response = dispatch(model_id, lambda client, target_model: _call_bedrock(client.invoke_model, target_model, payload))
+        response_body = json.loads(response["body"].read().decode("utf-8"))
+    record_usage(response_body.get("usage"))
+    return extract_bedrock_text(response_body).strip()
+
+def stream_bedrock(prompt, model_id, max_tokens=2000, image=None, system=TUTOR_SYSTEM_PROMPT):
+    """Yield answer text deltas as Bedrock generates them"""
+    payload = build_bedrock_payload(prompt, max_tokens, image, model_id, system)
+    response = dispatch(
+        model_id,
+        lambda client, target_model: _call_bedrock(client.invoke_model_with_response_stream, target_model, payload),
+        "stream"
+    )
+    yield from iter_bedrock_deltas(response, on_usage=record_usage)
+
+# ========== PIPELINE STAGES ==========
+def _configured_providers():
+    return tuple(name for name, key in (("tavily", TAVILY_API_KEY), ("newsapi", NEWS_API_KEY)) if key)
+
+def retrieve_context(user_query, language, budget):
+    """Local knowledge base first, then the web providers the gate asks for, concurrently under one deadline"""
+    
+    with span("search.kb"):
+        kb_hits = kb_search(user_query)
+    kb_used = is_strong_recall(kb_hits)
+    
+    # Evergreen questions skip news, covered or self-contained ones skip the web too
+    with span("retrieval_gate"):
+        gate = decide_retrieval(user_query, kb_hits, configured=_configured_providers())
+    annotate("retrieval_gate", gate["decision"])
+    
+    providers = {}
+    if "newsapi" in gate["providers"]:
+        providers["newsapi"] = (
+            lambda: news_search(user_query, max_results=2, timeout=min(10, budget), language=language),
+            [],
+        )
+    if "tavily" in gate["providers"]:
+        providers["tavily"] = (
+            lambda: tavily_search(user_query, max_results=5, timeout=min(15, budget), language=language),
+            {"results": [], "answer": None},
+        )
+    retrieval = fan_out(providers, budget)
+    for outcome in ("timed_out", "failed", "skipped"):
+        if retrieval[outcome]:
+            annotate(f"providers_{outcome}", retrieval[outcome])
+    annotate("upstreams", {
+        name: {"state": stats["state"], "timeout_s": stats["timeout_s"]}
+        for name, stats in resilience_stats().items()
+    })
+    
+    web_results = retrieval["results"].get("tavily", {"results": [], "answer": None})
+    sources = (kb_hits if kb_used else []) + web_results.get("results", [])
+    news_articles = retrieval["results"].get("newsapi", [])
+    
+    print(f"🔍 Found {len(sources)} sources ({'knowledge base' if kb_used else 'web'}) and {len(news_articles)} news articles in {retrieval['elapsed_ms']}ms")
+    
+    return {
+        "kb_hits": kb_hits,
+        "kb_used": kb_used,
+        "gate": gate,
+        "retrieval": retrieval,
+        "sources": sources,
+        "news_articles": news_articles
+    }
+
+def prepare_generation(user_query, language, retrieved, image=None, session_id=None, history=None):
+    """Assemble context, route and build the prompt for one question"""
+    
+    # Dedupe, rank and trim everything retrieved into the prompt's token budget
+    with span("context_assembly"):
+        sources, news_articles, context_stats = assemble_context(
+            user_query, retrieved["sources"], retrieved["news_articles"]
+        )
+    
+    trace = {
+        "answer_cache": {"hit": False, "skipped": image is not None},
+        "kb_used": retrieved["kb_used"],
+        "kb_top_score": retrieved["kb_hits"][0]["score"] if retrieved["kb_hits"] else None,
+        "kb_top_relevance": retrieved["kb_hits"][0]["relevance"] if retrieved["kb_hits"] else None,
+        "web_used": any(s.get("type", "web") == "web" for s in sources) or bool(news_articles),
+        "retrieval_gate": retrieved.get("gate"),
+        "context": context_stats
+    }
+    
+    # Route by question complexity: fast tier for simple asks, Sonnet for hard ones
+    route = route_query(user_query, context_stats, has_image=image is not None)
+    trace["route"] = {"tier": route["tier"], "score": route["score"], "features": route["features"]}
+    metadata = {**build_metadata(sources, news_articles, retrieved["retrieval"], route), "language": language}
+    if image:
+        metadata["image"] = image_summary(image)
+    annotate("model_tier", route["tier"])
+    
+    with span("prompt_build"):
+        prompt = build_educational_prompt(user_query, sources, news_articles, history)
+    
+    return {
+        "user_query": user_query,
+        "language": language,
+        "prompt": prompt,
+        "route": route,
+        "image": image,
+        "all_sources": format_sources(sources, news_articles),
+        "session_id": session_id,
+        # Only kept for sessions: the next turn may answer a follow-up from these
+        "context_sources": compact_sources(sources, news_articles) if session_id else [],
+        "history_used": bool(history and (history["summary"] or history["turns"])),
+        "metadata": metadata,
+        "trace": trace
+    }
+
+def summarize_history(summary, turns, language):
+    """Fold older session turns into the rolling summary with the fast model"""
+    transcript = "\n".join(f"Student: {t['question']}\nTutor: {t['answer'][:1500]}" for t in turns)
+    prompt = f"""Update the summary of a tutoring session. Keep what the student asked, what was explained and anything they struggled with, in at most 120 words of plain bullet points. Write it in the language with code "{language}".
+
+CURRENT SUMMARY:
+{summary or "(none)"}
+
+NEW TURNS:
+{transcript}
+
+UPDATED SUMMARY:"""
+    return invoke_bedrock(prompt, ROUTES["fast"]["model_id"], 300, system=None).strip()
+
+def remember_answer(prepared, answer_text):
+    """Cache a generated answer and harvest its sources for the knowledge base"""
+    if prepared.get("session_id"):
+        record_turn(
+            prepared["session_id"], prepared["user_query"], answer_text,
+            prepared["context_sources"], prepared["language"], summarize=summarize_history
+        )
+    # Answers built on partial context are not worth pinning in the cache, an
+    # answer about an image says nothing about the same question without it,
+    # and one shaped by earlier turns only makes sense within its session
+    if prepared["metadata"]["partial_context"] or prepared.get("image") or prepared.get("history_used"):
+        return
+    store_answer(
+        prepared["user_query"], prepared["language"], answer_text,
+        prepared["all_sources"], prepared["route"]["model_id"]
+    )
+    harvest_sources(prepared["all_sources"])
+
+def generate_answer(prepared):
+    """Blocking Bedrock call for a prepared question; raises on service errors"""
+    route = prepared["route"]
+    answer_text = invoke_bedrock(prepared["prompt"], route["model_id"], route["max_tokens"], prepared.get("image"))
+    if not answer_text:
+        return FALLBACK_ANSWER
+    remember_answer(prepared, answer_text)
+    return answer_text
+
+# ========== RESPONSE ==========
+def format_sources(sources, news_articles):
+    """Flatten web and news results into the list the frontend renders"""
+    all_sources = []
+    
+    # Add web and knowledge-base sources
+    for source in sources:
+        all_sources.append({
+            "type": source.get("type", "web"),
+            "title": source["title"],
+            "url": source["url"],
+            "snippet": source.get("snippet", "")
+        })
+    
+    # Add news sources
+    for article in news_articles:
+        all_sources.append({
+            "type": "news",
+            "title": article["title"],
+            "url": article["url"],
+            "snippet": article.get("snippet", ""),
+            "source": article.get("source", "")
+        })
+    
+    return all_sources
+
+def build_metadata(sources, news_articles, retrieval, route):
+    """Response metadata shared by the JSON and streaming paths"""
+    return {
+        "web_sources_found": sum(1 for s in sources if s.get("type", "web") == "web"),
+        "kb_sources_found": sum(1 for s in sources if s.get("type") == "kb"),
+        "news_articles_found": len(news_articles),
+        "timestamp": datetime.utcnow().isoformat(),
+        "model_used": route["model_id"],
+        "model_tier": route["tier"],
+        "max_tokens": route["max_tokens"],
+        "retrieval_ms": retrieval["elapsed_ms"],
+        "providers_timed_out": retrieval["timed_out"],
+        "providers_failed": retrieval.get("failed", []),
+        "providers_skipped": retrieval.get("skipped", []),
+        "partial_context": bool(retrieval["timed_out"] or retrieval.get("failed") or retrieval.get("skipped"))
+    }
+
+def _json_response(status_code, cors_headers, data, compact=False):
+    with span("serialize"):
+        body = dumps(compact_response(data) if compact else data)
+    return status_code, {**cors_headers, "Content-Type": "application/json"}, [body]
+
+def _sse_frames(events, compact=False):
+    """Encode (event, data) pairs as SSE frames, with compact sources when asked"""
+    for name, data in events:
+        if compact and name == "sources":
+            data = compact_wire_sources(data)
+        yield sse_frame(name, data)
+
+def _stream_frames(prepared, compact=False):
+    """SSE frames: sources first, then text deltas, then final metadata"""
+    return _sse_frames(_answer_events(prepared), compact)
+
+def _answer_events(prepared):
+    """(event, data) pairs of a streamed answer, shared by SSE and single flights"""
+    route = prepared["route"]
+    yield "sources", prepared["all_sources"]
+    
+    started = time.monotonic()
+    first_token_ms = None
+    deltas = []
+    try:
+        with span("bedrock"):
+            for delta in stream_bedrock(prepared["prompt"], route["model_id"], route["max_tokens"], prepared.get("image")):
+                if first_token_ms is None:
+                    first_token_ms = int((time.monotonic() - started) * 1000)
+                deltas.append(delta)
+                yield "delta", {"text": delta}
+    except Exception as e:
+        error_msg = str(e)
+        print(f"❌ Bedrock stream error: {error_msg}")
+        annotate("error", "bedrock")
+        if isinstance(e, BedrockBusy):
+            yield "error", {"error": "AI service busy", "details": error_msg, "retry_after_s": e.retry_after}
+        else:
+            yield "error", {"error": "AI service error", "details": error_msg}
+        return
+    record("bedrock_first_token", first_token_ms)
+    
+    answer_text = "".join(deltas).strip()
+    if not answer_text:
+        yield "delta", {"text": FALLBACK_ANSWER}
+    else:
+        remember_answer(prepared, answer_text)
+    
+    print(f"✅ Streamed answer: {len(answer_text)} characters, first token after {first_token_ms}ms")
+    yield "metadata", {
+        **prepared["metadata"],
+        "time_to_first_token_ms": first_token_ms,
+        "resource_pool": pool_stats(),
+        "search_cache": search_cache_stats(),
+        "upstreams": resilience_stats(),
+        "usage": usage_totals(),
+        "served_by": served_by(),
+        "bedrock_targets": dispatch_stats(),
+        "trace": prepared["trace"]
+    }
+
+def _cached_frames(cached, metadata, trace, compact=False):
+    """Replay a cached answer with the same frame sequence as a live stream"""
+    yield from _sse_frames([
+        ("sources", cached["sources"]),
+        ("delta", {"text": cached["answer"]}),
+        ("metadata", {**metadata, "time_to_first_token_ms": 0, "trace": trace}),
+    ], compact)
+
+def _cached_answer_response(event, body, cors_headers, cached, language):
+    """Serve a near-duplicate question straight from the answer cache"""
+    trace = {"answer_cache": {"hit": True, "similarity": cached["similarity"], "age_s": cached["age_s"]}}
+    metadata = {
+        "web_sources_found": sum(1 for s in cached["sources"] if s.get("type") == "web"),
+        "news_articles_found": sum(1 for s in cached["sources"] if s.get("type") == "news"),
+        "timestamp": datetime.utcnow().isoformat(),
+        "model_used": cached["model_used"],
+        "language": language
+    }
+    print(f"💾 Answer cache hit (similarity {cached['similarity']}, {cached['age_s']}s old)")
+    
+    if wants_stream(event, body):
+        stream_headers = {**cors_headers, "Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+        return 200, stream_headers, _cached_frames(cached, metadata, trace, wants_compact_sources(body))
+    
+    return _json_response(200, cors_headers, {
+        "answer": cached["answer"],
+        "sources": cached["sources"],
+        "language": language,
+        "metadata": metadata,
+        "trace": trace
+    }, wants_compact_sources(body))
+
+# ========== SINGLE FLIGHT ==========
+def _has_history(session):
+    return bool(session and (session["turns"] or session["summary"]))
+
+def _flight_events(user_query, language, context, ticket):
+    """Retrieval and generation run once for every identical request in a flight"""
+    try:
+        retrieved = retrieve_context(user_query, language, retrieval_deadline(context))
+        # No student's history goes in: the answer is shared, like an answer cache hit
+        prepared = prepare_generation(user_query, language, retrieved)
+        prepared["metadata"]["admission"] = ticket.summary()
+        yield from _answer_events(prepared)
+    finally:
+        ticket.release()
+
+def _subscriber_events(events, role, user_query, language, session_id):
+    """One request's view of a flight: its own metadata, and its own session turn once answered"""
+    sources, deltas, failed = [], [], False
+    for name, data in events:
+        if name == "sources":
+            sources = data
+        elif name == "delta":
+            deltas.append(data["text"])
+        elif name == "error":
+            failed = True
+        elif name == "metadata":
+            # Usage is what this request spent; only the leader's trace carries the Bedrock calls
+            data = {**data, "usage": usage_totals(), "single_flight": {"role": role}}
+            if session_id:
+                data["session_id"] = session_id
+        yield name, data
+    if session_id and deltas and not failed:
+        record_turn(
+            session_id, user_query, "".join(deltas).strip(), compact_sources(sources, []),
+            language, summarize=summarize_history
+        )
+
+def _flight_response(event, body, cors_headers, context, user_query, language, session_id):
+    """Answer through the question's single flight; None when it must be answered alone"""
+    flight, leader = join_flight(user_query, language)
+    if leader:
+        try:
+            with span("admission"):
+                ticket = admit(*client_identity(event, body))
+        except AdmissionDenied as e:
+            flight.abandon()
+            return _too_many_requests(cors_headers, e)
+        except BaseException:
+            flight.abandon()
+            raise
+        flight.start(_flight_events, user_query, language, context, ticket)
+    else:
+        print(f"🛫 Joining the flight already answering this question ({flight.subscribers + 1} waiting)")
+    role = "leader" if leader else "follower"
+    annotate("single_flight", role)
+    
+    events = flight.subscribe()
+    try:
+        with span("single_flight_wait"):
+            first = next(events)
+    except FlightAbandoned:
+        print("🛬 Shared flight abandoned, answering alone")
+        return None
+    events = _subscriber_events(itertools.chain([first], events), role, user_query, language, session_id)
+    
+    if wants_stream(event, body):
+        stream_headers = {**cors_headers, "Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+        return 200, stream_headers, _sse_frames(events, wants_compact_sources(body))
+    
+    sources, deltas, metadata, error = [], [], {}, None
+    for name, data in events:
+        if name == "sources":
+            sources = data
+        elif name == "delta":
+            deltas.append(data["text"])
+        elif name == "metadata":
+            metadata = data
+        elif name == "error":
+            error = data
+    if error is not None:
+        print(f"❌ Bedrock error: {error['details']}")
+        if "retry_after_s" in error:
+            return _service_busy(cors_headers, error["retry_after_s"], error["details"])
+        return _json_response(500, cors_headers, {
+            **error,
+            "message": "Failed to generate response. Please check Lambda logs."
+        })
+    trace = metadata.pop("trace", {})
+    print(f"📤 Returning shared answer with {len(sources)} sources")
+    return _json_response(200, cors_headers, {
+        "answer": "".join(deltas).strip(),
+        "sources": sources,
+        "language": language,
+        "metadata": metadata,
+        "trace": trace
+    }, wants_compact_sources(body))
+
+# ========== BATCH ==========
+_EMPTY_RETRIEVAL = {
+    "kb_hits": [],
+    "kb_used": False,
+    "retrieval": {"results": {}, "timed_out": ["batch"], "elapsed_ms": 0},
+    "sources": [],
+    "news_articles": []
+}
+
+# A follow-up answered from its session's sources: nothing was searched, nothing is missing
+_SESSION_RETRIEVAL = {
+    "kb_hits": [],
+    "kb_used": False,
+    "retrieval": {"results": {}, "timed_out": [], "elapsed_ms": 0},
+    "sources": [],
+    "news_articles": []
+}
+
+def _handle_batch(prompts, context, cors_headers, client, compact=False):
+    """Answer a worksheet of prompts with shared retrieval and bounded Bedrock parallelism"""
+    started = time.monotonic()
+    if len(prompts) > BATCH_MAX_ITEMS:
+        return _json_response(400, cors_headers, {"error": f"Batch is limited to {BATCH_MAX_ITEMS} prompts"})
+    deadline = started + batch_deadline(context)
+    
+    items = []
+    for index, prompt in enumerate(prompts):
+        prompt = prompt.strip() if isinstance(prompt, str) else ""
+        items.append({
+            "index": index,
+            "prompt": prompt,
+            "answer": None,
+            "sources": [],
+            "cached": False,
+            "error": None if prompt else "Empty prompt"
+        })
+    valid = [item for item in items if item["prompt"]]
+    languages = detect_many([item["prompt"] for item in valid])
+    
+    # Identical questions are answered once
+    units, unit_of = dedupe_questions([(item["prompt"], lang) for item, lang in zip(valid, languages)])
+    unit_results = [None] * len(units)
+    pending = []
+    for u, (question, language) in enumerate(units):
+        cached = lookup_answer(question, language)
+        if cached is None:
+            pending.append(u)
+            continue
+        unit_results[u] = {
+            "answer": cached["answer"],
+            "sources": cached["sources"],
+            "language": language,
+            "model_used": cached["model_used"],
+            "cached": True,
+            "error": None
+        }
+    
+    # Worksheets are metered like that many questions, with their Bedrock parallelism reserved
+    ticket = None
+    if pending:
+        try:
+            with span("admission"):
+                ticket = admit(*client, cost=len(pending), slots=min(len(pending), BATCH_BEDROCK_CONCURRENCY))
+        except AdmissionDenied as e:
+            return _too_many_requests(cors_headers, e)
+    try:
+        generated_units, retrieval_groups = _generate_batch(units, pending, context, deadline)
+    finally:
+        if ticket is not None:
+            ticket.release()
+    for u, result in generated_units.items():
+        unit_results[u] = result
+    
+    for item, u in zip(valid, unit_of):
+        item.update(unit_results[u])
+    
+    errors = sum(1 for item in items if item["error"])
+    print(f"📤 Batch of {len(items)}: {len(units)} unique, {len(pending)} generated, {errors} errors")
+    return _json_response(200, cors_headers, {
+        "items": items,
+        "metadata": {
+            "count": len(items),
+            "unique_questions": len(units),
+            "answer_cache_hits": len(units) - len(pending),
+            "retrieval_groups": retrieval_groups,
+            "errors": errors,
+            "elapsed_ms": int((time.monotonic() - started) * 1000),
+            "timestamp": datetime.utcnow().isoformat(),
+            "usage": usage_totals(),
+            "served_by": served_by(),
+            "admission": ticket.summary() if ticket else None
+        }
+    }, compact)
+
+def _generate_batch(units, pending, context, deadline):
+    """Retrieve and generate the batch units that missed the answer cache; returns (results, retrievals)"""
+    results = {}
+    if not pending:
+        return results, 0
+    # Related questions share one retrieval, run concurrently across groups
+    budget = retrieval_deadline(context)
+    groups = group_related([units[u] for u in pending])
+    leaders = [units[pending[group[0]]] for group in groups]
+    retrieved = run_bounded(
+        lambda leader: retrieve_context(leader[0], leader[1], budget),
+        leaders, BATCH_RETRIEVAL_CONCURRENCY, budget + 1
+    )
+    retrieved_for = {}
+    for group, (result, error) in zip(groups, retrieved):
+        for member in group:
+            retrieved_for[pending[member]] = result if error is None else _EMPTY_RETRIEVAL
+    
+    # Bedrock calls with bounded parallelism inside the remaining time
+    prepared = [prepare_generation(units[u][0], units[u][1], retrieved_for[u]) for u in pending]
+    generated = run_bounded(generate_answer, prepared, BATCH_BEDROCK_CONCURRENCY, deadline - time.monotonic())
+    for u, prep, (answer_text, error) in zip(pending, prepared, generated):
+        if error is not None:
+            print(f"❌ Batch item error: {str(error)}")
+        results[u] = {
+            "answer": answer_text,
+            "sources": prep["all_sources"],
+            "language": prep["language"],
+            "model_used": prep["route"]["model_id"],
+            "cached": False,
+            "error": str(error) if error is not None else None
+        }
+    return results, len(groups)
+
+# ========== JOBS ==========
+def _submit_job(event, body, cors_headers):
+    """202 with the id of a queued study plan or practice set"""
+    try:
+        params = job_params(body["job"])
+    except JobError as e:
+        return _json_response(e.status, cors_headers, {"error": str(e)})
+    # A job costs a few questions' worth of the client's rate; its Bedrock calls lease in-flight slots as it runs
+    try:
+        with span("admission"):
+            admit(*client_identity(event, body), cost=JOB_ADMISSION_COST, slots=0)
+    except AdmissionDenied as e:
+        return _too_many_requests(cors_headers, e)
+    try:
+        job = submit_job(params)
+    except JobError as e:
+        return _json_response(e.status, cors_headers, {"error": str(e)})
+    return _json_response(202, cors_headers, {"job_id": job["job_id"], "status": job["status"], "poll_after_s": JOB_POLL_SECONDS})
+
+def _job_status(event, body, cors_headers):
+    """The job so far as JSON, or its progress as SSE frames"""
+    job_id = body["job_id"]
+    if not valid_job_id(job_id):
+        return _json_response(400, cors_headers, {"error": "Invalid 'job_id'"})
+    job = get_job(job_id)
+    if job is None:
+        return _json_response(404, cors_headers, {"error": "Unknown or expired job"})
+    if wants_stream(event, body):
+        stream_headers = {**cors_headers, "Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+        return 200, stream_headers, _sse_frames(job_events(job_id), wants_compact_sources(body))
+    return _json_response(200, cors_headers, job, wants_compact_sources(body))
+
 # ========== MAIN HANDLER ==========
-def lambda_handler(event, context):
-    """Main Lambda function handler"""
+def handle_event(event, context):
+    """Process one request; returns (status_code, headers, body_chunks).
+
+    body_chunks is a list for JSON responses and a lazy generator of SSE
+    frames when streaming, so a streaming wrapper can flush each frame.
+    The request's stage timings are emitted once the body is complete.
+    """
+    trace = start_trace(context)
     
-    print(f"📥 Received event: {json.dumps(event)}")
+    # Size-capped and image-redacted; the raw event can carry megabytes of base64
+    print(f"📥 Received event: {json.dumps(summarize_event(event))}")
     
+    status_code, headers, chunks = _route_event(event, context, trace)
+    annotate("status", status_code)
+    if isinstance(chunks, list):
+        trace.emit()
+        return status_code, headers, chunks
+    return status_code, headers, trace.wrap_stream(chunks)
+
+def _route_event(event, context, trace):
     # CORS headers
     cors_headers = get_cors_headers(event)
     
     # Handle preflight OPTIONS request
     if event.get("requestContext", {}).get("http", {}).get("method") == "OPTIONS":
-        return {
-            "statusCode": 200,
-            "headers": cors_headers,
-            "body": json.dumps({"message": "CORS preflight OK"})
-        }
+        trace.set_path("preflight")
+        return 200, cors_headers, [json.dumps({"message": "CORS preflight OK"})]
     
-    # Parse request body
+    # Parse request body, refusing oversized payloads before they are parsed
+    trace.set_path("invalid")
+    raw_body = event.get("body")
+    if isinstance(raw_body, str) and len(raw_body) > MAX_BODY_CHARS:
+        return _json_response(413, cors_headers, {"error": "Request body too large"})
     try:
-        body = event.get("body", "{}")
-        if isinstance(body, str):
-            body = json.loads(body)
+        with span("body_parse"):
+            body = event.get("body", "{}")
+            if isinstance(body, str):
+                body = json.loads(body)
     except json.JSONDecodeError as e:
-        return {
-            "statusCode": 400,
-            "headers": {**cors_headers, "Content-Type": "application/json"},
-            "body": json.dumps({"error": f"Invalid JSON: {str(e)}"})
-        }
+        return _json_response(400, cors_headers, {"error": f"Invalid JSON: {str(e)}"})
+    
+    # Batch mode: {"prompts": [...]} answers a whole worksheet in one call
+    if isinstance(body.get("prompts"), list):
+        trace.set_path("batch")
+        return _handle_batch(
+            body["prompts"], context, cors_headers, client_identity(event, body), wants_compact_sources(body)
+        )
+    
+    # Jobs: study plans and practice sets are submitted, then polled or watched
+    if isinstance(body.get("job"), dict):
+        trace.set_path("job_submit")
+        return _submit_job(event, body, cors_headers)
+    if "job_id" in body:
+        trace.set_path("job_status")
+        return _job_status(event, body, cors_headers)
     
     # Get user query (support both 'prompt' and 'query' fields)
     user_query = body.get("prompt") or body.get("query") or ""
     user_query = user_query.strip()
     
     if not user_query:
-        return {
-            "statusCode": 400,
-            "headers": {**cors_headers, "Content-Type": "application/json"},
-            "body": json.dumps({"error": "Missing 'prompt' or 'query' in request body"})
-        }
+        return _json_response(400, cors_headers, {"error": "Missing 'prompt' or 'query' in request body"})
     
     print(f"📝 Processing query: {user_query}")
     
-    # Step 1: Search for context
-    web_results = tavily_search(user_query, max_results=5)
-    news_results = news_search(user_query, max_results=2)
+    # Decode, dedupe and downscale an attached image; the base64 string is dropped once decoded
+    image = None
+    if body.get("image"):
+        try:
+            with span("image_prepare"):
+                image = prepare_image(body.pop("image"))
+        except ImageError as e:
+            return _json_response(e.status, cors_headers, {"error": str(e)})
+        annotate("image_cached", image["cached"])
+    
+    with span("language_detect"):
+        language = detect_language(user_query)
+    annotate("language", language)
+    
+    # Multi-turn: the client's session_id selects the stored history
+    session_id = body.get("session_id") if valid_session_id(body.get("session_id")) else None
+    session, follow_up = None, False
+    if session_id:
+        with span("session_load"):
+            session = load_session(session_id)
+        follow_up = is_follow_up(user_query, session)
+        annotate("follow_up", follow_up)
     
-    sources = web_results.get("results", [])
-    news_articles = news_results
+    # Step 0: Near-duplicate questions are answered from the cache (text-only,
+    # self-contained questions; "why?" means something different every time)
+    cached = None
+    if image is None and not follow_up:
+        with span("answer_cache"):
+            cached = lookup_answer(user_query, language)
+    if cached is not None:
+        trace.set_path("cache_hit")
+        if session_id:
+            record_turn(session_id, user_query, cached["answer"], [], language, summarize=summarize_history)
+        return _cached_answer_response(event, body, cors_headers, cached, language)
     
-    print(f"🔍 Found {len(sources)} web sources and {len(news_articles)} news articles")
+    # Identical questions asked at the same time share one retrieval and generation;
+    # the shared prompt has no history, so only sessions without any may join
+    if SINGLEFLIGHT_ENABLED and image is None and not _has_history(session):
+        trace.set_path("stream" if wants_stream(event, body) else "json")
+        response = _flight_response(event, body, cors_headers, context, user_query, language, session_id)
+        if response is not None:
+            return response
     
-    # Step 2: Build educational prompt
-    educational_prompt = build_educational_prompt(user_query, sources, news_articles)
+    # Admission: only requests that will reach Bedrock are metered, and a
+    # burst waits briefly for capacity before being refused with a 429
+    try:
+        with span("admission"):
+            ticket = admit(*client_identity(event, body))
+    except AdmissionDenied as e:
+        return _too_many_requests(cors_headers, e)
+    try:
+        prepared = _prepare_admitted(user_query, language, image, session_id, session, follow_up, context)
+    except BaseException:
+        ticket.release()
+        raise
+    prepared["metadata"]["admission"] = ticket.summary()
+    
+    # Step 3 (streaming): sources, then deltas, then metadata
+    if wants_stream(event, body):
+        trace.set_path("stream")
+        stream_headers = {**cors_headers, "Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+        return 200, stream_headers, _release_after(_stream_frames(prepared, wants_compact_sources(body)), ticket)
     
     # Step 3: Call Bedrock (Claude)
+    trace.set_path("json")
     try:
-        bedrock_client = boto3.client("bedrock-runtime", region_name="us-east-1")
-        
-        payload = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 2000,
-            "temperature": 0.7,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [{"type": "text", "text": educational_prompt}]
-                }
-            ]
-        }
-        
-        # Use inference profile if configured, otherwise use direct model
-        if INFERENCE_PROFILE_ARN:
-            model_id = INFERENCE_PROFILE_ARN
-            print(f"🤖 Using inference profile: {model_id}")
-        else:
-            model_id = "us.anthropic.claude-3-5-sonnet-20241022-v2:0"
-            print(f"🤖 Using model: {model_id}")
-        
-        response = bedrock_client.invoke_model(
-            modelId=model_id,
-            body=json.dumps(payload).encode("utf-8"),
-            accept="application/json",
-            contentType="application/json"
-        )
-        
-        response_body = json.loads(response["body"].read().decode("utf-8"))
-        answer_text = extract_bedrock_text(response_body).strip()
-        
-        if not answer_text:
-            answer_text = "I apologize, but I couldn't generate a proper response. Please try rephrasing your question."
-        
+        answer_text = generate_answer(prepared)
         print(f"✅ Generated answer: {len(answer_text)} characters")
         
+    except BedrockBusy as e:
+        print(f"❌ Bedrock busy: {str(e)}")
+        return _service_busy(cors_headers, e.retry_after, str(e))
     except Exception as e:
         error_msg = str(e)
         print(f"❌ Bedrock error: {error_msg}")
-        return {
-            "statusCode": 500,
-            "headers": {**cors_headers, "Content-Type": "application/json"},
-            "body": json.dumps({
-                "error": "AI service error",
-                "details": error_msg,
-                "message": "Failed to generate response. Please check Lambda logs."
-            })
-        }
-    
-    # Step 4: Prepare response
-    all_sources = []
-    
-    # Add web sources
-    for source in sources:
-        all_sources.append({
-            "type": "web",
-            "title": source["title"],
-            "url": source["url"],
-            "snippet": source.get("snippet", "")
-        })
-    
-    # Add news sources
-    for article in news_articles:
-        all_sources.append({
-            "type": "news",
-            "title": article["title"],
-            "url": article["url"],
-            "snippet": article.get("snippet", ""),
-            "source": article.get("source", "")
+        return _json_response(500, cors_headers, {
+            "error": "AI service error",
+            "details": error_msg,
+            "message": "Failed to generate response. Please check Lambda logs."
         })
+    finally:
+        ticket.release()
     
+    # Step 4: Prepare response
     response_data = {
         "answer": answer_text,
-        "sources": all_sources,
+        "sources": prepared["all_sources"],
+        "language": language,
         "metadata": {
-            "web_sources_found": len(sources),
-            "news_articles_found": len(news_articles),
-            "timestamp": datetime.utcnow().isoformat(),
-            "model_used": model_id
-        }
+            **prepared["metadata"], "resource_pool": pool_stats(), "search_cache": search_cache_stats(),
+            "upstreams": resilience_stats(), "usage": usage_totals(), "served_by": served_by(), "bedrock_targets": dispatch_stats()
+        },
+        "trace": prepared["trace"]
     }
     
-    print(f"📤 Returning response with {len(all_sources)} sources")
+    print(f"📤 Returning response with {len(prepared['all_sources'])} sources")
+    
+    return _json_response(200, cors_headers, response_data, wants_compact_sources(body))
+
+def _prepare_admitted(user_query, language, image, session_id, session, follow_up, context):
+    """Retrieval and prompt building for an admitted request"""
+    # Step 1: Retrieve context (knowledge base, then web and news concurrently);
+    # a follow-up is answered from the sources its session already gathered
+    reused_sources, reused_news = session_sources(session) if follow_up else ([], [])
+    if reused_sources or reused_news:
+        print(f"🔁 Follow-up: reusing {len(reused_sources) + len(reused_news)} session sources")
+        retrieved = {**_SESSION_RETRIEVAL, "sources": reused_sources, "news_articles": reused_news}
+    else:
+        retrieved = retrieve_context(user_query, language, retrieval_deadline(context))
+    
+    # Step 2: Build educational prompt and pick the model route
+    history = history_for_prompt(session) if session else None
+    prepared = prepare_generation(user_query, language, retrieved, image, session_id, history)
+    if session_id:
+        prepared["trace"]["session"] = {
+            "follow_up": follow_up,
+            "reused_sources": bool(reused_sources or reused_news),
+            "history_turns": len(history["turns"]),
+            "history_tokens": history["tokens"],
+        }
+        prepared["metadata"]["session_id"] = session_id
+    return prepared
+
+def lambda_handler(event, context):
+    """Main Lambda function handler.
+
+    API Gateway buffers Lambda output, so a streamed request still gets the
+    complete SSE body here; run local_server.py (e.g. behind the Lambda Web
+    Adapter) to flush frames as they are generated. A body compressed for
+    the client's Accept-Encoding goes back base64-encoded, which API
+    Gateway and function URLs decode before sending it on.
+    """
+    # Asynchronous invocation from the lambda job runner
+    if event.get("job_run"):
+        return run_job(event["job_run"], context)
     
+    status_code, headers, chunks = handle_event(event, context)
+    body = "".join(chunks)
+    payload, encoding = encode_body(body, negotiate_encoding(event.get("headers")))
+    if encoding is None:
+        return {"statusCode": status_code, "headers": headers, "body": body}
     return {
-        "statusCode": 200,
-        "headers": {**cors_headers, "Content-Type": "application/json"},
-        "body": json.dumps(response_data)
-    }
\ No newline at end of file
+        "statusCode": status_code,
+        "headers": encoding_headers(headers, encoding),
+        "body": base64.b64encode(payload).decode("ascii"),
+        "isBase64Encoded": True
+    }
@@ -0,0 +1,150 @@
+"""English/Spanish detection in one pass over the text.
+
+Two tables are compiled once at import from ranked vocabulary lists:
+
+- word log-odds: log P(word | es) - log P(word | en) under a Zipf prior,
+  so shared short words ("a", "no", "me") weigh in proportionally instead of
+  counting as Spanish outright;
+- character-trigram log-odds over the same vocabulary, used for words not in
+  either list ("fotosintesis" vs "photosynthesis").
+
+detect_language tokenizes lazily and stops as soon as the evidence is
+decisive or MAX_WORDS words have been read, so long pasted homework costs
+the same few microseconds as a one-line question.
+"""
+import math
+import re
+
+# ========== CONFIGURATION ==========
+MAX_CHARS = 1200
+MAX_WORDS = 48
+DECISIVE_SCORE = 8.0
+SPANISH_MARGIN = 0.5
+WORD_CLIP = 4.0
+TRIGRAM_WEIGHT = 1.0
+ACCENT_BONUS = 1.5
+
+_WORD_RE = re.compile(r"[a-záéíóúüñ']+")
+_SPANISH_MARKS = ("¿", "¡")
+_SPANISH_LETTERS = frozenset("áéíóúñ")
+
+# Ranked by approximate corpus frequency, most frequent first
+SPANISH_VOCAB = """
+de la que el en y a los se del las un por con no una su para es al lo como más
+o pero sus le ha me si sin sobre este ya entre cuando todo esta ser son dos
+también fue había era muy años hasta desde está mi porque qué sólo han yo hay
+vez puede todos así nos ni parte tiene él uno donde bien tiempo mismo ese ahora
+cada e vida otro después te otros aunque esa eso hace otra tan durante siempre
+día tanto ella tres sí sido gran según menos cómo cuál cuándo dónde quién
+hola gracias favor buenos buenas adiós explica explícame explicar dime cuéntame
+ayuda ayúdame necesito puedes quiero hacer tengo pregunta respuesta ejemplo ejemplos pasos paso simple sencillo
+forma manera tarea examen clase escuela estudiar aprender significa qué
+funciona funcionan diferencia entre causas efectos historia guerra mundial
+célula células energía planta plantas agua luz tierra sol cuerpo humano
+sangre corazón número números ecuación resolver problema matemáticas física
+química biología fotosíntesis mitosis átomo átomos molécula recursión función
+programa código computadora datos palabra palabras oración idioma libro
+resumen capítulo autor poema país gobierno ciudad población revolución
+independencia siglo teoría ley fuerza movimiento velocidad
+""".split()
+
+ENGLISH_VOCAB = """
+the of and to a in is it you that he was for on are with as i his they be at
+one have this from or had by not but what some we can out other were all there
+when up use your how said an each she which do their time if will way about
+many then them write would like so these her long make thing see him two has
+look more day could go come did number no most people my over know water than
+call first who may down side been now find explain why does work between steps
+step simple hi hello thanks thank okay good please help me tell describe define
+difference example examples question answer homework test class school study learn means happen happens
+works causes effects history war world cell cells energy plant plants light
+earth sun body human blood heart numbers equation solve problem math physics
+chemistry biology photosynthesis mitosis atom atoms molecule recursion function
+program code computer data word words sentence language book summary chapter
+author poem country government city population revolution independence century
+theory law force motion speed should could which where while through because
+""".split()
+
+
+# ========== TABLE COMPILATION ==========
+def _zipf(vocab):
+    probs = {}
+    total = sum(1.0 / (rank + 10) for rank in range(len(vocab)))
+    for rank, word in enumerate(vocab):
+        probs.setdefault(word, (1.0 / (rank + 10)) / total)
+    return probs
+
+
+def _trigrams(word):
+    padded = f" {word} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def _compile_tables():
+    es_words, en_words = _zipf(SPANISH_VOCAB), _zipf(ENGLISH_VOCAB)
+    floor = 0.2 * min(min(es_words.values()), min(en_words.values()))
+
+    word_table = {}
+    for word in set(es_words) | set(en_words):
+        ratio = math.log(es_words.get(word, floor) / en_words.get(word, floor))
+        word_table[word] = max(-WORD_CLIP, min(WORD_CLIP, ratio))
+
+    es_grams, en_grams = {}, {}
+    for probs, grams in ((es_words, es_grams), (en_words, en_grams)):
+        for word in probs:
+            for gram in _trigrams(word):
+                grams[gram] = grams.get(gram, 0) + 1
+    es_total, en_total = sum(es_grams.values()), sum(en_grams.values())
+    vocab_size = len(set(es_grams) | set(en_grams))
+
+    trigram_table = {}
+    for gram in set(es_grams) | set(en_grams):
+        p_es = (es_grams.get(gram, 0) + 1) / (es_total + vocab_size)
+        p_en = (en_grams.get(gram, 0) + 1) / (en_total + vocab_size)
+        trigram_table[gram] = math.log(p_es / p_en)
+    return word_table, trigram_table
+
+
+WORD_TABLE, TRIGRAM_TABLE = _compile_tables()
+
+
+# ========== SCORING ==========
+def _word_score(word):
+    score = WORD_TABLE.get(word)
+    if score is not None:
+        return score
+    grams = _trigrams(word)
+    score = TRIGRAM_WEIGHT * sum(TRIGRAM_TABLE.get(g, 0.0) for g in grams) / len(grams)
+    if not _SPANISH_LETTERS.isdisjoint(word):
+        score += ACCENT_BONUS
+    return score
+
+
+def language_score(text):
+    """Log-odds that text is Spanish rather than English (positive means Spanish)"""
+    sample = (text or "")[:MAX_CHARS].lower()
+    score = 0.0
+    for mark in _SPANISH_MARKS:
+        if mark in sample:
+            score += DECISIVE_SCORE / 2
+    for n, match in enumerate(_WORD_RE.finditer(sample)):
+        if n >= MAX_WORDS or abs(score) >= DECISIVE_SCORE:
+            break
+        score += _word_score(match.group())
+    return score
+
+
+def detect_language(text):
+    """Return 'es' for Spanish and 'en' (the default) for everything else"""
+    return "es" if language_score(text) > SPANISH_MARGIN else "en"
+
+
+def detect_many(texts):
+    """Detect a batch of texts; repeated texts are scored once"""
+    seen = {}
+    results = []
+    for text in texts:
+        if text not in seen:
+            seen[text] = detect_language(text)
+        results.append(seen[text])
+    return results
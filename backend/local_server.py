@@ -0,0 +1,125 @@
+"""Local HTTP wrapper around handle_event that flushes SSE frames as they arrive.
+
+Run with `python local_server.py`, or deploy it behind the AWS Lambda Web
+Adapter to get real response streaming from the Python runtime.
+"""
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from images import MAX_BODY_CHARS
+from lambda_handler import get_cors_headers, handle_event
+from response_encoding import StreamEncoder, encode_body, encoding_headers, negotiate_encoding
+
+# ========== CONFIGURATION ==========
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", "8080"))
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get("REQUEST_TIMEOUT_SECONDS", "60"))
+
+
+class RequestContext:
+    """Minimal stand-in for the Lambda context object"""
+
+    def __init__(self, timeout_s):
+        self._deadline = time.monotonic() + timeout_s
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+def build_event(method, target, headers, body, source_ip=None):
+    """Translate an HTTP request into an API Gateway v2 style event"""
+    url = urlsplit(target)
+    return {
+        "rawPath": url.path,
+        "rawQueryString": url.query,
+        "headers": {k.lower(): v for k, v in headers.items()},
+        "requestContext": {"http": {"method": method, "path": url.path, "sourceIp": source_ip}},
+        "body": body,
+    }
+
+
+class StudyBuddyRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_OPTIONS(self):
+        self._dispatch()
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def _to_event(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8") if length else ""
+        return build_event(self.command, self.path, self.headers, body, self.client_address[0])
+
+    def _reject_oversized(self):
+        """Answer 413 from Content-Length alone, without reading the body into memory"""
+        payload = b'{"error": "Request body too large"}'
+        self.send_response(413)
+        for name, value in get_cors_headers({"headers": {"origin": self.headers.get("Origin", "")}}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(payload)
+        self.close_connection = True
+
+    def _dispatch(self):
+        if int(self.headers.get("Content-Length") or 0) > MAX_BODY_CHARS:
+            self._reject_oversized()
+            return
+        event = self._to_event()
+        status_code, headers, chunks = handle_event(event, RequestContext(REQUEST_TIMEOUT_SECONDS))
+        streaming = headers.get("Content-Type") == "text/event-stream"
+        encoding = negotiate_encoding(event["headers"], stream=streaming)
+
+        if not streaming:
+            payload, encoding = encode_body("".join(chunks), encoding)
+            self.send_response(status_code)
+            for name, value in encoding_headers(headers, encoding).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        encoder = StreamEncoder(encoding)
+        self.send_response(status_code)
+        for name, value in encoding_headers(headers, encoder.encoding).items():
+            self.send_header(name, value)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for chunk in chunks:
+                self._write_chunk(encoder.encode(chunk))
+            self._write_chunk(encoder.finish())
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            print("⚠️ Client disconnected mid-stream")
+            self.close_connection = True
+
+    def _write_chunk(self, data):
+        if data:
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+
+def main():
+    server = ThreadingHTTPServer((HOST, PORT), StudyBuddyRequestHandler)
+    print(f"🚀 Smart Study Buddy listening on http://{HOST}:{PORT}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
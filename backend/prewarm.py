@@ -0,0 +1,219 @@
+"""Pre-warm the answer and search caches with the most asked questions.
+
+    python prewarm.py mine --log handler.log [--top 50]
+    python prewarm.py run --log handler.log [--top 200] [--concurrency 4]
+    python prewarm.py run --log-group /aws/lambda/smart-study-buddy --hours 24
+
+Traffic is concentrated on a few hundred curriculum topics, so a scheduled
+run (e.g. an EventBridge rule invoking `handler` every 30 minutes) answers
+them ahead of time through the handler's own pipeline: retrieve_context
+(knowledge base, gate, tavily_search, news_search through the search
+cache), prepare_generation (prompt builder, routing) and generate_answer
+(Bedrock, then store_answer). Peak-hour requests for those topics are then
+answer cache hits.
+
+Hot questions are mined from the "📝 Processing query:" lines the handler
+logs, read from files or a CloudWatch log group. Rewordings are merged with
+the answer cache's own SimHash similarity, so one cached answer serves the
+whole group. Questions whose cached answer still has more than
+PREWARM_REFRESH_AHEAD_SECONDS to live are skipped; the rest are answered
+again before they expire.
+
+The caches must be shared for this to help: set ANSWER_CACHE_BACKEND and
+SEARCH_CACHE_BACKEND to dynamodb (or sqlite locally) for both the handler
+and this job.
+"""
+import gzip
+import os
+import sys
+import time
+from collections import Counter
+
+from answer_cache import (
+    ANSWER_CACHE_BACKEND, ANSWER_CACHE_SIMILARITY, answer_expires_at, simhash, similarity,
+)
+from batch import run_bounded
+from language import detect_language
+from search_cache import normalize_query
+
+# ========== CONFIGURATION ==========
+PREWARM_TOP_N = int(os.environ.get("PREWARM_TOP_N", "200"))
+PREWARM_MIN_COUNT = int(os.environ.get("PREWARM_MIN_COUNT", "3"))
+PREWARM_CONCURRENCY = int(os.environ.get("PREWARM_CONCURRENCY", "4"))
+PREWARM_REFRESH_AHEAD_SECONDS = int(os.environ.get("PREWARM_REFRESH_AHEAD_SECONDS", "3600"))
+PREWARM_LOG_GROUP = os.environ.get("PREWARM_LOG_GROUP", "")
+PREWARM_LOG_HOURS = float(os.environ.get("PREWARM_LOG_HOURS", "24"))
+PREWARM_RETRIEVAL_SECONDS = 10.0
+PREWARM_MAX_SECONDS = float(os.environ.get("PREWARM_MAX_SECONDS", "3600"))
+# Leave room for the final report when running inside a Lambda invocation
+PREWARM_RESERVE_SECONDS = 20.0
+
+QUERY_MARKER = "📝 Processing query: "
+MAX_QUESTION_CHARS = 500
+
+
+# ========== MINING ==========
+def iter_log_files(paths):
+    """Lines of plain or gzipped log files"""
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+            yield from f
+
+
+def iter_cloudwatch(log_group, hours):
+    """Query lines of the last `hours` of a CloudWatch log group"""
+    import boto3
+
+    client = boto3.client("logs")
+    start = int((time.time() - hours * 3600) * 1000)
+    paginator = client.get_paginator("filter_log_events")
+    for page in paginator.paginate(logGroupName=log_group, startTime=start, filterPattern='"Processing query"'):
+        for event in page.get("events", []):
+            yield event["message"]
+
+
+def extract_questions(lines):
+    for line in lines:
+        at = line.find(QUERY_MARKER)
+        if at >= 0:
+            question = line[at + len(QUERY_MARKER):].strip()
+            if question and len(question) <= MAX_QUESTION_CHARS:
+                yield question
+
+
+def hot_questions(questions, top_n=PREWARM_TOP_N, min_count=PREWARM_MIN_COUNT):
+    """The top_n most asked questions, rewordings merged; [{question, count, variants}]"""
+    exact = Counter()
+    phrasing = {}
+    for question in questions:
+        key = normalize_query(question)
+        exact[key] += 1
+        phrasing.setdefault(key, Counter())[question] += 1
+
+    # Greedy clustering over the most common forms, compared by SimHash like the cache does
+    groups = []
+    for key, count in exact.most_common(top_n * 5):
+        signature = simhash(key)
+        if not signature:
+            continue
+        for group in groups:
+            if similarity(signature, group["signature"]) >= ANSWER_CACHE_SIMILARITY:
+                group["count"] += count
+                group["variants"] += 1
+                break
+        else:
+            question = phrasing[key].most_common(1)[0][0]
+            groups.append({"question": question, "signature": signature, "count": count, "variants": 1})
+
+    groups.sort(key=lambda g: g["count"], reverse=True)
+    return [
+        {"question": g["question"], "count": g["count"], "variants": g["variants"]}
+        for g in groups[:top_n] if g["count"] >= min_count
+    ]
+
+
+# ========== WARMING ==========
+def _needs_refresh(question, language, now):
+    expires_at = answer_expires_at(question, language)
+    return expires_at is None or expires_at - now < PREWARM_REFRESH_AHEAD_SECONDS
+
+
+def warm_one(item):
+    """Answer one hot question through the handler pipeline; the answer lands in the cache"""
+    # Imported here so `mine` works without the handler's configuration
+    from lambda_handler import generate_answer, prepare_generation, retrieve_context
+
+    question, language = item["question"], item["language"]
+    started = time.monotonic()
+    retrieved = retrieve_context(question, language, PREWARM_RETRIEVAL_SECONDS)
+    prepared = prepare_generation(question, language, retrieved)
+    answer = generate_answer(prepared)
+    if prepared["metadata"]["partial_context"]:
+        # remember_answer does not cache these; a later run will try again
+        raise RuntimeError(f"partial context ({', '.join(prepared['metadata']['providers_failed'] + prepared['metadata']['providers_timed_out'])})")
+    return {"chars": len(answer), "ms": int((time.monotonic() - started) * 1000)}
+
+
+def prewarm(hot, concurrency=PREWARM_CONCURRENCY, deadline_s=None):
+    """Refresh the cached answers of hot questions that are missing or about to expire"""
+    if ANSWER_CACHE_BACKEND == "memory":
+        print("⚠️ ANSWER_CACHE_BACKEND is memory: warmed answers stay in this process only")
+    now = time.time()
+    due, fresh = [], 0
+    for item in hot:
+        language = detect_language(item["question"])
+        if _needs_refresh(item["question"], language, now):
+            due.append({**item, "language": language})
+        else:
+            fresh += 1
+    print(f"🔥 Pre-warming {len(due)} of {len(hot)} hot questions ({fresh} still fresh)")
+
+    started = time.monotonic()
+    outcomes = run_bounded(warm_one, due, concurrency, deadline_s if deadline_s is not None else PREWARM_MAX_SECONDS)
+    failed = []
+    for item, (result, error) in zip(due, outcomes):
+        if error is not None:
+            failed.append({"question": item["question"], "error": str(error)})
+            print(f"❌ {item['question'][:60]}: {str(error)}")
+        else:
+            print(f"✅ {item['question'][:60]} ({item['count']} asks, {result['ms']}ms)")
+    report = {
+        "hot": len(hot),
+        "fresh": fresh,
+        "warmed": len(due) - len(failed),
+        "failed": failed,
+        "elapsed_ms": int((time.monotonic() - started) * 1000),
+    }
+    print(f"📊 Pre-warm: {report['warmed']} warmed, {report['fresh']} fresh, {len(failed)} failed in {report['elapsed_ms']}ms")
+    return report
+
+
+# ========== ENTRY POINTS ==========
+def handler(event, context):
+    """Scheduled Lambda entry point; event may override top_n, hours and log_group"""
+    event = event or {}
+    log_group = event.get("log_group") or PREWARM_LOG_GROUP
+    if not log_group:
+        raise ValueError("Set PREWARM_LOG_GROUP or pass log_group in the event")
+    hot = hot_questions(
+        extract_questions(iter_cloudwatch(log_group, float(event.get("hours", PREWARM_LOG_HOURS)))),
+        top_n=int(event.get("top_n", PREWARM_TOP_N)),
+    )
+    deadline_s = None
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        deadline_s = context.get_remaining_time_in_millis() / 1000.0 - PREWARM_RESERVE_SECONDS
+    return prewarm(hot, deadline_s=deadline_s)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Mine hot questions from handler logs and pre-warm the caches")
+    parser.add_argument("command", choices=("mine", "run"))
+    parser.add_argument("--log", action="append", default=[], help="handler log file (.gz ok); repeatable")
+    parser.add_argument("--log-group", default=PREWARM_LOG_GROUP, help="CloudWatch log group instead of files")
+    parser.add_argument("--hours", type=float, default=PREWARM_LOG_HOURS)
+    parser.add_argument("--top", type=int, default=PREWARM_TOP_N)
+    parser.add_argument("--min-count", type=int, default=PREWARM_MIN_COUNT)
+    parser.add_argument("--concurrency", type=int, default=PREWARM_CONCURRENCY)
+    args = parser.parse_args(argv)
+
+    if args.log:
+        lines = iter_log_files(args.log)
+    elif args.log_group:
+        lines = iter_cloudwatch(args.log_group, args.hours)
+    else:
+        parser.error("pass --log or --log-group")
+    hot = hot_questions(extract_questions(lines), args.top, args.min_count)
+
+    if args.command == "mine":
+        for item in hot:
+            print(f"{item['count']:6}  {item['variants']:3} forms  {item['question']}")
+        return 0
+    report = prewarm(hot, args.concurrency)
+    return 1 if report["failed"] and not report["warmed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
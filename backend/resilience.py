@@ -0,0 +1,246 @@
+"""Per-upstream adaptive timeouts, circuit breakers and hedged requests.
+
+Every call to an upstream goes through call_upstream(name, fn, ceiling):
+
+- the timeout is the upstream's observed p99 latency times
+  TIMEOUT_P99_MULTIPLIER, clamped between TIMEOUT_FLOOR_SECONDS and the
+  caller's ceiling (the ceiling alone until ADAPTIVE_MIN_SAMPLES calls
+  have been seen);
+- after BREAKER_FAILURE_THRESHOLD consecutive failures the breaker opens
+  and calls fail fast with CircuitOpenError for BREAKER_COOLDOWN_SECONDS,
+  then a single probe decides whether it closes again;
+- for upstreams listed in HEDGED_UPSTREAMS, a call still running after the
+  observed p95 gets a second, parallel attempt and the first answer wins.
+  At most HEDGE_MAX_RATIO of calls are hedged, so a slow upstream never
+  sees more than that much extra load.
+
+State is per container and reported by resilience_stats().
+"""
+import os
+import threading
+import time
+from collections import deque
+
+# ========== CONFIGURATION ==========
+TIMEOUT_P99_MULTIPLIER = float(os.environ.get("TIMEOUT_P99_MULTIPLIER", "1.5"))
+TIMEOUT_FLOOR_SECONDS = float(os.environ.get("TIMEOUT_FLOOR_SECONDS", "1.0"))
+ADAPTIVE_MIN_SAMPLES = int(os.environ.get("ADAPTIVE_MIN_SAMPLES", "20"))
+LATENCY_WINDOW = int(os.environ.get("LATENCY_WINDOW", "200"))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_COOLDOWN_SECONDS = float(os.environ.get("BREAKER_COOLDOWN_SECONDS", "30"))
+HEDGED_UPSTREAMS = {
+    name.strip() for name in os.environ.get("HEDGED_UPSTREAMS", "").split(",") if name.strip()
+}
+HEDGE_MAX_RATIO = float(os.environ.get("HEDGE_MAX_RATIO", "0.1"))
+HEDGE_WORKERS = int(os.environ.get("HEDGE_WORKERS", "8"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+_registry = {}
+_registry_lock = threading.Lock()
+_executor = None
+
+
+class CircuitOpenError(Exception):
+    """The upstream's breaker is open; the call was skipped without waiting"""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} circuit open, retry in {retry_in:.0f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+# ========== UPSTREAM STATE ==========
+class Upstream:
+    """Latency window and breaker for one upstream"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._percentiles = None
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.last_timeout = None
+        self.counts = {"calls": 0, "failures": 0, "skipped": 0, "hedged": 0, "hedge_wins": 0}
+
+    def _latency_percentile(self, pct):
+        # Sorted lazily and cached until the next sample arrives
+        if self._percentiles is None:
+            self._percentiles = sorted(self._latencies)
+        ordered = self._percentiles
+        return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))]
+
+    def timeout(self, ceiling):
+        with self._lock:
+            # The half-open probe gets the full ceiling so a slower-but-healthy upstream can recover
+            if self.state == HALF_OPEN or len(self._latencies) < ADAPTIVE_MIN_SAMPLES:
+                return ceiling
+            adaptive = self._latency_percentile(99) * TIMEOUT_P99_MULTIPLIER
+        return max(TIMEOUT_FLOOR_SECONDS, min(ceiling, adaptive))
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None when there is too little history"""
+        with self._lock:
+            if len(self._latencies) < ADAPTIVE_MIN_SAMPLES:
+                return None
+            return self._latency_percentile(95)
+
+    def allow(self):
+        """Whether a call may go out now; moves an expired open breaker to half-open"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at < BREAKER_COOLDOWN_SECONDS:
+                self.counts["skipped"] += 1
+                return False
+            # Half-open: exactly one probe in flight
+            if self._probing:
+                self.counts["skipped"] += 1
+                return False
+            self.state = HALF_OPEN
+            self._probing = True
+            return True
+
+    def retry_in(self):
+        with self._lock:
+            return max(0.0, BREAKER_COOLDOWN_SECONDS - (time.monotonic() - self.opened_at))
+
+    def record_success(self, latency_s):
+        with self._lock:
+            self.counts["calls"] += 1
+            self._latencies.append(latency_s)
+            self._percentiles = None
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                print(f"🟢 {self.name} circuit closed")
+            self.state = CLOSED
+            self._probing = False
+
+    def record_failure(self, timed_out_after=None):
+        with self._lock:
+            if timed_out_after is not None:
+                # A timeout is a censored sample: the call took at least this long.
+                # Counting it lets the window drift up instead of locking the timeout low.
+                self._latencies.append(timed_out_after)
+                self._percentiles = None
+            self.counts["calls"] += 1
+            self.counts["failures"] += 1
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= BREAKER_FAILURE_THRESHOLD:
+                if self.state != OPEN:
+                    print(f"🔴 {self.name} circuit open for {BREAKER_COOLDOWN_SECONDS:.0f}s")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def count_hedge_win(self):
+        with self._lock:
+            self.counts["hedge_wins"] += 1
+
+    def take_hedge(self):
+        """Claim a hedge if this upstream is still under HEDGE_MAX_RATIO"""
+        with self._lock:
+            if self.counts["hedged"] + 1 > HEDGE_MAX_RATIO * max(1, self.counts["calls"]):
+                return False
+            self.counts["hedged"] += 1
+            return True
+
+    def snapshot(self):
+        with self._lock:
+            enough = len(self._latencies) >= ADAPTIVE_MIN_SAMPLES
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "samples": len(self._latencies),
+                "timeout_s": round(self.last_timeout, 2) if self.last_timeout is not None else None,
+                "p50_ms": int(self._latency_percentile(50) * 1000) if enough else None,
+                "p99_ms": int(self._latency_percentile(99) * 1000) if enough else None,
+                **self.counts,
+            }
+
+
+def get_upstream(name):
+    upstream = _registry.get(name)
+    if upstream is None:
+        with _registry_lock:
+            upstream = _registry.setdefault(name, Upstream(name))
+    return upstream
+
+
+# ========== CALLS ==========
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _registry_lock:
+            if _executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                _executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+    return _executor
+
+
+def _hedged(upstream, fn, timeout, delay):
+    """Run fn(timeout); if it is still running after delay, race a second attempt"""
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    started = time.monotonic()
+    primary = _get_executor().submit(fn, timeout)
+    pending = [primary]
+    done, _ = wait(pending, timeout=delay)
+    if not done and upstream.take_hedge():
+        print(f"🪃 Hedging {upstream.name} after {delay * 1000:.0f}ms")
+        pending.append(_get_executor().submit(fn, max(TIMEOUT_FLOOR_SECONDS, timeout - delay)))
+
+    last_error = None
+    while pending:
+        remaining = timeout - (time.monotonic() - started)
+        done, _ = wait(pending, timeout=max(0.0, remaining), return_when=FIRST_COMPLETED)
+        if not done:
+            raise TimeoutError(f"{upstream.name} timed out after {timeout:.1f}s")
+        for future in done:
+            pending.remove(future)
+            if future.exception() is None:
+                if future is not primary:
+                    upstream.count_hedge_win()
+                return future.result()
+            last_error = future.exception()
+    raise last_error
+
+
+def call_upstream(name, fn, ceiling):
+    """Call fn(timeout) under name's adaptive timeout, breaker and hedging policy.
+
+    Raises CircuitOpenError without calling fn while the breaker is open;
+    any exception from fn counts as a failure and is re-raised.
+    """
+    upstream = get_upstream(name)
+    if not upstream.allow():
+        raise CircuitOpenError(name, upstream.retry_in())
+
+    timeout = upstream.timeout(ceiling)
+    upstream.last_timeout = timeout
+    delay = upstream.hedge_delay() if name in HEDGED_UPSTREAMS else None
+    started = time.monotonic()
+    try:
+        if delay is not None and delay < timeout:
+            result = _hedged(upstream, fn, timeout, delay)
+        else:
+            result = fn(timeout)
+    except (TimeoutError, OSError) as e:
+        upstream.record_failure(timeout if isinstance(e, TimeoutError) else None)
+        raise
+    except Exception:
+        upstream.record_failure()
+        raise
+    upstream.record_success(time.monotonic() - started)
+    return result
+
+
+def resilience_stats():
+    """Breaker state, timeout and hedge counts per upstream in this container"""
+    with _registry_lock:
+        upstreams = list(_registry.values())
+    return {upstream.name: upstream.snapshot() for upstream in upstreams}
@@ -0,0 +1,168 @@
+"""Per-container resource pool.
+
+Everything here is created lazily on first use and then reused by every
+warm invocation: the Bedrock runtime client and one keep-alive connection
+pool per upstream host. boto3 and http.client are imported on first use too,
+so requests that never reach an upstream (preflight, validation errors)
+do not pay for them on a cold start.
+"""
+import os
+import threading
+from urllib.parse import urlsplit
+
+# ========== CONFIGURATION ==========
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "8"))
+BEDROCK_MAX_POOL_CONNECTIONS = int(os.environ.get("BEDROCK_MAX_POOL_CONNECTIONS", "16"))
+# Set to a local stub (see benchmarks/stubs.py) to run without AWS
+BEDROCK_ENDPOINT_URL = os.environ.get("BEDROCK_ENDPOINT_URL", "").strip() or None
+
+_lock = threading.Lock()
+_clients = {}
+_http_pools = {}
+_stats = {
+    "bedrock_client": {"hits": 0, "misses": 0},
+    "http_connections": {"hits": 0, "misses": 0},
+}
+
+
+class UpstreamHTTPError(Exception):
+    """Raised when an upstream answers with a non-2xx status"""
+
+    def __init__(self, url, status, body):
+        super().__init__(f"HTTP {status} from {url}")
+        self.url = url
+        self.status = status
+        self.body = body
+
+
+def _count(kind, hit):
+    with _lock:
+        _stats[kind]["hits" if hit else "misses"] += 1
+
+
+# ========== BEDROCK CLIENT ==========
+def get_bedrock_client(region="us-east-1", endpoint_url=None):
+    """Return the container-wide bedrock-runtime client for a region (and endpoint)"""
+    endpoint_url = endpoint_url or BEDROCK_ENDPOINT_URL
+    key = ("bedrock-runtime", region, endpoint_url)
+    client = _clients.get(key)
+    if client is not None:
+        _count("bedrock_client", True)
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            import boto3
+            from botocore.config import Config
+
+            # boto3 clients are thread-safe; construct once and share.
+            # Retries are bedrock_dispatch's job: it can fail over to another
+            # target instead of retrying the one that throttled.
+            client = boto3.client(
+                "bedrock-runtime",
+                region_name=region,
+                endpoint_url=endpoint_url,
+                config=Config(
+                    max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS,
+                    tcp_keepalive=True,
+                    retries={"mode": "standard", "total_max_attempts": 1},
+                ),
+            )
+            _clients[key] = client
+            _stats["bedrock_client"]["misses"] += 1
+            return client
+    _count("bedrock_client", True)
+    return client
+
+
+# ========== KEEP-ALIVE HTTP ==========
+class _HostPool:
+    """Idle keep-alive connections to one scheme://host:port"""
+
+    def __init__(self, scheme, host, port, maxsize):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is not None:
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+        import http.client
+
+        if self.scheme == "https":
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=timeout)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+        return conn, False
+
+    def release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+
+def _pool_for(scheme, host, port):
+    key = (scheme, host, port)
+    pool = _http_pools.get(key)
+    if pool is None:
+        with _lock:
+            pool = _http_pools.setdefault(key, _HostPool(scheme, host, port, HTTP_POOL_SIZE))
+    return pool
+
+
+def http_request(method, url, body=None, headers=None, timeout=10):
+    """Send a request over a pooled keep-alive connection and return the body bytes"""
+    parts = urlsplit(url)
+    scheme = parts.scheme or "https"
+    port = parts.port or (443 if scheme == "https" else 80)
+    path = parts.path or "/"
+    if parts.query:
+        path = f"{path}?{parts.query}"
+
+    pool = _pool_for(scheme, parts.hostname, port)
+    request_headers = {"Connection": "keep-alive", **(headers or {})}
+
+    import http.client
+
+    for attempt in range(2):
+        conn, reused = pool.acquire(timeout)
+        try:
+            conn.request(method, path, body=body, headers=request_headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            # The server dropped an idle keep-alive socket; retry once on a fresh one
+            if reused and attempt == 0:
+                continue
+            raise
+        except Exception:
+            conn.close()
+            raise
+
+        _count("http_connections", reused)
+        if response.will_close:
+            conn.close()
+        else:
+            pool.release(conn)
+
+        if not 200 <= response.status < 300:
+            raise UpstreamHTTPError(url, response.status, data)
+        return data
+
+
+# ========== STATS ==========
+def pool_stats():
+    """Hit/miss counts for client and connection reuse in this container"""
+    with _lock:
+        return {kind: dict(counts) for kind, counts in _stats.items()}
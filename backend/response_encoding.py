@@ -0,0 +1,174 @@
+"""Response bytes on the wire: dense JSON, compact sources and compression.
+
+A long answer with eight sources and the full metadata is tens of KB, much
+of it read over school Wi-Fi and phones. Three things shrink it:
+
+- dense JSON (dumps): no spaces after separators, and accented letters
+  and emoji as UTF-8 rather than \\u escapes, which matters for Spanish;
+- compact sources, for a client that sends "source_format": "compact":
+  just what the frontend renders (title, url, type when not web, source
+  for news). The snippets stay on the server, where the answer cache and
+  the knowledge base still need them;
+- compression negotiated from Accept-Encoding (negotiate_encoding): br
+  when the brotli package is installed, else gzip; streams prefer gzip.
+  encode_body compresses bodies of at least COMPRESS_MIN_BYTES, where it
+  outweighs the extra header. StreamEncoder compresses an SSE stream frame
+  by frame, flushing after each one so the client still sees every frame
+  as soon as it is written.
+
+benchmarks/encoding_bench.py measures bytes and encode CPU for each option.
+"""
+import json
+import os
+import zlib
+
+# ========== CONFIGURATION ==========
+COMPRESSION_ENABLED = os.environ.get("COMPRESSION_ENABLED", "true").lower() == "true"
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_STREAMS = os.environ.get("COMPRESS_STREAMS", "true").lower() == "true"
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "5"))
+
+# In order of preference when the client weights them equally. Flushed
+# after every frame, br streams come out larger than gzip ones and cost
+# more CPU (benchmarks/encoding_bench.py), so streams prefer gzip
+ENCODINGS = ("br", "gzip")
+STREAM_ENCODINGS = ("gzip", "br")
+
+_brotli = None
+
+
+def _brotli_module():
+    """The brotli package, or False when it is not installed"""
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+        except ImportError:
+            brotli = False
+        _brotli = brotli
+    return _brotli
+
+
+# ========== PAYLOADS ==========
+def dumps(data):
+    """JSON with no padding and non-ASCII text as UTF-8"""
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def wants_compact_sources(body):
+    return isinstance(body, dict) and body.get("source_format") == "compact"
+
+
+def compact_sources(sources):
+    """Sources with only the fields the frontend renders"""
+    compacted = []
+    for source in sources:
+        entry = {"title": source.get("title", ""), "url": source.get("url", "")}
+        if source.get("type", "web") != "web":
+            entry["type"] = source["type"]
+        if source.get("source"):
+            entry["source"] = source["source"]
+        compacted.append(entry)
+    return compacted
+
+
+def compact_response(data):
+    """A JSON response with its sources, and each batch item's, compacted"""
+    if not isinstance(data, dict):
+        return data
+    data = dict(data)
+    if isinstance(data.get("sources"), list):
+        data["sources"] = compact_sources(data["sources"])
+    if isinstance(data.get("items"), list):
+        data["items"] = [
+            {**item, "sources": compact_sources(item.get("sources") or [])} for item in data["items"]
+        ]
+    return data
+
+
+# ========== COMPRESSION ==========
+def negotiate_encoding(headers, stream=False):
+    """br, gzip or None for a request's Accept-Encoding header"""
+    if not COMPRESSION_ENABLED:
+        return None
+    headers = headers or {}
+    accept = headers.get("accept-encoding") or headers.get("Accept-Encoding") or ""
+    weights = {}
+    for part in accept.split(","):
+        name, _, params = part.partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name.strip():
+            weights[name.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    for encoding in STREAM_ENCODINGS if stream else ENCODINGS:
+        if encoding == "br" and not _brotli_module():
+            continue
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def _utf8(text):
+    # A lone surrogate from an upstream must not fail the whole response
+    return text.encode("utf-8", "replace")
+
+
+def compress(data, encoding, level=None):
+    """data as one br or gzip body; level defaults to BROTLI_QUALITY or GZIP_LEVEL"""
+    if encoding == "br":
+        return _brotli_module().compress(data, quality=BROTLI_QUALITY if level is None else level)
+    return zlib.compress(data, GZIP_LEVEL if level is None else level, wbits=31)
+
+
+def encode_body(text, encoding):
+    """(bytes, encoding used): compressed when negotiated, large enough and smaller"""
+    data = _utf8(text)
+    if encoding is None or len(data) < COMPRESS_MIN_BYTES:
+        return data, None
+    compressed = compress(data, encoding)
+    if len(compressed) >= len(data):
+        return data, None
+    return compressed, encoding
+
+
+def encoding_headers(headers, encoding):
+    """Response headers for a body sent with encoding (None leaves them as they are)"""
+    if encoding is None:
+        return headers
+    vary = headers.get("Vary")
+    return {**headers, "Content-Encoding": encoding, "Vary": f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"}
+
+
+class StreamEncoder:
+    """Encodes SSE frames one at a time; each encode() returns bytes the client can decode at once"""
+
+    def __init__(self, encoding, level=None):
+        self.encoding = encoding if COMPRESS_STREAMS else None
+        if self.encoding == "br":
+            self._compressor = _brotli_module().Compressor(quality=BROTLI_QUALITY if level is None else level)
+        elif self.encoding == "gzip":
+            self._compressor = zlib.compressobj(GZIP_LEVEL if level is None else level, zlib.DEFLATED, 31)
+
+    def encode(self, text):
+        data = _utf8(text)
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        if self.encoding == "gzip":
+            return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data
+
+    def finish(self):
+        if self.encoding == "br":
+            return self._compressor.finish()
+        if self.encoding == "gzip":
+            return self._compressor.flush(zlib.Z_FINISH)
+        return b""
@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+
+from resilience import CircuitOpenError
+from tracing import span, submit_with_context
+
+# ========== CONFIGURATION ==========
+RETRIEVAL_MAX_SECONDS = float(os.environ.get("RETRIEVAL_MAX_SECONDS", "8"))
+GENERATION_RESERVE_SECONDS = float(os.environ.get("GENERATION_RESERVE_SECONDS", "15"))
+RETRIEVAL_MIN_SECONDS = 1.0
+RETRIEVAL_WORKERS = int(os.environ.get("RETRIEVAL_WORKERS", "8"))
+
+# Shared across warm invocations; a provider that overruns the deadline keeps
+# its thread until its own socket timeout fires, it never blocks the response.
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                _executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+    return _executor
+
+
+# ========== DEADLINE ==========
+def retrieval_deadline(context):
+    """Seconds retrieval may spend, leaving room for the Bedrock call"""
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return RETRIEVAL_MAX_SECONDS
+
+    remaining = context.get_remaining_time_in_millis() / 1000.0
+    budget = min(RETRIEVAL_MAX_SECONDS, remaining - GENERATION_RESERVE_SECONDS)
+    return max(RETRIEVAL_MIN_SECONDS, budget)
+
+
+# ========== FAN-OUT ==========
+def _timed(name, fn):
+    with span(f"search.{name}"):
+        return fn()
+
+
+def fan_out(providers, deadline_s):
+    """Run every provider concurrently and keep whatever finishes before the deadline.
+
+    providers maps a provider name to (callable, fallback). A provider that
+    misses the deadline, raises, or is skipped by its open circuit breaker
+    contributes its fallback instead.
+    """
+    if not providers:
+        return {"results": {}, "timed_out": [], "failed": [], "skipped": [], "elapsed_ms": 0}
+
+    from concurrent.futures import wait
+
+    started = time.monotonic()
+    executor = _get_executor()
+    futures = {name: submit_with_context(executor, _timed, name, fn) for name, (fn, _) in providers.items()}
+    wait(list(futures.values()), timeout=deadline_s)
+
+    results = {}
+    timed_out = []
+    failed = []
+    skipped = []
+    for name, future in futures.items():
+        fallback = providers[name][1]
+        if not future.done():
+            future.cancel()
+            timed_out.append(name)
+            print(f"⏱️ {name} missed the {deadline_s:.1f}s retrieval deadline")
+            results[name] = fallback
+            continue
+        try:
+            results[name] = future.result()
+        except CircuitOpenError as e:
+            print(f"⏭️ Skipping {name}: {str(e)}")
+            skipped.append(name)
+            results[name] = fallback
+        except Exception as e:
+            print(f"❌ {name} retrieval error: {str(e)}")
+            failed.append(name)
+            results[name] = fallback
+
+    return {
+        "results": results,
+        "timed_out": timed_out,
+        "failed": failed,
+        "skipped": skipped,
+        "elapsed_ms": int((time.monotonic() - started) * 1000),
+    }
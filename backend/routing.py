@@ -0,0 +1,131 @@
+"""Pick a Bedrock model tier and max_tokens per question.
+
+Short definitional questions go to the fast tier with a small output
+budget; multi-part, reasoning-heavy or source-heavy questions go to Sonnet
+with more room. Every tier serves Sonnet (or INFERENCE_PROFILE_ARN) unless
+FAST_MODEL_ID names a cheaper model the account has access to, e.g. Haiku
+3.5: not every account or region has it enabled, so it is opt-in. The table
+is overridable with ROUTING_TABLE, a JSON object merged over DEFAULT_ROUTES,
+e.g. {"fast": {"max_tokens": 500}}. Questions with an image never go to a
+tier whose model cannot read images.
+"""
+import json
+import os
+import re
+
+# ========== CONFIGURATION ==========
+ROUTING_ENABLED = os.environ.get("ROUTING_ENABLED", "true").lower() == "true"
+INFERENCE_PROFILE_ARN = os.environ.get("INFERENCE_PROFILE_ARN", "").strip()
+
+HAIKU_MODEL_ID = "us.anthropic.claude-3-5-haiku-20241022-v1:0"
+SONNET_MODEL_ID = "us.anthropic.claude-3-5-sonnet-20241022-v2:0"
+# Opt-in cheaper model for the fast tier, e.g. HAIKU_MODEL_ID
+FAST_MODEL_ID = os.environ.get("FAST_MODEL_ID", "").strip()
+
+DEFAULT_ROUTES = {
+    "fast": {
+        "model_id": FAST_MODEL_ID or SONNET_MODEL_ID,
+        "max_tokens": 700,
+        "vision": not FAST_MODEL_ID or "sonnet" in FAST_MODEL_ID.lower(),
+    },
+    "standard": {"model_id": SONNET_MODEL_ID, "max_tokens": 1500, "vision": True},
+    "deep": {"model_id": SONNET_MODEL_ID, "max_tokens": 2000, "vision": True},
+}
+
+# Tier used for image questions when the chosen tier has no vision support
+VISION_TIER = os.environ.get("VISION_TIER", "standard")
+
+# Complexity score thresholds: below FAST_MAX is fast, above DEEP_MIN is deep
+FAST_MAX = 2
+DEEP_MIN = 5
+
+REASONING_CUES = re.compile(
+    r"\b(why|how does|how do|compare|contrast|difference between|prove|derive|"
+    r"analy[sz]e|evaluate|justify|solve|calculate|step[- ]by[- ]step|in detail|"
+    r"por qué|compara|diferencia entre|demuestra|analiza|resuelve|calcula|paso a paso)\b",
+    re.IGNORECASE,
+)
+DEFINITION_CUES = re.compile(
+    r"^\s*(define|what is|what are|what's|who is|who was|qué es|que es|quién es)\b",
+    re.IGNORECASE,
+)
+MATH_OR_CODE = re.compile(r"[=+\-*/^<>]\s*\d|\d\s*[=+\-*/^<>]|```|def |function |\bO\(")
+
+
+def _load_routes():
+    routes = {tier: dict(route) for tier, route in DEFAULT_ROUTES.items()}
+    raw = os.environ.get("ROUTING_TABLE", "").strip()
+    if raw:
+        try:
+            for tier, override in json.loads(raw).items():
+                routes.setdefault(tier, {}).update(override)
+        except (ValueError, AttributeError) as e:
+            print(f"⚠️ Ignoring invalid ROUTING_TABLE: {str(e)}")
+    # An explicitly configured inference profile keeps serving the Sonnet tiers
+    if INFERENCE_PROFILE_ARN:
+        for route in routes.values():
+            if route.get("model_id") == SONNET_MODEL_ID:
+                route["model_id"] = INFERENCE_PROFILE_ARN
+    return routes
+
+
+ROUTES = _load_routes()
+
+
+# ========== CLASSIFICATION ==========
+def query_features(user_query, context_stats=None, has_image=False):
+    """Cheap signals that correlate with how much reasoning an answer needs"""
+    words = user_query.split()
+    context_stats = context_stats or {}
+    return {
+        "words": len(words),
+        "questions": max(1, user_query.count("?") + user_query.count("¿") // 2),
+        "reasoning_cues": len(REASONING_CUES.findall(user_query)),
+        "definition": bool(DEFINITION_CUES.search(user_query)),
+        "math_or_code": bool(MATH_OR_CODE.search(user_query)),
+        "context_tokens": context_stats.get("context_tokens", 0),
+        "image": has_image,
+    }
+
+
+def complexity_score(features):
+    score = 0
+    if features["words"] > 12:
+        score += 1
+    if features["words"] > 40:
+        score += 2
+    score += min(features["reasoning_cues"], 3) * 2
+    score += (features["questions"] - 1) * 2
+    if features["math_or_code"]:
+        score += 2
+    if features["context_tokens"] > 800:
+        score += 1
+    if features["definition"] and features["reasoning_cues"] == 0:
+        score -= 2
+    return score
+
+
+def route_query(user_query, context_stats=None, has_image=False):
+    """Return the chosen tier with its model_id and max_tokens"""
+    features = query_features(user_query, context_stats, has_image)
+    score = complexity_score(features)
+    if not ROUTING_ENABLED:
+        tier = "deep"
+    elif score < FAST_MAX:
+        tier = "fast"
+    elif score >= DEEP_MIN:
+        tier = "deep"
+    else:
+        tier = "standard"
+    if has_image and not ROUTES[tier].get("vision", True):
+        tier = VISION_TIER
+
+    route = ROUTES[tier]
+    print(f"🧭 Routed to {tier} ({route['model_id']}, max_tokens={route['max_tokens']}, score={score})")
+    return {
+        "tier": tier,
+        "model_id": route["model_id"],
+        "max_tokens": route["max_tokens"],
+        "score": score,
+        "features": features,
+    }
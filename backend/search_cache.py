@@ -0,0 +1,155 @@
+"""Result cache in front of the search providers.
+
+Keys are the provider name, the normalized query and every other search
+argument that changes the result (language, domain filters, result count).
+Each provider has its own TTL because news goes stale far sooner than
+reference material.
+"""
+import functools
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+
+from stores import open_store
+
+# ========== CONFIGURATION ==========
+SEARCH_CACHE_BACKEND = os.environ.get("SEARCH_CACHE_BACKEND", "memory")
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", "512"))
+SEARCH_CACHE_MAX_BYTES = int(os.environ.get("SEARCH_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+SEARCH_CACHE_TTLS = {
+    "tavily": int(os.environ.get("TAVILY_CACHE_TTL_SECONDS", "86400")),
+    "newsapi": int(os.environ.get("NEWS_CACHE_TTL_SECONDS", "900")),
+}
+
+# Arguments that only affect how we wait for a result, never the result itself
+_UNKEYED_ARGS = {"timeout"}
+
+_store = None
+_store_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def _get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = open_store(
+                    SEARCH_CACHE_BACKEND,
+                    "search_cache",
+                    max_entries=SEARCH_CACHE_MAX_ENTRIES,
+                    max_bytes=SEARCH_CACHE_MAX_BYTES,
+                )
+    return _store
+
+
+# ========== KEYS ==========
+# Operators and brackets change what a question asks ("2+2" vs "2-2",
+# "(2+3)*4" vs "2+3*4"), so they are kept, each as a token of its own;
+# other punctuation is dropped
+_OPERATORS = frozenset("+-*/^=<>%×÷()")
+_OPERATOR_CLASS = re.escape("".join(sorted(_OPERATORS)))
+_OPERATOR_RE = re.compile(f"([{_OPERATOR_CLASS}])")
+_PUNCTUATION_RE = re.compile(f"[^\\w\\s{_OPERATOR_CLASS}]")
+_SPACED_SYMBOL_RE = re.compile(f" ?([{_OPERATOR_CLASS}]) ?")
+
+
+def normalize_query(query):
+    """Case-, punctuation- and whitespace-insensitive form of a question; math symbols are kept"""
+    text = unicodedata.normalize("NFKC", query or "").lower()
+    text = _PUNCTUATION_RE.sub(" ", _OPERATOR_RE.sub(r" \1 ", text))
+    return " ".join(text.split())
+
+
+def is_math_symbol(token):
+    return token in _OPERATORS
+
+
+def exact_key(text):
+    """A question with only case, Unicode form, spacing and end punctuation folded.
+
+    For keys where two questions may share an answer only if they really are
+    the same question: batch dedupe and single flights.
+    """
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    text = _SPACED_SYMBOL_RE.sub(r"\1", " ".join(text.split()))
+    return text.rstrip("?!.¿¡ ").lstrip("¿¡ ")
+
+
+def cache_key(provider, query, **params):
+    """Stable key for one provider call"""
+    material = json.dumps(
+        {"provider": provider, "query": normalize_query(query), "params": params},
+        sort_keys=True,
+    )
+    return f"{provider}:{hashlib.sha256(material.encode('utf-8')).hexdigest()[:32]}"
+
+
+def _has_results(result):
+    if isinstance(result, dict):
+        return bool(result.get("results"))
+    return bool(result)
+
+
+def _count(provider, outcome):
+    with _stats_lock:
+        counts = _stats.setdefault(provider, {"hits": 0, "misses": 0})
+        counts[outcome] += 1
+
+
+# ========== DECORATOR ==========
+def cached_search(provider):
+    """Serve a search function from the cache, storing non-empty results only"""
+
+    def decorator(fn):
+        signature = None
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            nonlocal signature
+            if signature is None:
+                # Resolved on first call: inspect costs ~10ms to import on a cold start
+                import inspect
+
+                signature = inspect.signature(fn)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = {k: v for k, v in bound.arguments.items() if k not in _UNKEYED_ARGS}
+            query = params.pop("query")
+            key = cache_key(provider, query, **params)
+
+            store = _get_store()
+            try:
+                cached = store.get(key)
+            except Exception as e:
+                print(f"⚠️ Search cache read failed: {str(e)}")
+                cached = None
+            if cached is not None:
+                _count(provider, "hits")
+                print(f"💾 {provider} cache hit")
+                return cached
+
+            _count(provider, "misses")
+            result = fn(*args, **kwargs)
+            # Empty results usually mean a failed or unconfigured provider
+            if _has_results(result):
+                try:
+                    store.put(key, result, SEARCH_CACHE_TTLS.get(provider, 600))
+                except Exception as e:
+                    print(f"⚠️ Search cache write failed: {str(e)}")
+            return result
+
+        wrapper.uncached = fn
+        return wrapper
+
+    return decorator
+
+
+def search_cache_stats():
+    """Per-provider hit/miss counts in this container"""
+    with _stats_lock:
+        return {provider: dict(counts) for provider, counts in _stats.items()}
@@ -0,0 +1,244 @@
+"""Multi-turn study sessions with a fixed prompt footprint.
+
+A session is one store entry keyed by the client's session_id:
+
+    {"summary": str, "turns": [{"n", "question", "answer", "language", "at"}],
+     "sources": [...], "turn_count": int, "updated_at": float}
+
+Only the newest turns that fit SESSION_HISTORY_TOKEN_BUDGET are replayed
+verbatim; older ones are folded into a rolling summary by a background
+thread after the turn is recorded, so the prompt (and per-turn latency)
+stays flat however long the conversation gets. Sources from earlier turns
+are kept with their passages so a follow-up can be answered without
+searching again.
+
+On Lambda the compaction thread is frozen with the container between
+invocations and simply finishes on the next one; turns that have not been
+folded yet are dropped from the prompt rather than overflowing it.
+"""
+import os
+import re
+import threading
+import time
+
+from context_assembly import estimate_tokens
+from kb_index import tokenize
+from stores import open_store
+
+# ========== CONFIGURATION ==========
+SESSION_STORE_BACKEND = os.environ.get("SESSION_STORE_BACKEND", "sqlite")
+SESSION_TTL_SECONDS = int(os.environ.get("SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+SESSION_HISTORY_TOKEN_BUDGET = int(os.environ.get("SESSION_HISTORY_TOKEN_BUDGET", "800"))
+SESSION_SUMMARY_MAX_TOKENS = int(os.environ.get("SESSION_SUMMARY_MAX_TOKENS", "300"))
+SESSION_MAX_SOURCES = int(os.environ.get("SESSION_MAX_SOURCES", "12"))
+SESSION_ANSWER_MAX_CHARS = 4000
+SOURCE_PASSAGE_MAX_CHARS = 800
+FOLLOW_UP_OVERLAP = 0.6
+FOLLOW_UP_MAX_WORDS = 12
+
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,128}$")
+
+# Questions that lean on the previous turn ("why?", "give me an example", "y eso?")
+FOLLOW_UP_CUES = re.compile(
+    r"^\s*(and|but|what about|tell me more|more|another|also|y|pero|y si|qué más|más)\b|"
+    r"\b(it|they|them|he|she|above|previous|again|example|"
+    r"eso|esto|ello|anterior|otra vez|ejemplo)\b",
+    re.IGNORECASE,
+)
+
+_store = None
+_store_lock = threading.Lock()
+# Striped so the lock table stays bounded however many sessions a container sees
+_session_locks = [threading.Lock() for _ in range(64)]
+_compacting = set()
+
+
+def _get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                # No in-process tier: the next turn may land on another container
+                _store = open_store(SESSION_STORE_BACKEND, "sessions", local_cache=False)
+    return _store
+
+
+def _lock_for(session_id):
+    return _session_locks[hash(session_id) % len(_session_locks)]
+
+
+# ========== READING ==========
+def valid_session_id(value):
+    return isinstance(value, str) and bool(_SESSION_ID_RE.match(value))
+
+
+def new_session():
+    return {"summary": "", "turns": [], "sources": [], "turn_count": 0, "updated_at": time.time()}
+
+
+def load_session(session_id):
+    """The stored session, or a fresh one"""
+    try:
+        session = _get_store().get(session_id)
+    except Exception as e:
+        print(f"⚠️ Session read failed: {str(e)}")
+        session = None
+    return session or new_session()
+
+
+def _turn_tokens(turn):
+    return estimate_tokens(turn["question"]) + estimate_tokens(turn["answer"])
+
+
+def _split_turns(turns, budget):
+    """(older turns to compact, newest turns that fit the verbatim budget)"""
+    used = 0
+    keep = 0
+    for turn in reversed(turns):
+        used += _turn_tokens(turn)
+        if used > budget and keep:
+            break
+        keep += 1
+    return turns[:len(turns) - keep], turns[len(turns) - keep:]
+
+
+def history_for_prompt(session):
+    """Summary plus the newest turns within SESSION_HISTORY_TOKEN_BUDGET"""
+    _, recent = _split_turns(session["turns"], SESSION_HISTORY_TOKEN_BUDGET)
+    recent = [t for t in recent if _turn_tokens(t) <= SESSION_HISTORY_TOKEN_BUDGET]
+    return {
+        "summary": session["summary"],
+        "turns": [{"question": t["question"], "answer": t["answer"]} for t in recent],
+        "tokens": estimate_tokens(session["summary"]) + sum(_turn_tokens(t) for t in recent),
+    }
+
+
+def is_follow_up(question, session):
+    """Whether a question builds on the session rather than starting a new topic"""
+    if not session["turns"]:
+        return False
+    if len(question.split()) <= FOLLOW_UP_MAX_WORDS and FOLLOW_UP_CUES.search(question):
+        return True
+    # Nothing but function words: "why?", "how so?", "¿por qué?"
+    terms = set(tokenize(question))
+    if not terms:
+        return True
+    last = session["turns"][-1]
+    known = set(tokenize(" ".join([session["summary"], last["question"], last["answer"][:1000]])))
+    return len(terms & known) / len(terms) >= FOLLOW_UP_OVERLAP
+
+
+def session_sources(session):
+    """Earlier turns' sources split into (web and kb sources, news articles)"""
+    sources = [s for s in session["sources"] if s.get("type") != "news"]
+    news = [s for s in session["sources"] if s.get("type") == "news"]
+    return sources, news
+
+
+# ========== WRITING ==========
+def compact_sources(sources, news_articles):
+    """The assembled context of one turn, trimmed for storage in the session"""
+    kept = []
+    for item in list(sources) + [dict(a, type="news") for a in news_articles]:
+        passage = (item.get("passage") or item.get("snippet") or "")[:SOURCE_PASSAGE_MAX_CHARS]
+        kept.append({
+            "type": item.get("type", "web"),
+            "title": item.get("title", "Source"),
+            "url": item.get("url", ""),
+            "snippet": item.get("snippet", "")[:400],
+            "content": passage,
+            "source": item.get("source", ""),
+        })
+    return kept
+
+
+def _save(session_id, session):
+    session["updated_at"] = time.time()
+    try:
+        _get_store().put(session_id, session, SESSION_TTL_SECONDS)
+    except Exception as e:
+        print(f"⚠️ Session write failed: {str(e)}")
+
+
+def record_turn(session_id, question, answer, sources, language, summarize=None):
+    """Append a turn and, when older turns overflow the budget, compact them in the background.
+
+    summarize(summary, turns, language) returns the new rolling summary;
+    without it (or when it fails) a short extractive summary is used.
+    """
+    with _lock_for(session_id):
+        session = load_session(session_id)
+        session["turn_count"] += 1
+        session["turns"].append({
+            "n": session["turn_count"],
+            "question": question,
+            "answer": answer[:SESSION_ANSWER_MAX_CHARS],
+            "language": language,
+            "at": time.time(),
+        })
+        merged, seen = [], set()
+        for source in list(sources) + session["sources"]:
+            key = source.get("url") or source.get("title")
+            if key not in seen:
+                seen.add(key)
+                merged.append(source)
+        session["sources"] = merged[:SESSION_MAX_SOURCES]
+        _save(session_id, session)
+        older, _ = _split_turns(session["turns"], SESSION_HISTORY_TOKEN_BUDGET)
+
+    if not older:
+        return
+    with _store_lock:
+        if session_id in _compacting:
+            return
+        _compacting.add(session_id)
+    threading.Thread(
+        target=_compact, args=(session_id, summarize, language), daemon=True, name="session-compact"
+    ).start()
+
+
+def _extractive_summary(summary, turns):
+    lines = [summary] if summary else []
+    for turn in turns:
+        first_sentence = re.split(r"(?<=[.!?])\s", turn["answer"].strip(), maxsplit=1)[0]
+        lines.append(f"- Asked: {turn['question'][:160]} Learned: {first_sentence[:200]}")
+    return "\n".join(lines)
+
+
+def _trim_summary(summary):
+    # Drop whole lines from the front until the summary fits its budget
+    lines = summary.splitlines()
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > SESSION_SUMMARY_MAX_TOKENS:
+        lines.pop(0)
+    text = "\n".join(lines)
+    max_chars = int(SESSION_SUMMARY_MAX_TOKENS * 3.8)
+    return text if len(text) <= max_chars else text[-max_chars:]
+
+
+def _compact(session_id, summarize, language):
+    """Fold turns that no longer fit the verbatim budget into the rolling summary"""
+    try:
+        session = load_session(session_id)
+        older, _ = _split_turns(session["turns"], SESSION_HISTORY_TOKEN_BUDGET)
+        if not older:
+            return
+        started = time.monotonic()
+        summary = None
+        if summarize is not None:
+            try:
+                summary = summarize(session["summary"], older, language)
+            except Exception as e:
+                print(f"⚠️ Session summary failed, using extractive fallback: {str(e)}")
+        summary = _trim_summary(summary or _extractive_summary(session["summary"], older))
+
+        # Turns may have been added meanwhile; drop exactly the ones we folded
+        folded = {turn["n"] for turn in older}
+        with _lock_for(session_id):
+            session = load_session(session_id)
+            session["turns"] = [t for t in session["turns"] if t["n"] not in folded]
+            session["summary"] = summary
+            _save(session_id, session)
+        print(f"🗜️ Compacted {len(older)} turns of session {session_id[:8]} in {int((time.monotonic() - started) * 1000)}ms")
+    finally:
+        with _store_lock:
+            _compacting.discard(session_id)
@@ -0,0 +1,289 @@
+"""Single-flight: identical questions asked at the same time share one answer.
+
+When a teacher tells a class to "ask the buddy about mitosis", dozens of
+identical prompts arrive within seconds, after the answer cache was checked
+and before any of them has written to it. The first request (the leader)
+runs retrieval and generation in a flight keyed by the question (exact_key:
+only case, spacing and end punctuation folded, so "5+3" and "5-3" never
+share a flight) and its language; the others (followers) subscribe to that
+flight and get the same events as they are produced: sources, each text
+delta, then metadata. A streaming follower sees the answer written at the
+leader's pace; a JSON follower gets the assembled answer. The flight ends
+with the answer, and from then on the answer cache serves repeats. The
+shared prompt carries no conversation history, so the handler only sends
+questions from sessions without any through a flight.
+
+Within a process, subscribers share an in-memory Flight. Across containers,
+set SINGLEFLIGHT_BACKEND to dynamodb (or sqlite, the local stand-in between
+processes on one machine): the leader claims the flight in the store and
+publishes its events there every SINGLEFLIGHT_PUBLISH_SECONDS, and the
+first request for it in another container polls them into a local flight
+that its own followers share. A claim whose owner stops publishing for
+SINGLEFLIGHT_LEASE_SECONDS is taken over by the next request.
+
+A flight abandoned before its first event (the leader was refused
+admission, or its remote owner died) raises FlightAbandoned in its
+followers, which then answer on their own.
+"""
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+from search_cache import exact_key
+from stores import open_store
+from tracing import submit_with_context
+
+# ========== CONFIGURATION ==========
+SINGLEFLIGHT_ENABLED = os.environ.get("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+SINGLEFLIGHT_BACKEND = os.environ.get("SINGLEFLIGHT_BACKEND", "memory")
+SINGLEFLIGHT_LEASE_SECONDS = float(os.environ.get("SINGLEFLIGHT_LEASE_SECONDS", "30"))
+SINGLEFLIGHT_WAIT_SECONDS = float(os.environ.get("SINGLEFLIGHT_WAIT_SECONDS", "60"))
+SINGLEFLIGHT_PUBLISH_SECONDS = float(os.environ.get("SINGLEFLIGHT_PUBLISH_SECONDS", "0.25"))
+SINGLEFLIGHT_POLL_SECONDS = float(os.environ.get("SINGLEFLIGHT_POLL_SECONDS", "0.2"))
+SINGLEFLIGHT_WORKERS = int(os.environ.get("SINGLEFLIGHT_WORKERS", "64"))
+
+RUNNING, DONE, ABANDONED = "running", "done", "abandoned"
+
+_flights = {}
+_flights_lock = threading.Lock()
+_stats = {"leaders": 0, "followers": 0, "remote_followers": 0, "abandoned": 0}
+_store = None
+_store_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class FlightAbandoned(Exception):
+    """The flight ended before producing anything; answer the request alone"""
+
+
+def _get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                # Followers poll the shared record, so no in-process tier
+                _store = open_store(SINGLEFLIGHT_BACKEND, "singleflight", local_cache=False)
+    return _store
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                _executor = ThreadPoolExecutor(max_workers=SINGLEFLIGHT_WORKERS, thread_name_prefix="flight")
+    return _executor
+
+
+def flight_key(question, language):
+    material = f"{language}:{exact_key(question)}"
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()[:32]
+
+
+# ========== FLIGHT ==========
+class Flight:
+    """The events of one answer, produced once and replayed to every subscriber"""
+
+    def __init__(self, key):
+        self.key = key
+        self.owner = uuid.uuid4().hex
+        self.shared = False
+        self.events = []
+        self.state = RUNNING
+        self.subscribers = 0
+        self._cond = threading.Condition()
+        self._synced_at = 0.0
+        self._sync_failed = False
+
+    def start(self, produce, *args):
+        """Run produce(*args), a generator of (event, data) pairs, in the background.
+
+        The producer outlives a subscriber that disconnects, so the others
+        still get the whole answer.
+        """
+        submit_with_context(_get_executor(), self._run, produce, *args)
+
+    def _run(self, produce, *args):
+        try:
+            for name, data in produce(*args):
+                self.publish(name, data)
+        except FlightAbandoned:
+            self.abandon()
+            return
+        except Exception as e:
+            print(f"❌ Single-flight producer error: {str(e)}")
+            if not self.events:
+                self.abandon()
+                return
+            self.publish("error", {"error": "AI service error", "details": str(e)})
+        self._finish(DONE)
+
+    def publish(self, name, data):
+        with self._cond:
+            self.events.append((name, data))
+            self._cond.notify_all()
+        if self.shared and (name != "delta" or time.monotonic() - self._synced_at >= SINGLEFLIGHT_PUBLISH_SECONDS):
+            self._sync(RUNNING)
+
+    def abandon(self):
+        """End the flight without an answer, e.g. when its leader was refused admission"""
+        self._finish(ABANDONED)
+
+    def _finish(self, state):
+        with self._cond:
+            self.state = state
+            self._cond.notify_all()
+        with _flights_lock:
+            if _flights.get(self.key) is self:
+                del _flights[self.key]
+        if state == ABANDONED:
+            _count("abandoned")
+        if self.shared:
+            self._sync(state)
+
+    def subscribe(self):
+        """Every event of the flight, past ones first, until it finishes"""
+        with self._cond:
+            self.subscribers += 1
+        index = 0
+        while True:
+            with self._cond:
+                waited = time.monotonic()
+                while index >= len(self.events) and self.state == RUNNING:
+                    if time.monotonic() - waited > SINGLEFLIGHT_WAIT_SECONDS:
+                        break
+                    self._cond.wait(SINGLEFLIGHT_POLL_SECONDS)
+                pending = self.events[index:]
+                state = self.state
+            index += len(pending)
+            if not pending and index == 0:
+                raise FlightAbandoned(f"flight {state}")
+            yield from pending
+            if not pending:
+                if state != DONE:
+                    # Started but never finished: end the subscriber's stream cleanly
+                    yield "error", {"error": "AI service error", "details": "shared answer was interrupted"}
+                return
+
+    # ---------- shared store ----------
+    def _sync(self, state):
+        """Write this flight's events to the store while we still own the claim"""
+        if self._sync_failed:
+            return
+        owner = self.owner
+        record = {"owner": owner, "state": state, "events": _compact(self.events), "expires_at": time.time() + SINGLEFLIGHT_LEASE_SECONDS}
+
+        def write(current):
+            if current and current.get("owner") != owner:
+                return current, False
+            return record, True
+
+        try:
+            if not _get_store().update(self.key, write, SINGLEFLIGHT_LEASE_SECONDS):
+                print("⚠️ Single-flight claim was taken over, no longer publishing")
+                self._sync_failed = True
+        except Exception as e:
+            print(f"⚠️ Single-flight publish failed (remote followers will retake): {str(e)}")
+            self._sync_failed = True
+        self._synced_at = time.monotonic()
+
+
+def _compact(events):
+    """Events with consecutive deltas merged, as stored for remote followers"""
+    compacted = []
+    for name, data in events:
+        if name == "delta" and compacted and compacted[-1][0] == "delta":
+            compacted[-1] = ["delta", {"text": compacted[-1][1]["text"] + data["text"]}]
+        else:
+            compacted.append([name, data])
+    return compacted
+
+
+def _claim(key, owner):
+    """Claim the flight in the shared store; returns the owner that holds it"""
+
+    def claim(current):
+        now = time.time()
+        if current and current.get("state") != ABANDONED and current.get("expires_at", 0) > now:
+            return current, current["owner"]
+        return {"owner": owner, "state": RUNNING, "events": [], "expires_at": now + SINGLEFLIGHT_LEASE_SECONDS}, owner
+
+    return _get_store().update(key, claim, SINGLEFLIGHT_LEASE_SECONDS)
+
+
+def _follow_remote(key):
+    """Events of a flight another container owns, polled from the store"""
+    index = 0
+    delivered = ""
+    while True:
+        record = _get_store().get(key) or {}
+        if record.get("state") == ABANDONED or record.get("expires_at", 0) <= time.time():
+            if index == 0:
+                raise FlightAbandoned("remote owner stopped")
+            raise RuntimeError("remote owner stopped mid-answer")
+        events = record.get("events") or []
+        # The last stored delta grows between polls; emit only its new text
+        for position in range(max(0, index - 1), len(events)):
+            name, data = events[position]
+            if position == index - 1:
+                if name == "delta" and len(data["text"]) > len(delivered):
+                    yield "delta", {"text": data["text"][len(delivered):]}
+                    delivered = data["text"]
+                continue
+            delivered = data["text"] if name == "delta" else ""
+            yield name, data
+        index = len(events)
+        if record.get("state") == DONE:
+            return
+        time.sleep(SINGLEFLIGHT_POLL_SECONDS)
+
+
+# ========== JOINING ==========
+def _count(outcome):
+    with _flights_lock:
+        _stats[outcome] += 1
+
+
+def join_flight(question, language):
+    """(flight, leader) for a question: leader is True when the caller must start it.
+
+    A follower only subscribes. A flight owned by another container is
+    started here as a poller, so the caller is a follower of it too.
+    """
+    key = flight_key(question, language)
+    with _flights_lock:
+        flight = _flights.get(key)
+        if flight is not None:
+            _stats["followers"] += 1
+            return flight, False
+        flight = _flights[key] = Flight(key)
+        _stats["leaders"] += 1
+    if SINGLEFLIGHT_BACKEND == "memory":
+        return flight, True
+
+    try:
+        owner = _claim(key, flight.owner)
+    except Exception as e:
+        # Without the store, coalesce within this container only
+        print(f"⚠️ Single-flight store unavailable: {str(e)}")
+        return flight, True
+    if owner == flight.owner:
+        flight.shared = True
+        return flight, True
+    with _flights_lock:
+        _stats["leaders"] -= 1
+        _stats["remote_followers"] += 1
+    print("🛫 Following a flight owned by another container")
+    flight.start(_follow_remote, key)
+    return flight, False
+
+
+def singleflight_stats():
+    """Flights led, joined locally, followed remotely and abandoned in this container"""
+    with _flights_lock:
+        return {**_stats, "in_flight": len(_flights)}
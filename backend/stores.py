@@ -0,0 +1,329 @@
+"""Pluggable key/value stores with per-entry TTL.
+
+MemoryStore is an in-process LRU bounded by entry count and bytes.
+SQLiteStore is a local file that every process on the host (or an EFS
+mount) can share. DynamoDBStore talks to DynamoDB or any compatible
+stand-in such as DynamoDB Local via DYNAMODB_ENDPOINT_URL. TieredStore puts
+a MemoryStore in front of a shared store.
+
+Values must be JSON-serializable; every read returns a fresh copy.
+update(key, fn, ttl) is an atomic read-modify-write for shared counters
+such as rate-limit buckets: fn(current value or None) returns
+(new value, result) and update returns the result.
+"""
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+# ========== CONFIGURATION ==========
+SQLITE_STORE_PATH = os.environ.get("SQLITE_STORE_PATH", "/tmp/smart_study_buddy.sqlite")
+DYNAMODB_TABLE = os.environ.get("DYNAMODB_TABLE", "smart-study-buddy-cache")
+DYNAMODB_ENDPOINT_URL = os.environ.get("DYNAMODB_ENDPOINT_URL", "").strip() or None
+DYNAMODB_REGION = os.environ.get("DYNAMODB_REGION", "us-east-1")
+# Optimistic-concurrency attempts for DynamoDBStore.update under contention
+UPDATE_MAX_ATTEMPTS = 8
+
+
+class UpdateConflict(Exception):
+    """An atomic update kept losing races and gave up"""
+
+
+# ========== IN-PROCESS LRU ==========
+class MemoryStore:
+    """Thread-safe LRU with TTL, evicting by entry count and total bytes"""
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get_entry(self, key):
+        """Return (value, expires_at) or None when missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            raw, expires_at = entry
+            if expires_at <= time.time():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+        return json.loads(raw), expires_at
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry[0] if entry else None
+
+    def put(self, key, value, ttl):
+        self.put_until(key, value, time.time() + ttl)
+
+    def put_until(self, key, value, expires_at):
+        raw = json.dumps(value)
+        if len(raw) > self.max_bytes:
+            return
+        with self._lock:
+            self._put_locked(key, raw, expires_at)
+
+    def update(self, key, fn, ttl):
+        with self._lock:
+            entry = self._entries.get(key)
+            current = json.loads(entry[0]) if entry and entry[1] > time.time() else None
+            value, result = fn(current)
+            self._put_locked(key, json.dumps(value), time.time() + ttl)
+        return result
+
+    def _put_locked(self, key, raw, expires_at):
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (raw, expires_at)
+        self._bytes += len(raw)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def _drop(self, key):
+        raw, _ = self._entries.pop(key)
+        self._bytes -= len(raw)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# ========== SQLITE ==========
+class SQLiteStore:
+    """Shared on-disk store; evicts least recently read rows past max_entries"""
+
+    def __init__(self, path=SQLITE_STORE_PATH, table="kv", max_entries=10000):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        import sqlite3
+
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table}(accessed_at)")
+
+    def get_entry(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                return None
+            self._conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0]), row[1]
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry[0] if entry else None
+
+    def put(self, key, value, ttl):
+        self.put_until(key, value, time.time() + ttl)
+
+    def put_until(self, key, value, expires_at):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, now),
+            )
+            self._evict(now)
+
+    def update(self, key, fn, ttl):
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so other processes wait instead of interleaving
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+                ).fetchone()
+                current = json.loads(row[0]) if row and row[1] > now else None
+                value, result = fn(current)
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now + ttl, now),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def _evict(self, now):
+        self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,))
+        (count,) = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+
+# ========== DYNAMODB ==========
+class DynamoDBStore:
+    """Items are {pk, value, expires_at}; enable DynamoDB TTL on expires_at"""
+
+    def __init__(self, table=DYNAMODB_TABLE, prefix="", region=DYNAMODB_REGION, endpoint_url=DYNAMODB_ENDPOINT_URL):
+        import boto3
+
+        self.table = table
+        self.prefix = prefix
+        self._client = boto3.client("dynamodb", region_name=region, endpoint_url=endpoint_url)
+
+    def get_entry(self, key):
+        item = self._client.get_item(
+            TableName=self.table, Key={"pk": {"S": self.prefix + key}}, ConsistentRead=False
+        ).get("Item")
+        if not item:
+            return None
+        expires_at = float(item["expires_at"]["N"])
+        # DynamoDB deletes expired items lazily, so check expiry on read
+        if expires_at <= time.time():
+            return None
+        return json.loads(item["value"]["S"]), expires_at
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry[0] if entry else None
+
+    def put(self, key, value, ttl):
+        self.put_until(key, value, time.time() + ttl)
+
+    def put_until(self, key, value, expires_at):
+        self._client.put_item(
+            TableName=self.table,
+            Item={
+                "pk": {"S": self.prefix + key},
+                "value": {"S": json.dumps(value)},
+                "expires_at": {"N": str(int(expires_at))},
+            },
+        )
+
+    def update(self, key, fn, ttl):
+        """Optimistic read-modify-write on a version attribute, retried on conflict"""
+        pk = {"S": self.prefix + key}
+        for attempt in range(UPDATE_MAX_ATTEMPTS):
+            item = self._client.get_item(TableName=self.table, Key={"pk": pk}, ConsistentRead=True).get("Item")
+            current = None
+            if item and float(item["expires_at"]["N"]) > time.time():
+                current = json.loads(item["value"]["S"])
+            version = int(item["version"]["N"]) if item and "version" in item else 0
+            value, result = fn(current)
+            if item is None:
+                condition, values = "attribute_not_exists(pk)", {}
+            elif "version" in item:
+                condition, values = "version = :v", {":v": {"N": str(version)}}
+            else:
+                condition, values = "attribute_not_exists(version)", {}
+            try:
+                self._client.put_item(
+                    TableName=self.table,
+                    Item={
+                        "pk": pk,
+                        "value": {"S": json.dumps(value)},
+                        "expires_at": {"N": str(int(time.time() + ttl))},
+                        "version": {"N": str(version + 1)},
+                    },
+                    ConditionExpression=condition,
+                    **({"ExpressionAttributeValues": values} if values else {}),
+                )
+                return result
+            except self._client.exceptions.ConditionalCheckFailedException:
+                time.sleep(random.uniform(0, 0.01 * (attempt + 1)))
+        raise UpdateConflict(f"Gave up updating {key} after {UPDATE_MAX_ATTEMPTS} conflicting writes")
+
+    def delete(self, key):
+        self._client.delete_item(TableName=self.table, Key={"pk": {"S": self.prefix + key}})
+
+
+# ========== TIERED ==========
+class TieredStore:
+    """In-process LRU in front of a shared store"""
+
+    def __init__(self, local, shared):
+        self.local = local
+        self.shared = shared
+
+    def get_entry(self, key):
+        entry = self.local.get_entry(key)
+        if entry is not None:
+            return entry
+        try:
+            entry = self.shared.get_entry(key)
+        except Exception as e:
+            print(f"⚠️ Shared store read failed: {str(e)}")
+            return None
+        if entry is not None:
+            self.local.put_until(key, entry[0], entry[1])
+        return entry
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry[0] if entry else None
+
+    def put(self, key, value, ttl):
+        self.put_until(key, value, time.time() + ttl)
+
+    def put_until(self, key, value, expires_at):
+        self.local.put_until(key, value, expires_at)
+        try:
+            self.shared.put_until(key, value, expires_at)
+        except Exception as e:
+            print(f"⚠️ Shared store write failed: {str(e)}")
+
+    def update(self, key, fn, ttl):
+        # The shared store is the source of truth for counters; drop any local copy
+        self.local.delete(key)
+        return self.shared.update(key, fn, ttl)
+
+    def delete(self, key):
+        self.local.delete(key)
+        try:
+            self.shared.delete(key)
+        except Exception as e:
+            print(f"⚠️ Shared store delete failed: {str(e)}")
+
+
+# ========== FACTORY ==========
+def open_store(backend, namespace, max_entries=1024, max_bytes=16 * 1024 * 1024, local_cache=True):
+    """Build a store for one namespace; backend is memory, sqlite or dynamodb.
+
+    local_cache=False skips the in-process tier, for values that other
+    containers update and that must never be read stale.
+    """
+    local = MemoryStore(max_entries=max_entries, max_bytes=max_bytes)
+    backend = (backend or "memory").strip().lower()
+    if backend == "memory":
+        return local
+    if backend == "sqlite":
+        shared = SQLiteStore(table=namespace, max_entries=max_entries * 10)
+    elif backend == "dynamodb":
+        shared = DynamoDBStore(prefix=f"{namespace}#")
+    else:
+        raise ValueError(f"Unknown store backend: {backend}")
+    return TieredStore(local, shared) if local_cache else shared
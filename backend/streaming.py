@@ -0,0 +1,42 @@
+import json
+
+from response_encoding import dumps
+
+
+# ========== STREAM NEGOTIATION ==========
+def wants_stream(event, body):
+    """True when the client asked for a server-sent event stream"""
+    if isinstance(body, dict) and body.get("stream") is True:
+        return True
+    headers = event.get("headers") or {}
+    accept = headers.get("accept") or headers.get("Accept") or ""
+    return "text/event-stream" in accept
+
+
+# ========== SSE FRAMES ==========
+def sse_frame(event_name, data):
+    """Encode one server-sent event frame"""
+    return f"event: {event_name}\ndata: {dumps(data)}\n\n"
+
+
+# ========== BEDROCK STREAM ==========
+def iter_bedrock_deltas(response, on_usage=None):
+    """Yield text deltas from an invoke_model_with_response_stream response.
+
+    on_usage, if given, receives the token usage reported at the start
+    (input and cache tokens) and end (output tokens) of the stream.
+    """
+    for event in response["body"]:
+        chunk = event.get("chunk")
+        if not chunk:
+            continue
+        data = json.loads(chunk["bytes"].decode("utf-8"))
+        if data.get("type") == "content_block_delta":
+            text = (data.get("delta") or {}).get("text")
+            if text:
+                yield text
+        elif on_usage is not None and data.get("type") == "message_start":
+            on_usage((data.get("message") or {}).get("usage"))
+        elif on_usage is not None and data.get("type") == "message_delta":
+            # Counts here are cumulative; only the output tokens are new
+            on_usage({"output_tokens": (data.get("usage") or {}).get("output_tokens")})
@@ -0,0 +1,218 @@
+"""Per-request stage timing emitted as CloudWatch Embedded Metric Format.
+
+Each request gets a Trace held in a context variable; `with span("bedrock"):`
+records a stage duration on it, from any thread that was started with a
+copy of the request's context (fan_out and run_bounded do this). When the
+request finishes, one EMF JSON line is printed. CloudWatch turns it into
+metrics, and `python tracing.py summarize <logfile>` gives p50/p90/p99 per
+stage locally.
+"""
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# ========== CONFIGURATION ==========
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "SmartStudyBuddy")
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+EVENT_LOG_MAX_CHARS = int(os.environ.get("EVENT_LOG_MAX_CHARS", "1024"))
+SERVICE_NAME = "smart-study-buddy"
+
+# Body fields that are never worth logging (base64 payloads)
+_REDACTED_FIELDS = ("image",)
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """Stage durations and properties for one request"""
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id
+        self.started = time.monotonic()
+        # Monotonic time the invocation must have answered by, when known
+        self.deadline = None
+        self.spans = {}
+        self.properties = {}
+        self.dimensions = {"Service": SERVICE_NAME, "Path": "unknown"}
+        self._lock = threading.Lock()
+        self._emitted = False
+
+    def record(self, name, ms):
+        with self._lock:
+            self.spans.setdefault(name, []).append(round(ms, 2))
+
+    def set(self, key, value):
+        with self._lock:
+            self.properties[key] = value
+
+    def set_path(self, path):
+        self.dimensions["Path"] = path
+
+    def to_emf(self):
+        total_ms = round((time.monotonic() - self.started) * 1000, 2)
+        with self._lock:
+            values = {f"{name}_ms": v[0] if len(v) == 1 else v for name, v in self.spans.items()}
+            properties = dict(self.properties)
+        values["total_ms"] = total_ms
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [sorted(self.dimensions)],
+                    "Metrics": [{"Name": name, "Unit": "Milliseconds"} for name in values],
+                }],
+            },
+            **self.dimensions,
+            **properties,
+            **values,
+            "request_id": self.request_id,
+        }
+
+    def emit(self):
+        """Print the EMF line once; later calls are no-ops"""
+        if self._emitted or not METRICS_ENABLED:
+            return
+        self._emitted = True
+        print(json.dumps(self.to_emf(), default=str))
+
+    def wrap_stream(self, chunks):
+        """Emit after a streamed body has been fully produced"""
+        try:
+            yield from chunks
+        finally:
+            self.emit()
+
+
+# ========== API ==========
+def start_trace(context=None):
+    trace = Trace(getattr(context, "aws_request_id", None))
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        trace.deadline = trace.started + context.get_remaining_time_in_millis() / 1000.0
+    _current.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def span(name):
+    """Time a stage on the current request's trace (no-op outside a request)"""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        trace = _current.get()
+        if trace is not None:
+            trace.record(name, (time.monotonic() - started) * 1000)
+
+
+def record(name, ms):
+    """Record a duration measured elsewhere (e.g. time to first token)"""
+    trace = _current.get()
+    if trace is not None and ms is not None:
+        trace.record(name, ms)
+
+
+def annotate(key, value):
+    """Attach a non-metric property to the current request's EMF line"""
+    trace = _current.get()
+    if trace is not None:
+        trace.set(key, value)
+
+
+def submit_with_context(executor, fn, *args):
+    """executor.submit that carries the request's trace into the worker thread"""
+    ctx = contextvars.copy_context()
+    return executor.submit(ctx.run, fn, *args)
+
+
+# ========== EVENT LOGGING ==========
+def summarize_event(event):
+    """Size-capped description of an event for logs; never re-serializes the body"""
+    http = (event.get("requestContext") or {}).get("http") or {}
+    body = event.get("body")
+    summary = {
+        "method": http.get("method") or event.get("httpMethod"),
+        "path": event.get("rawPath") or event.get("path"),
+        "origin": (event.get("headers") or {}).get("origin") or (event.get("headers") or {}).get("Origin"),
+        "body_chars": len(body) if isinstance(body, str) else None,
+    }
+    if isinstance(body, str):
+        preview = body[:EVENT_LOG_MAX_CHARS]
+        for field in _REDACTED_FIELDS:
+            marker = f'"{field}"'
+            if marker in preview:
+                preview = preview[:preview.index(marker)] + f'{marker}: "<redacted>"…'
+        summary["body_preview"] = preview
+    elif isinstance(body, dict):
+        summary["body_keys"] = sorted(body)
+    return summary
+
+
+# ========== LOCAL COLLECTOR ==========
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(lines):
+    """Aggregate EMF lines into per-path, per-stage percentiles"""
+    samples = {}
+    for line in lines:
+        start = line.find('{"_aws"')
+        if start < 0:
+            continue
+        try:
+            record = json.loads(line[start:])
+        except ValueError:
+            continue
+        path = record.get("Path", "unknown")
+        for metric in record["_aws"]["CloudWatchMetrics"][0]["Metrics"]:
+            value = record.get(metric["Name"])
+            values = value if isinstance(value, list) else [value]
+            samples.setdefault((path, metric["Name"]), []).extend(v for v in values if v is not None)
+
+    report = {}
+    for (path, name), values in sorted(samples.items()):
+        report.setdefault(path, {})[name] = {
+            "count": len(values),
+            "p50": _percentile(values, 50),
+            "p90": _percentile(values, 90),
+            "p99": _percentile(values, 99),
+            "max": max(values),
+        }
+    return report
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarize stage metrics from handler logs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    summary = sub.add_parser("summarize", help="p50/p90/p99 per stage from EMF log lines")
+    summary.add_argument("logfile", nargs="?", help="log file (default: stdin)")
+    args = parser.parse_args(argv)
+
+    stream = open(args.logfile, encoding="utf-8") if args.logfile else sys.stdin
+    with stream:
+        report = summarize(stream)
+    for path, stages in report.items():
+        print(f"[{path}]")
+        print(f"  {'stage':<24} {'count':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+        for name, stats in stages.items():
+            print(
+                f"  {name:<24} {stats['count']:>6} {stats['p50']:>9.1f} {stats['p90']:>9.1f} "
+                f"{stats['p99']:>9.1f} {stats['max']:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,17 +4,102 @@ import './App.css'
 // Replace with your actual Lambda URL
 const LAMBDA_URL = import.meta.env.VITE_LAMBDA_URL || 'YOUR_LAMBDA_URL_HERE'
 
+// Read server-sent events from a fetch response and hand each frame to onFrame
+async function readEventStream(response, onFrame) {
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+
+  const flushFrames = () => {
+    let boundary
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const rawFrame = buffer.slice(0, boundary)
+      buffer = buffer.slice(boundary + 2)
+
+      let event = 'message'
+      const dataLines = []
+      for (const line of rawFrame.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim()
+        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim())
+      }
+      if (dataLines.length) onFrame(event, JSON.parse(dataLines.join('\n')))
+    }
+  }
+
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+    flushFrames()
+  }
+  buffer += decoder.decode()
+  flushFrames()
+}
+
+// One study session per browser tab; the backend keeps its history under this id
+function getSessionId() {
+  let id = sessionStorage.getItem('studyBuddySessionId')
+  if (!id) {
+    id = crypto.randomUUID()
+    sessionStorage.setItem('studyBuddySessionId', id)
+  }
+  return id
+}
+
+// Sources come back with just what MessageBubble renders (no snippets); the
+// browser already asks for gzip/br responses through Accept-Encoding
+const SOURCE_FORMAT = 'compact'
+
+// On 429 (rate limited) or 503 (AI service busy) the backend says when to
+// come back; retry once if that is soon enough
+const MAX_RETRY_AFTER_SECONDS = 10
+
+async function postWithRetry(url, options, onWait) {
+  const response = await fetch(url, options)
+  if (response.status !== 429 && response.status !== 503) return response
+  const retryAfter = Number(response.headers.get('Retry-After')) || 1
+  if (retryAfter > MAX_RETRY_AFTER_SECONDS) return response
+  onWait(retryAfter)
+  await new Promise(resolve => setTimeout(resolve, retryAfter * 1000))
+  return fetch(url, options)
+}
+
+// "/plan <topic>" and "/practice <topic>" start a background job on the
+// backend; its sections fill in as they are written. Polling stops on a
+// 4xx answer (the job is unknown or expired) or after this many failures
+const MAX_JOB_POLL_FAILURES = 5
+const JOB_COMMANDS = {
+  '/plan': { type: 'study_plan', label: 'Study plan' },
+  '/practice': { type: 'practice_set', label: 'Practice set' },
+}
+
+function parseJobCommand(text) {
+  const [command, ...rest] = text.split(' ')
+  const job = JOB_COMMANDS[command.toLowerCase()]
+  const topic = rest.join(' ').trim()
+  return job && topic ? { ...job, topic } : null
+}
+
+function jobContent(label, topic, job) {
+  const written = job.sections.filter(s => s.status === 'done')
+  let header = `⏳ ${label} on "${topic}": ${job.progress.done}/${job.progress.total ?? '…'} sections ready`
+  if (job.status === 'done') header = `📋 ${label} on "${topic}"`
+  else if (job.status === 'failed') header = `⚠️ ${label} on "${topic}" stopped: ${job.error}`
+  return [header, ...written.map(s => `## ${s.title}\n\n${s.content}`)].join('\n\n')
+}
+
 function App() {
   const [messages, setMessages] = useState([
     {
       id: 1,
       role: 'assistant',
-      content: "Hi! I'm your AI tutor. Ask me anything and I'll explain it step-by-step with reliable sources.\n\n¡Hola! Soy tu tutor de IA. Pregúntame lo que quieras y te lo explicaré paso a paso con fuentes confiables.\n\n🌍 I automatically respond in your language!\n📸 You can also upload images/screenshots!",
+      content: "Hi! I'm your AI tutor. Ask me anything and I'll explain it step-by-step with reliable sources.\n\n¡Hola! Soy tu tutor de IA. Pregúntame lo que quieras y te lo explicaré paso a paso con fuentes confiables.\n\n🌍 I automatically respond in your language!\n📸 You can also upload images/screenshots!\n🗓️ Type /plan <topic> for a study plan or /practice <topic> for practice questions!",
       timestamp: new Date().toISOString()
     }
   ])
   const [input, setInput] = useState('')
   const [isLoading, setIsLoading] = useState(false)
+  const [isStreaming, setIsStreaming] = useState(false)
   const [selectedImage, setSelectedImage] = useState(null)
   const [imagePreview, setImagePreview] = useState(null)
   const [showUploadMenu, setShowUploadMenu] = useState(false)
@@ -52,6 +137,73 @@ function App() {
     }
   }
 
+  // Submit a job, then poll it in the background so the chat stays usable
+  const startJob = async (job) => {
+    const response = await postWithRetry(LAMBDA_URL, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({
+        job: { type: job.type, topic: job.topic },
+        session_id: getSessionId()
+      })
+    }, (seconds) => console.log(`⏳ Many students are asking right now, retrying in ${seconds}s`))
+    const submitted = await response.json().catch(() => ({}))
+    if (response.status !== 202) {
+      if (response.status === 429 || response.status === 503) {
+        throw Object.assign(new Error(submitted.message || submitted.error || 'Too many requests, please try again shortly'), { busy: true })
+      }
+      throw new Error(submitted.error || `HTTP ${response.status}`)
+    }
+    console.log('🗂️ Job submitted:', submitted.job_id)
+
+    const assistantId = Date.now() + 1
+    const updateAssistant = (changes) => setMessages(prev =>
+      prev.map(m => m.id === assistantId ? { ...m, ...changes } : m)
+    )
+    setMessages(prev => [...prev, {
+      id: assistantId,
+      role: 'assistant',
+      content: `⏳ ${job.label} on "${job.topic}": getting started...`,
+      timestamp: new Date().toISOString()
+    }])
+
+    let failures = 0
+    const poll = async () => {
+      try {
+        const statusResponse = await fetch(LAMBDA_URL, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ job_id: submitted.job_id, source_format: SOURCE_FORMAT })
+        })
+        const status = await statusResponse.json().catch(() => ({}))
+        if (!statusResponse.ok) {
+          const permanent = statusResponse.status >= 400 && statusResponse.status < 500 && statusResponse.status !== 429
+          throw Object.assign(new Error(status.error || `HTTP ${statusResponse.status}`), { permanent })
+        }
+        failures = 0
+        updateAssistant({
+          content: jobContent(job.label, job.topic, status),
+          sources: status.sources || [],
+          language: status.language || 'en'
+        })
+        if (status.status === 'done' || status.status === 'failed') return
+      } catch (error) {
+        // A failed poll is retried a few times; the job keeps running on the backend
+        console.error('❌ Job poll error:', error)
+        failures += 1
+        if (error.permanent || failures >= MAX_JOB_POLL_FAILURES) {
+          updateAssistant({
+            role: 'error',
+            content: `${job.label} on "${job.topic}": couldn't get its progress (${error.message}). Please try again later.`
+          })
+          return
+        }
+      }
+      setTimeout(poll, (submitted.poll_after_s || 2) * 1000)
+    }
+    setTimeout(poll, (submitted.poll_after_s || 2) * 1000)
+  }
+
   const sendMessage = async (e) => {
     e.preventDefault()
     
@@ -79,13 +231,22 @@ function App() {
     setIsLoading(true)
 
     try {
+      const job = !currentImage && parseJobCommand(currentInput)
+      if (job) {
+        await startJob(job)
+        return
+      }
+
       console.log('🚀 Sending request to:', LAMBDA_URL)
       console.log('📝 Query:', currentInput)
       console.log('🖼️ Has image:', !!currentImage)
 
       // Prepare request body
       const requestBody = {
-        prompt: currentInput || "Please analyze this image and explain what you see in detail."
+        prompt: currentInput || "Please analyze this image and explain what you see in detail.",
+        stream: true,
+        session_id: getSessionId(),
+        source_format: SOURCE_FORMAT
       }
 
       // Add image if present (convert to base64 without data URL prefix)
@@ -94,21 +255,52 @@ function App() {
         requestBody.image = base64Data
       }
 
-      const response = await fetch(LAMBDA_URL, {
+      const response = await postWithRetry(LAMBDA_URL, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Accept': 'text/event-stream, application/json',
         },
         body: JSON.stringify(requestBody)
-      })
+      }, (seconds) => console.log(`⏳ Many students are asking right now, retrying in ${seconds}s`))
 
       console.log('📥 Response status:', response.status)
 
       if (!response.ok) {
         const errorData = await response.json().catch(() => ({}))
+        if (response.status === 429 || response.status === 503) {
+          throw Object.assign(new Error(errorData.message || 'Too many requests, please try again shortly'), { busy: true })
+        }
         throw new Error(errorData.error || errorData.message || `HTTP ${response.status}`)
       }
 
+      const contentType = response.headers.get('Content-Type') || ''
+      if (contentType.includes('text/event-stream')) {
+        const assistantId = Date.now() + 1
+        const updateAssistant = (changes) => setMessages(prev =>
+          prev.map(m => m.id === assistantId ? { ...m, ...changes(m) } : m)
+        )
+
+        setMessages(prev => [...prev, {
+          id: assistantId,
+          role: 'assistant',
+          content: '',
+          sources: [],
+          metadata: {},
+          timestamp: new Date().toISOString()
+        }])
+        setIsStreaming(true)
+
+        await readEventStream(response, (event, data) => {
+          if (event === 'sources') updateAssistant(() => ({ sources: data }))
+          else if (event === 'delta') updateAssistant(m => ({ content: m.content + data.text }))
+          else if (event === 'metadata') updateAssistant(() => ({ metadata: data, language: data.language || 'en' }))
+          else if (event === 'error') throw new Error(data.error || 'Stream error')
+        })
+        console.log('✅ Stream complete')
+        return
+      }
+
       const data = await response.json()
       console.log('✅ Response data:', data)
 
@@ -130,13 +322,14 @@ function App() {
       const errorMessage = {
         id: Date.now() + 1,
         role: 'error',
-        content: `Error: ${error.message}. Please check:\n• Lambda URL is correct\n• Lambda is deployed and running\n• API Gateway trigger is configured\n• CORS is enabled`,
+        content: error.busy ? `⏳ ${error.message}` : `Error: ${error.message}. Please check:\n• Lambda URL is correct\n• Lambda is deployed and running\n• API Gateway trigger is configured\n• CORS is enabled`,
         timestamp: new Date().toISOString()
       }
 
       setMessages(prev => [...prev, errorMessage])
     } finally {
       setIsLoading(false)
+      setIsStreaming(false)
     }
   }
 
@@ -166,7 +359,7 @@ function App() {
             <MessageBubble key={msg.id} message={msg} />
           ))}
           
-          {isLoading && (
+          {isLoading && !isStreaming && (
             <div className="message assistant-message">
               <div className="message-avatar">🤖</div>
               <div className="message-content">
@@ -1,14 +1,32 @@
 import os
 import json
+import base64
+import gzip
+import re
+import threading
+import time
 import boto3
 import urllib.request
 import urllib.error
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Local knowledge base, when backend/kb_index.py and its kb.idx are packaged alongside
+try:
+    from kb_index import is_strong_recall, kb_search
+except ImportError:
+    kb_search = None
 
 # --------- env ---------
 INFERENCE_PROFILE_ARN = os.environ.get("INFERENCE_PROFILE_ARN", "").strip()
 SEARCH_PROVIDER       = os.environ.get("SEARCH_PROVIDER", "tavily").strip().lower()
 TAVILY_API_KEY        = os.environ.get("TAVILY_API_KEY", "").strip()
 NEWS_API_KEY          = os.environ.get("NEWS_API_KEY", "").strip()
+RETRIEVAL_MAX_SECONDS = float(os.environ.get("RETRIEVAL_MAX_SECONDS", "8"))
+GENERATION_RESERVE_S  = float(os.environ.get("GENERATION_RESERVE_SECONDS", "15"))
+BREAKER_THRESHOLD     = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_COOLDOWN_S    = float(os.environ.get("BREAKER_COOLDOWN_SECONDS", "30"))
+COMPRESS_MIN_BYTES    = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+EVENT_LOG_MAX_CHARS   = int(os.environ.get("EVENT_LOG_MAX_CHARS", "1024"))
 
 # --------- CORS helpers (fixes "Failed to fetch") ---------
 ALLOWED_ORIGINS = {
@@ -50,47 +68,216 @@ def _cors_headers(event):
         "Access-Control-Allow-Methods": "OPTIONS,POST,GET",
     }
 
+# --------- Response encoding ---------
+def _accepts_gzip(event) -> bool:
+    hdrs = event.get("headers") or {}
+    accept = hdrs.get("accept-encoding") or hdrs.get("Accept-Encoding") or ""
+    for part in accept.lower().split(","):
+        name, _, params = part.partition(";")
+        if name.strip() in ("gzip", "*"):
+            q = params.strip()
+            try:
+                return not q.startswith("q=") or float(q[2:]) > 0
+            except ValueError:
+                return False
+    return False
+
+def _compact_sources(sources: list) -> list:
+    """Only what the frontend renders: title and url, plus type and source for news"""
+    compacted = []
+    for s in sources:
+        entry = {"title": s.get("title", ""), "url": s.get("url", "")}
+        if s.get("type", "web") != "web":
+            entry["type"] = s["type"]
+        if s.get("source"):
+            entry["source"] = s["source"]
+        compacted.append(entry)
+    return compacted
+
+def _json_response(event, status: int, headers: dict, data: dict) -> dict:
+    """Dense JSON, gzipped (base64 for API Gateway) when the client accepts it and it is worth it"""
+    body = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+    headers = {**headers, "Content-Type": "application/json"}
+    raw = body.encode("utf-8", "replace")
+    if len(raw) < COMPRESS_MIN_BYTES or not _accepts_gzip(event):
+        return {"statusCode": status, "headers": headers, "body": body}
+    vary = headers.get("Vary")
+    headers.update({"Content-Encoding": "gzip", "Vary": f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"})
+    return {
+        "statusCode": status,
+        "headers": headers,
+        "body": base64.b64encode(gzip.compress(raw, 6)).decode("ascii"),
+        "isBase64Encoded": True,
+    }
+
 # --------- small HTTP helper ---------
-def _http_json(url: str, payload: dict, headers: dict) -> dict:
+def _http_json(url: str, payload: dict, headers: dict, timeout: float = 20) -> dict:
     req = urllib.request.Request(
         url,
         data=json.dumps(payload).encode("utf-8"),
         headers=headers,
         method="POST",
     )
-    with urllib.request.urlopen(req, timeout=20) as resp:
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
         return json.loads(resp.read().decode("utf-8"))
 
+# --------- Upstream guard: adaptive timeout + circuit breaker ---------
+class CircuitOpen(Exception):
+    pass
+
+class _Upstream:
+    """Recent latencies and breaker state for one upstream (per container)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.failures = 0
+        self.opened_at = None
+        self.timeout = None
+
+    def pick_timeout(self, ceiling: float) -> float:
+        # 1.5x the observed p99 once there are 20 samples, never below 1s
+        with self.lock:
+            if self.opened_at is not None or len(self.latencies) < 20:
+                return ceiling
+            p99 = sorted(self.latencies)[int(0.99 * (len(self.latencies) - 1))]
+        return max(1.0, min(ceiling, p99 * 1.5))
+
+    def call(self, fn, ceiling: float):
+        with self.lock:
+            if self.opened_at is not None and time.monotonic() - self.opened_at < BREAKER_COOLDOWN_S:
+                raise CircuitOpen(f"{self.name} circuit open")
+        self.timeout = self.pick_timeout(ceiling)
+        started = time.monotonic()
+        try:
+            result = fn(self.timeout)
+        except Exception as e:
+            with self.lock:
+                self.failures += 1
+                if isinstance(e, TimeoutError):
+                    self.latencies = (self.latencies + [self.timeout])[-200:]
+                if self.failures >= BREAKER_THRESHOLD or self.opened_at is not None:
+                    self.opened_at = time.monotonic()
+            raise
+        with self.lock:
+            self.latencies = (self.latencies + [time.monotonic() - started])[-200:]
+            self.failures = 0
+            self.opened_at = None
+        return result
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            state = "closed" if self.opened_at is None else "open"
+            return {"state": state, "failures": self.failures, "timeout_s": self.timeout}
+
+_UPSTREAMS = {"tavily": _Upstream("tavily"), "newsapi": _Upstream("newsapi")}
+
+# --------- Retrieval fan-out ---------
+_retrieval_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
+
+def _retrieval_budget(context) -> float:
+    """Seconds retrieval may spend, leaving room for the Bedrock call."""
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return RETRIEVAL_MAX_SECONDS
+    remaining = context.get_remaining_time_in_millis() / 1000.0
+    return max(1.0, min(RETRIEVAL_MAX_SECONDS, remaining - GENERATION_RESERVE_S))
+
+def _fan_out(providers: dict, deadline_s: float) -> dict:
+    """Run providers concurrently; late or failing ones fall back to their default."""
+    started = time.monotonic()
+    futures = {name: _retrieval_pool.submit(fn) for name, (fn, _) in providers.items()}
+    wait(list(futures.values()), timeout=deadline_s)
+
+    results, timed_out, failed, skipped = {}, [], [], []
+    for name, fut in futures.items():
+        fallback = providers[name][1]
+        if not fut.done():
+            fut.cancel()
+            timed_out.append(name)
+            print(f"⏱️ {name} missed the {deadline_s:.1f}s retrieval deadline")
+            results[name] = fallback
+            continue
+        try:
+            results[name] = fut.result()
+        except CircuitOpen as e:
+            print(f"⏭️ Skipping {name}: {str(e)}")
+            skipped.append(name)
+            results[name] = fallback
+        except Exception as e:
+            print(f"❌ {name} retrieval error: {str(e)}")
+            failed.append(name)
+            results[name] = fallback
+    return {
+        "results": results,
+        "timed_out": timed_out,
+        "failed": failed,
+        "skipped": skipped,
+        "elapsed_ms": int((time.monotonic() - started) * 1000),
+    }
+
 # --------- Language Detection ---------
+# Log-odds weights (positive = Spanish), compiled once per container. Whole
+# words only: 'es', 'la', 'de' and 'un' inside English words no longer count.
+_LANG_WORD_RE = re.compile(r"[a-záéíóúüñ']+")
+_LANG_WEIGHTS = {
+    **{w: 2.0 for w in (
+        "qué", "cómo", "cuál", "cuándo", "dónde", "quién", "por", "porque",
+        "el", "los", "las", "una", "es", "son", "está", "del", "para", "con",
+        "sin", "sobre", "entre", "yo", "tú", "él", "ella", "nosotros", "ustedes",
+        "explica", "explicar", "dime", "cuéntame", "ayuda", "ayúdame", "hola",
+        "gracias", "que", "cual", "como", "y", "en", "de", "la", "se", "al",
+        "lo", "más", "pero", "sus", "su", "mi", "muy", "hay", "tiene",
+    )},
+    **{w: -2.0 for w in (
+        "the", "of", "and", "to", "in", "is", "it", "you", "that", "was", "for",
+        "on", "are", "with", "as", "be", "at", "have", "this", "from", "or",
+        "by", "not", "but", "what", "can", "how", "why", "which", "do", "does",
+        "explain", "tell", "help", "please", "about", "between", "describe",
+        "who", "when", "where", "an", "my", "your", "their", "will",
+    )},
+    # Shared short words lean only slightly
+    "a": -0.3, "no": 0.3, "me": 0.3, "un": 1.0, "son": 0.5, "define": 0.0,
+}
+_SPANISH_LETTERS = frozenset("áéíóúñ¿¡")
+
+def _language_score(text: str, max_chars: int = 1200, max_words: int = 48) -> float:
+    """Single pass over at most max_words words; stops once the evidence is decisive."""
+    sample = (text or "")[:max_chars].lower()
+    score = 4.0 if ("¿" in sample or "¡" in sample) else 0.0
+    for n, match in enumerate(_LANG_WORD_RE.finditer(sample)):
+        if n >= max_words or abs(score) >= 8.0:
+            break
+        word = match.group()
+        weight = _LANG_WEIGHTS.get(word)
+        if weight is None:
+            weight = 1.5 if not _SPANISH_LETTERS.isdisjoint(word) else 0.0
+        score += weight
+    return score
+
 def detect_language(text: str) -> str:
     """
-    Simple language detection based on common words.
-    Returns 'es' for Spanish, 'en' for English
+    Word-frequency language detection.
+    Returns 'es' for Spanish, 'en' for English (the default)
     """
-    # Common Spanish words/patterns
-    spanish_indicators = [
-        'qué', 'cómo', 'cuál', 'cuándo', 'dónde', 'quién', 'por qué',
-        'el', 'la', 'los', 'las', 'un', 'una', 'es', 'son', 'está',
-        'de', 'del', 'para', 'con', 'sin', 'sobre', 'entre',
-        'yo', 'tú', 'él', 'ella', 'nosotros', 'ustedes',
-        'explica', 'explicar', 'dime', 'cuéntame', 'ayuda'
-    ]
-    
-    text_lower = text.lower()
-    
-    # Check for Spanish indicators
-    spanish_count = sum(1 for word in spanish_indicators if word in text_lower)
-    
-    # If we find Spanish words, it's Spanish
-    if spanish_count >= 1:
-        print(f"🌍 Language detected: Spanish (found {spanish_count} indicators)")
+    score = _language_score(text)
+    if score > 0.5:
+        print(f"🌍 Language detected: Spanish (score {score:.1f})")
         return 'es'
     
-    print(f"🌍 Language detected: English (default)")
+    print(f"🌍 Language detected: English (score {score:.1f})")
     return 'en'
 
+def detect_many(texts: list) -> list:
+    """Batch detection; repeated texts are scored once."""
+    seen = {}
+    for text in texts:
+        if text not in seen:
+            seen[text] = "es" if _language_score(text) > 0.5 else "en"
+    return [seen[text] for text in texts]
+
 # --------- Web search (Tavily) with language support ---------
-def tavily_search(query: str, language: str = 'en', max_results: int = 6) -> dict:
+def tavily_search(query: str, language: str = 'en', max_results: int = 6, timeout: float = 20) -> dict:
     if not TAVILY_API_KEY:
         print("⚠️ TAVILY_API_KEY not set - skipping web search")
         return {"results": [], "answer": None}
@@ -111,61 +298,58 @@ def tavily_search(query: str, language: str = 'en', max_results: int = 6) -> dic
         # Prioritize Spanish-language sources
         body["include_domains"] = ["es.wikipedia.org", ".es", ".mx", ".ar", ".co", ".cl"]
     
-    try:
-        data = _http_json(url, body, {"Content-Type": "application/json"})
-        results = []
-        for r in data.get("results", []):
-            results.append({
-                "type": "web",
-                "title": r.get("title") or r.get("url") or "Source",
-                "url": r.get("url", ""),
-                "snippet": (r.get("content") or "")[:400],
-            })
-        print(f"✅ Tavily search ({language}): found {len(results)} results")
-        return {"results": results, "answer": data.get("answer")}
-    except Exception as e:
-        print(f"❌ Tavily search error: {str(e)}")
-        return {"results": [], "answer": None}
+    # Errors propagate to _fan_out so the breaker sees them
+    data = _UPSTREAMS["tavily"].call(
+        lambda t: _http_json(url, body, {"Content-Type": "application/json"}, timeout=t), timeout
+    )
+    results = []
+    for r in data.get("results", []):
+        results.append({
+            "type": "web",
+            "title": r.get("title") or r.get("url") or "Source",
+            "url": r.get("url", ""),
+            "snippet": (r.get("content") or "")[:400],
+        })
+    print(f"✅ Tavily search ({language}): found {len(results)} results")
+    return {"results": results, "answer": data.get("answer")}
 
 # --------- News search (NewsAPI) ---------
-def news_search(query: str, max_results: int = 3) -> list:
+def news_search(query: str, max_results: int = 3, timeout: float = 10) -> list:
     if not NEWS_API_KEY:
         print("⚠️ NEWS_API_KEY not set - skipping news search")
         return []
     
-    try:
-        # Build URL with parameters
-        params = {
-            "q": query,
-            "apiKey": NEWS_API_KEY,
-            "sortBy": "publishedAt",  # Most recent first
-            "pageSize": max_results,
-            "language": "en"
-        }
-        query_string = "&".join([f"{k}={v}" for k, v in params.items()])
-        url = f"https://newsapi.org/v2/everything?{query_string}"
-        
-        req = urllib.request.Request(url)
-        with urllib.request.urlopen(req, timeout=10) as response:
-            data = json.loads(response.read().decode("utf-8"))
-        
-        results = []
-        for article in data.get("articles", [])[:max_results]:
-            results.append({
-                "type": "news",
-                "title": article.get("title", "Article"),
-                "url": article.get("url", ""),
-                "snippet": article.get("description", "")[:300],
-                "source": article.get("source", {}).get("name", "Unknown"),
-                "published": article.get("publishedAt", "")
-            })
-        
-        print(f"✅ News search: found {len(results)} articles")
-        return results
-        
-    except Exception as e:
-        print(f"❌ News search error: {str(e)}")
-        return []
+    # Build URL with parameters
+    params = {
+        "q": query,
+        "apiKey": NEWS_API_KEY,
+        "sortBy": "publishedAt",  # Most recent first
+        "pageSize": max_results,
+        "language": "en"
+    }
+    query_string = "&".join([f"{k}={v}" for k, v in params.items()])
+    url = f"https://newsapi.org/v2/everything?{query_string}"
+    
+    def fetch(t):
+        with urllib.request.urlopen(urllib.request.Request(url), timeout=t) as response:
+            return json.loads(response.read().decode("utf-8"))
+    
+    # Errors propagate to _fan_out so the breaker sees them
+    data = _UPSTREAMS["newsapi"].call(fetch, timeout)
+    
+    results = []
+    for article in data.get("articles", [])[:max_results]:
+        results.append({
+            "type": "news",
+            "title": article.get("title", "Article"),
+            "url": article.get("url", ""),
+            "snippet": (article.get("description") or "")[:300],
+            "source": article.get("source", {}).get("name", "Unknown"),
+            "published": article.get("publishedAt", "")
+        })
+    
+    print(f"✅ News search: found {len(results)} articles")
+    return results
 
 # --------- Bedrock response extractor ---------
 def extract_text_from_bedrock(payload: dict) -> str:
@@ -199,6 +383,26 @@ def extract_text_from_bedrock(payload: dict) -> str:
     return json.dumps(payload)[:1200]
 
 # --------- Prompt builder ---------
+# Fixed instructions go in the system prompt; only the sources and question in
+# the user message change per request. At about 200 tokens they are far below
+# Bedrock's prompt-cache minimum (1,024 tokens), so they carry no cache_control.
+TUTOR_SYSTEM = (
+    "IMPORTANT INSTRUCTIONS:\n"
+    "- You are a helpful AI tutor answering questions for students\n"
+    "- The student's message may start with CURRENT WEB SOURCES containing up-to-date information\n"
+    "- For questions about recent events, news, or current information: USE THE WEB SOURCES PROVIDED\n"
+    "- Trust the sources - they are from reliable websites and contain factual current information\n"
+    "- Answer directly based on what the sources say\n"
+    "- Cite sources using [1], [2], [3] etc.\n"
+    "- If sources have dates/timelines, include them in your answer\n"
+    "- Be clear, educational, and step-by-step\n"
+    "- If the question is about current events or recent news, prioritize the web sources over general knowledge\n"
+    "- Answer in the same language as the student's question\n"
+)
+
+def system_blocks() -> list:
+    return [{"type": "text", "text": TUTOR_SYSTEM}]
+
 def build_prompt(user_prompt: str, web_hits: list) -> str:
     lines = []
     if web_hits:
@@ -211,25 +415,30 @@ def build_prompt(user_prompt: str, web_hits: list) -> str:
                 lines.append(f"Content: {snip[:400]}")
         lines.append("\n=== END OF SOURCES ===\n")
 
-    lines.append(
-        "IMPORTANT INSTRUCTIONS:\n"
-        "- You are a helpful AI tutor answering questions for students\n"
-        "- The web sources above contain CURRENT, UP-TO-DATE information\n"
-        "- For questions about recent events, news, or current information: USE THE WEB SOURCES PROVIDED\n"
-        "- Trust the sources - they are from reliable websites and contain factual current information\n"
-        "- Answer directly based on what the sources say\n"
-        "- Cite sources using [1], [2], [3] etc.\n"
-        "- If sources have dates/timelines, include them in your answer\n"
-        "- Be clear, educational, and step-by-step\n"
-        "- If the question is about current events or recent news, prioritize the web sources over general knowledge\n"
-    )
     lines.append(f"\nStudent Question: {user_prompt}\n")
     lines.append("Your Answer:")
     return "\n".join(lines)
 
+# --------- Event logging ---------
+def _event_summary(event) -> dict:
+    """Size-capped event description for logs: no headers, body cut at EVENT_LOG_MAX_CHARS, images redacted"""
+    http = (event.get("requestContext") or {}).get("http") or {}
+    body = event.get("body")
+    summary = {
+        "method": http.get("method") or event.get("httpMethod"),
+        "path": event.get("rawPath") or event.get("path"),
+        "body_chars": len(body) if isinstance(body, str) else None,
+    }
+    if isinstance(body, str):
+        preview = body[:EVENT_LOG_MAX_CHARS]
+        if '"image"' in preview:
+            preview = preview[:preview.index('"image"')] + '"image": "<redacted>"…'
+        summary["body_preview"] = preview
+    return summary
+
 # --------- Main handler ---------
 def lambda_handler(event, context):
-    print(f"📥 Event received: {json.dumps(event)}")
+    print(f"📥 Event received: {json.dumps(_event_summary(event), ensure_ascii=False)}")
     
     headers = _cors_headers(event)
 
@@ -253,19 +462,29 @@ def lambda_handler(event, context):
 
     user_prompt = (body.get("prompt") or "").strip() or "Explain recursion in simple steps."
     print(f"📝 User prompt: {user_prompt}")
+    language = detect_language(user_prompt)
 
-    # Web retrieval - Get both web results AND news
-    web_results = {"results": [], "answer": None}
-    news_results = []
-    
-    if SEARCH_PROVIDER == "tavily":
-        web_results = tavily_search(user_prompt, max_results=5)
-    
-    # Also search news for current events
-    news_results = news_search(user_prompt, max_results=3)
+    # Local knowledge base first; strong recall replaces the web search
+    kb_hits = kb_search(user_prompt) if kb_search else []
+    kb_used = bool(kb_hits) and is_strong_recall(kb_hits)
+
+    # Web retrieval - web results AND news, concurrently under one deadline
+    budget = _retrieval_budget(context)
+    providers = {
+        "newsapi": (lambda: news_search(user_prompt, max_results=3, timeout=min(10, budget)), []),
+    }
+    if SEARCH_PROVIDER == "tavily" and not kb_used:
+        providers["tavily"] = (
+            lambda: tavily_search(user_prompt, language=language, max_results=5, timeout=min(20, budget)),
+            {"results": [], "answer": None},
+        )
+    retrieval = _fan_out(providers, budget)
+
+    web_results = retrieval["results"].get("tavily", {"results": [], "answer": None})
+    news_results = retrieval["results"]["newsapi"]
     
     # Combine all sources
-    all_sources = web_results.get("results", []) + news_results
+    all_sources = (kb_hits if kb_used else []) + web_results.get("results", []) + news_results
     context_block = build_prompt(user_prompt, all_sources)
 
     # Bedrock call
@@ -276,6 +495,7 @@ def lambda_handler(event, context):
         "anthropic_version": "bedrock-2023-05-31",
         "max_tokens": 1500,
         "temperature": 0.7,
+        "system": system_blocks(),
         "messages": [
             {
                 "role": "user",
@@ -287,21 +507,17 @@ def lambda_handler(event, context):
     try:
         if INFERENCE_PROFILE_ARN:
             print(f"Using inference profile: {INFERENCE_PROFILE_ARN}")
-            resp = client.invoke_model(
-                modelId=INFERENCE_PROFILE_ARN,
-                body=json.dumps(payload).encode("utf-8"),
-                accept="application/json",
-                contentType="application/json",
-            )
+            model_id = INFERENCE_PROFILE_ARN
         else:
             model_id = "us.anthropic.claude-3-5-sonnet-20241022-v2:0"
             print(f"Using model: {model_id}")
-            resp = client.invoke_model(
-                modelId=model_id,
-                body=json.dumps(payload).encode("utf-8"),
-                accept="application/json",
-                contentType="application/json",
-            )
+
+        resp = client.invoke_model(
+            modelId=model_id,
+            body=json.dumps(payload).encode("utf-8"),
+            accept="application/json",
+            contentType="application/json",
+        )
 
         model_json = json.loads(resp["body"].read().decode("utf-8"))
         answer_text = extract_text_from_bedrock(model_json).strip()
@@ -314,21 +530,25 @@ def lambda_handler(event, context):
         
     except Exception as e:
         print(f"❌ Bedrock error: {str(e)}")
-        return {
-            "statusCode": 500,
-            "headers": {**headers, "Content-Type": "application/json"},
-            "body": json.dumps({"error": f"Bedrock error: {str(e)}"}),
-        }
+        return _json_response(event, 500, headers, {"error": f"Bedrock error: {str(e)}"})
 
     response_body = {
         "answer": answer_text,
-        "sources": all_sources,  # Include both web and news sources
-        "trace": {"kb_used": False, "web_used": bool(all_sources)},
+        # Include both web and news sources; snippets only when the client shows them
+        "sources": _compact_sources(all_sources) if body.get("source_format") == "compact" else all_sources,
+        "language": language,
+        "trace": {
+            "kb_used": kb_used,
+            "kb_top_relevance": kb_hits[0]["relevance"] if kb_hits else None,
+            "web_used": bool(web_results.get("results") or news_results),
+            "retrieval_ms": retrieval["elapsed_ms"],
+            "providers_timed_out": retrieval["timed_out"],
+            "providers_failed": retrieval["failed"],
+            "providers_skipped": retrieval["skipped"],
+            "upstreams": {name: up.snapshot() for name, up in _UPSTREAMS.items()},
+            "usage": model_json.get("usage"),
+        },
     }
 
     print("✅ Returning successful response")
-    return {
-        "statusCode": 200,
-        "headers": {**headers, "Content-Type": "application/json"},
-        "body": json.dumps(response_body),
-    }
\ No newline at end of file
+    return _json_response(event, 200, headers, response_body)
\ No newline at end of file